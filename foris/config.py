@@ -15,14 +15,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
-import os
 import logging
 from urlparse import urlunsplit
 
 from bottle import Bottle, request, template
 import bottle
 
-from .core import gettext_dummy as gettext, make_notification_title, ugettext as _
+from .core import gettext_dummy as gettext, make_notification_title, ugettext as _, \
+    LONG_NUCI_DEADLINE
 from .config_handlers import *
 from .nuci import client
 from .nuci.client import filters
@@ -106,10 +106,12 @@ class WanConfigPage(ConfigPageMixin, WanHandler):
     menu_order = 12
 
     def render(self, **kwargs):
-        stats = client.get(filter=filters.stats).find_child("stats")
-        wan_if = stats.data['interfaces'].get(self.wan_ifname)
-        if not (wan_if and wan_if.get('is_up')):
-            messages.warning(_("WAN port has no link, your internet connection probably won't work."))
+        # link status is just a hint, skip it when Nuci is slow
+        stats = client.get_optional(filter=filters.stats)
+        if stats is not None:
+            wan_if = stats.find_child("stats").data['interfaces'].get(self.wan_ifname)
+            if not (wan_if and wan_if.get('is_up')):
+                messages.warning(_("WAN port has no link, your internet connection probably won't work."))
         return super(WanConfigPage, self).render(**kwargs)
 
 
@@ -154,14 +156,14 @@ class MaintenanceConfigPage(ConfigPageMixin, MaintenanceHandler):
 
     def _action_config_backup(self):
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        directory = "/tmp/foris_backups"
         filename = "turris-backup-%s.tar.bz2" % timestamp
-        # TODO: remove old backups, catch errors
-        if not os.path.isdir(directory):
-            os.mkdir(directory)
-        client.save_config_backup(os.path.join(directory, filename))
-        return bottle.static_file(filename, directory,
-                                  mimetype="application/x-bz2", download=True)
+        backup = client.get_config_backup()
+        if backup is None:
+            raise bottle.HTTPError(500, "Configuration backup failed.")
+        # backup was already decoded and checked, damaged one ends with the error above
+        bottle.response.content_type = "application/x-bz2"
+        bottle.response.set_header("Content-Disposition", 'attachment; filename="%s"' % filename)
+        return backup
 
     def _action_reboot(self):
         client.reboot()
@@ -409,11 +411,17 @@ class AboutConfigPage(ConfigPageMixin):
         return verbose
 
     def render(self, **kwargs):
-        stats = client.get(filter=filters.stats).find_child("stats")
-        serial = client.get_serial()
-        if not contract_valid():
-            foris_conf = client.get(filter=filters.create_config_filter("foris"))
-            agreed_opt = foris_conf.find_child("uci.foris.eula.agreed_collect")
+        contract_is_valid = contract_valid()
+        # independent RPCs - send the ones missing in the cache in a single batch
+        with client.batch() as batch:
+            stats = batch.get(filter=filters.stats)
+            serial = client.get_serial(batch=batch)
+            if not contract_is_valid:
+                foris_conf = batch.get(filter=filters.create_config_filter("foris"))
+        stats = stats.result().find_child("stats")
+        serial = serial.result()
+        if not contract_is_valid:
+            agreed_opt = foris_conf.result().find_child("uci.foris.eula.agreed_collect")
             kwargs['agreed_collect'] = agreed_opt and bool(int(agreed_opt.value))
         return self.default_template(stats=stats.data, serial=serial,
                                      translate_sending_status=self.translate_sending_status,
@@ -580,8 +588,9 @@ def init_app():
     app.route("/", name="config_index", callback=index)
     app.route("/notifications/dismiss", method="POST",
               callback=dismiss_notifications)
+    # connection check takes longer than the other actions
     app.route("/<page_name:re:.+>/ajax", name="config_ajax", method=("GET", "POST"),
-              callback=config_ajax)
+              callback=config_ajax, nuci_deadline=LONG_NUCI_DEADLINE)
     app.route("/<page_name:re:.+>/action/<action:re:.+>", method="POST",
               callback=config_action_post)
     app.route("/<page_name:re:.+>/action/<action:re:.+>", name="config_action",
@@ -219,29 +219,29 @@ class LanHandler(BaseConfigHandler):
             .requires("dhcp_enabled", True)
 
         def lan_form_cb(data):
-            uci = Uci()
-            config = Config("dhcp")
-            uci.add(config)
-
-            dhcp = Section("lan", "dhcp")
-            config.add(dhcp)
-            # FIXME: this would overwrite any unrelated DHCP options the user might have set.
-            # Maybe we should get the current values, scan them and remove selectively the ones
-            # with 6 in front of them? Or have some support for higher level of stuff in nuci.
+            # modify the fetched configuration, only the changed options are sent
+            uci = lan_form.fork_config()
+            dhcp = uci.add(Config("dhcp")).add(Section("lan", "dhcp"))
+
+            # replace the DNS server option (6), keep the unrelated DHCP options
+            current_options = dhcp.find_child("dhcp_option")
+            contents = [value.content for value in current_options.children
+                        if not value.content.startswith("6,")] \
+                if isinstance(current_options, List) else []
+            contents.append("6," + data['lan_ipaddr'])
             options = List("dhcp_option")
-            options.add(Value(0, "6," + data['lan_ipaddr']))
+            for index, content in enumerate(contents):
+                options.add(Value(index, content))
             dhcp.add_replace(options)
-            network = Config("network")
-            uci.add(network)
-            interface = Section("lan", "interface")
-            network.add(interface)
-            interface.add(Option("ipaddr", data['lan_ipaddr']))
+
+            interface = uci.add(Config("network")).add(Section("lan", "interface"))
+            interface.put(Option("ipaddr", data['lan_ipaddr']))
             if data['dhcp_enabled']:
-                dhcp.add(Option("ignore", "0"))
-                dhcp.add(Option("start", data['dhcp_min']))
-                dhcp.add(Option("limit", data['dhcp_max']))
+                dhcp.put(Option("ignore", "0"))
+                dhcp.put(Option("start", data['dhcp_min']))
+                dhcp.put(Option("limit", data['dhcp_max']))
             else:
-                dhcp.add(Option("ignore", "1"))
+                dhcp.put(Option("ignore", "1"))
 
             return "edit_config", uci
 
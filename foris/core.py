@@ -17,6 +17,7 @@
 
 # builtins
 import collections
+import functools
 import gettext
 import hashlib
 import logging
@@ -32,12 +33,13 @@ from ncclient.operations import TimeoutExpiredError, RPCError
 
 # local
 from . import __version__ as foris_version
-from .nuci import client, filters, cache
+from .nuci import client, deadline, filters
+from .nuci.exceptions import NuciUnavailableError
 from .nuci.modules.uci_raw import Uci, Config, Section, Option
 from .nuci.modules.user_notify import Severity
 from .langs import iso2to3, translation_names, translations, DEFAULT_LANGUAGE
 from .plugins import ForisPluginLoader
-from .utils import redirect_unauthenticated, is_safe_redirect, is_user_authenticated
+from .utils import redirect_unauthenticated, is_safe_redirect, is_user_authenticated, login_required
 from .utils.bottle_csrf import get_csrf_token, update_csrf_token, CSRFValidationError, CSRFPlugin
 from .utils import DEVICE_CUSTOMIZATION, messages, contract_valid
 from .utils.reporting_middleware import ReportingMiddleware
@@ -48,8 +50,14 @@ logger = logging.getLogger("foris")
 
 BASE_DIR = os.path.dirname(__file__)
 
-# init cache
-nuci_cache = cache.NuciCache()
+# time available for all the Nuci calls of a single request (in seconds),
+# can be changed for a route by its "nuci_deadline" config
+NUCI_DEADLINE = 30
+# deadline for routes calling long RPCs - e.g. NTP sync or connection check
+LONG_NUCI_DEADLINE = 75
+
+# cache shared by all the reads from Nuci
+nuci_cache = client.StaticNetconfConnection.get_cache()
 
 # internationalization
 i18n_defaults(bottle.SimpleTemplate, bottle.request)
@@ -338,6 +346,51 @@ def foris_403_handler(error):
     bottle.app().default_error_handler(error)
 
 
+def nuci_deadline_plugin(callback):
+    """
+    Plugin limiting time of all the Nuci calls done by the route - instead of
+    waiting for the timeout of every single call.
+    """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        seconds = bottle.request.route.config.get(
+            "nuci_deadline", bottle.default_app().config.get("nuci_deadline", NUCI_DEADLINE))
+        with deadline.scope(seconds):
+            return callback(*args, **kwargs)
+    return wrapper
+
+
+def nuci_unavailable_plugin(callback):
+    """
+    Plugin rendering an error page when Nuci is unavailable, instead of
+    waiting for it on every request.
+    """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        try:
+            return callback(*args, **kwargs)
+        except NuciUnavailableError as e:
+            logger.warning("Request failed fast: %s", e)
+            bottle.response.status = 503
+            if e.retry_after is not None:
+                bottle.response.set_header("Retry-After", str(int(e.retry_after) + 1))
+            if bottle.request.is_xhr:
+                return dict(success=False, nuciUnavailable=True)
+            return bottle.template("nuci_unavailable", reason=e.reason,
+                                   retry_after=e.retry_after)
+    return wrapper
+
+
+@login_required
+def nuci_status():
+    """
+    State of the connection to Nuci for monitoring, as JSON.
+    """
+    status = client.StaticNetconfConnection.get_status()
+    status["cache"] = nuci_cache.stats()
+    return status
+
+
 def clickjacking_protection():
     # we don't use frames at all, we can safely deny opening pages in frames
     bottle.response.headers['X-Frame-Options'] = 'DENY'
@@ -355,6 +408,24 @@ def disable_caching(authenticated_only=True):
         bottle.response.headers['Pragma'] = "no-cache"
 
 
+def reset_nuci_stats():
+    """
+    Hook for resetting per-request statistics of Nuci calls.
+    """
+    client.StaticNetconfConnection.get_stats().reset_local()
+
+
+def log_nuci_stats():
+    """
+    Hook for logging how much of the request latency was spent by Nuci calls.
+    """
+    totals = client.StaticNetconfConnection.get_stats().local_totals()
+    if totals['calls']:
+        logger.debug("%s %s: %d Nuci call(s), %.3f s waiting in queue, %.3f s executing",
+                     bottle.request.method, bottle.request.fullpath, totals['calls'],
+                     totals['wait'], totals['execution'])
+
+
 def make_notification_title(notification):
     """
     Helper function for creating of human-readable notification title.
@@ -389,6 +460,8 @@ def init_foris_app(app, prefix):
     """
     app.catchall = False  # caught by ReportingMiddleware
     app.error_handler[403] = foris_403_handler
+    app.install(nuci_unavailable_plugin)
+    app.install(nuci_deadline_plugin)
     app.add_hook('after_request', clickjacking_protection)
     app.add_hook('after_request', disable_caching)
     app.config['prefix'] = prefix
@@ -412,6 +485,15 @@ def get_arg_parser():
     group.add_argument("--noauth", action="store_true",
                        help="disable authentication (available only in debug mode)")
     group.add_argument("--nucipath", help="path to Nuci binary")
+    group.add_argument("--nuci-deadline", type=int, default=NUCI_DEADLINE,
+                       help="time available for Nuci calls of a single request (in seconds)")
+    group.add_argument("--shared-nuci-cache", nargs="?", metavar="PATH",
+                       const="/var/run/foris/nuci-cache.sqlite",
+                       help="share cached Nuci data with other Foris processes "
+                            "(e.g. flup or CGI) through an SQLite database in a private directory")
+    group.add_argument("--uci-files", nargs="?", metavar="DIR", const="/etc/config",
+                       help="read uci configuration directly from the UCI files "
+                            "in DIR (changes are still made through Nuci)")
     parser.add_argument("-R", "--routes", action="store_true", help="print routes and exit")
     group.add_argument(
         "-S", "--static", action="store_true",
@@ -438,6 +520,7 @@ def init_default_app(include_static=False):
     if include_static:
         app.route('/static/<filename:re:.*>', name="static", callback=static)
     app.route("/js/<filename:re:.*>", name="render_js", callback=render_js)
+    app.route("/nuci-status", name="nuci_status", callback=nuci_status)
     return app
 
 
@@ -470,6 +553,8 @@ def prepare_main_app(args):
             logger.warning("authentication disabled")
             app.config["no_auth"] = True
 
+    app.config["nuci_deadline"] = args.nuci_deadline
+
     # set custom app attributes for main app and all mounted apps
     init_foris_app(app, None)
     for route in app.routes:
@@ -478,9 +563,29 @@ def prepare_main_app(args):
             prefix = route.config['mountpoint.prefix']
             init_foris_app(mounted, prefix)
 
+    # hooks of the main app are called also for requests to the mounted apps
+    app.add_hook('before_request', reset_nuci_stats)
+    app.add_hook('after_request', log_nuci_stats)
+
     if args.nucipath:
         client.StaticNetconfConnection.set_bin_path(args.nucipath)
 
+    if args.shared_nuci_cache:
+        try:
+            from .nuci.shared_cache import SharedCache
+            nuci_cache.set_shared(SharedCache(args.shared_nuci_cache))
+        except ImportError:
+            logger.warning("SQLite is not available, Nuci cache is not shared.")
+        except Exception:
+            logger.exception("Unable to open shared Nuci cache, Nuci cache is not shared.")
+
+    if args.uci_files:
+        client.StaticNetconfConnection.enable_uci_files(args.uci_files)
+
+    if args.server != "cgi" and not args.routes:
+        # long running server - keep fresh Nuci sessions ready in background
+        client.StaticNetconfConnection.enable_session_rotation()
+
     # load Foris plugins before applying Bottle plugins to app
     loader = ForisPluginLoader(app)
     loader.autoload_plugins()
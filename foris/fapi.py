@@ -23,6 +23,7 @@ from bottle import MultiDict
 from form import InputWithArgs, Dropdown, Form, Checkbox, websafe, Hidden, Radio
 from nuci import client
 from nuci.configurator import add_config_update, commit
+from nuci.modules.uci_raw import Uci, uci_diff, uci_paths
 from nuci.utils import LocalizableTextValue
 from utils import Lazy
 import validators as validators_module
@@ -95,6 +96,14 @@ class ForisForm(ForisFormElement):
         self.validated = False
         # _nuci_config is not required every time, lazy-evaluate it
         self._nuci_config = Lazy(lambda: client.get(filter))
+        self._filter = filter
+        # uci paths contained completely in the configuration fetched for the form
+        if filter is None:
+            self._fetched_paths = [""]
+        elif filter.tag == Uci.qual_tag(Uci.tag):
+            self._fetched_paths = uci_paths(filter)
+        else:
+            self._fetched_paths = []
         self.requirement_map = defaultdict(list)  # mapping: requirement -> list of required_by
         self.callbacks = []
         self.callback_results = {}  # name -> result
@@ -103,6 +112,17 @@ class ForisForm(ForisFormElement):
     def nuci_config(self):
         return self._nuci_config
 
+    def fork_config(self):
+        """Get copy-on-write fork of the uci configuration fetched for the form.
+
+        Callbacks can modify it and return it in edit_config, only the modified
+        options are sent then. nuci_config is not affected by the modifications.
+
+        :return: Uci instance
+        """
+        uci = self.nuci_config.find_child("uci")
+        return uci.fork() if uci is not None else Uci()
+
     @property
     def data(self):
         """
@@ -259,8 +279,40 @@ class ForisForm(ForisFormElement):
         """
         self.callbacks.append(cb)
 
+    def _current_config(self):
+        """Get the current configuration covered by the form's filter.
+
+        It's read again, bypassing the cache, because nuci_config may be outdated
+        when the configuration was changed outside of Foris (e.g. by uci command).
+        Errors are not handled here, the changes can't be sent safely without it.
+
+        :return: Uci instance, None if there's no uci data
+        """
+        return client.get_fresh(self._filter).find_child("uci")
+
+    def _config_changes(self, uci, current, changed_paths):
+        """Get changes of the current configuration made by `uci`.
+
+        :param uci: Uci tree returned by an edit_config callback
+        :param current: current Uci tree (see _current_config()), None if not known
+        :param changed_paths: uci paths changed by the previous callbacks, they're extended
+        :return: Uci tree with the changes, None if nothing would change
+        """
+        if type(uci) is not Uci:
+            return uci
+        # the parts of forks of nuci_config which weren't accessed are not changed
+        fetched = self._nuci_config.value
+        origin = fetched.find_child("uci") if fetched is not None else None
+        changeset = uci_diff(current, uci, self._fetched_paths, changed_paths, origin)
+        if not changeset.children:
+            return None
+        changed_paths.extend(uci_paths(changeset.get_xml()))
+        return changeset
+
     def process_callbacks(self, form_data):
         logger.debug("Processing callbacks")
+        changed_paths = []
+        current, current_fetched = None, False
         for cb in self.callbacks:
             logger.debug("Processing callback: %s", cb)
             cb_result = cb(form_data)
@@ -274,6 +326,15 @@ class ForisForm(ForisFormElement):
                     self.callback_results[k] = v
             elif operation == "edit_config":
                 data = cb_result[1:] if len(cb_result) > 1 else ()
+                if data:
+                    # send only the options which were actually changed
+                    if not current_fetched:
+                        current, current_fetched = self._current_config(), True
+                    update = self._config_changes(data[0], current, changed_paths)
+                    if update is None:
+                        logger.debug("Callback %s doesn't change the configuration.", cb)
+                        continue
+                    data = (update, ) + data[1:]
                 add_config_update(*data)
             else:
                 raise NotImplementedError("Unsupported callback operation: %s" % operation)
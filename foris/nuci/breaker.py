@@ -0,0 +1,134 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import random
+import threading
+from time import time
+
+from .exceptions import NuciUnavailableError
+
+logger = logging.getLogger("nuci.breaker")
+
+
+def backoff_delay(attempt, base, maximum, jitter=0.5):
+    """Compute exponential backoff delay with a random jitter.
+
+    :param attempt: number of the attempt, starting from 0
+    :param base: delay of the first attempt (in seconds)
+    :param maximum: upper bound of the delay without the jitter (in seconds)
+    :param jitter: relative size of the random part of the delay
+    :return: delay in seconds
+    """
+    delay = min(base * 2 ** attempt, maximum)
+    return delay * (1 + random.uniform(-jitter, jitter))
+
+
+class CircuitBreaker(object):
+    """Circuit breaker guarding the connection to Nuci.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    all the calls fail fast with NuciUnavailableError. After a backoff
+    delay the circuit becomes half-open - a single trial call is let
+    through, its success closes the circuit, its failure opens it again
+    with a doubled delay.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, base_delay=1, max_delay=60):
+        """
+        :param failure_threshold: number of consecutive failures opening the circuit
+        :param base_delay: delay before the first trial call (in seconds)
+        :param max_delay: maximum delay before a trial call (in seconds)
+        """
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._openings = 0  # consecutive openings of the circuit, for the backoff
+        self._retry_at = None
+        self._trial_running = False
+        self._last_failure = None
+        self._last_failure_time = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def before_call(self):
+        """Check whether a call may proceed.
+
+        :raises: NuciUnavailableError if the circuit is open
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            now = time()
+            if self._state == self.OPEN and now >= self._retry_at:
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                logger.info("Nuci circuit half-open, trying the connection.")
+                self._trial_running = True
+                return
+            raise NuciUnavailableError(self._last_failure, max(self._retry_at - now, 0))
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.warning("Nuci connection restored, circuit closed.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._openings = 0
+            self._trial_running = False
+
+    def record_cancelled(self):
+        """Record a call which was let through but didn't contact Nuci at all."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self, reason):
+        """Record a failed call.
+
+        :param reason: exception or a message describing the failure
+        """
+        with self._lock:
+            self._failures += 1
+            self._last_failure = str(reason) or type(reason).__name__
+            self._last_failure_time = time()
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                delay = backoff_delay(self._openings, self.base_delay, self.max_delay)
+                self._openings += 1
+                self._state = self.OPEN
+                self._retry_at = time() + delay
+                self._trial_running = False
+                logger.error("Nuci circuit opened for %.1f s: %s", delay, self._last_failure)
+
+    def status(self):
+        """Get the state of the circuit for monitoring.
+
+        :return: dict with keys state, failures, last_failure, last_failure_time, retry_at
+        """
+        with self._lock:
+            return dict(state=self._state, failures=self._failures,
+                        last_failure=self._last_failure,
+                        last_failure_time=self._last_failure_time,
+                        retry_at=self._retry_at if self._state != self.CLOSED else None)
@@ -15,86 +15,673 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+import threading
+import Queue
 
-from datetime import datetime, timedelta
+from collections import OrderedDict
 
-from .client import netconf
-from .filters import create_uci_filter
-from .modules.uci_raw import Uci
+from .modules.base import YinElement
+from .singleflight import SingleFlight
 
 logger = logging.getLogger("nuci.cache")
 
+CLOCK_MONOTONIC = 1  # clock id on Linux
+
+
+def _clock_gettime():
+    """Get clock_gettime() of libc, None if it's not available."""
+    try:
+        import ctypes
+    except ImportError:
+        return None
+
+    class Timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    try:
+        clock_gettime = ctypes.CDLL(None).clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+    def get_time():
+        timespec = Timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)):
+            raise OSError("clock_gettime() failed")
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    return get_time
 
-class NuciCache(object):
-    """Nuci caching class
 
-    It is used for explicit caching of values.
+_monotonic = _clock_gettime()
+
+
+def monotonic():
+    """Monotonic clock (in seconds).
+
+    Python 2 has no monotonic clock, CLOCK_MONOTONIC is read through ctypes.
+    Elapsed real time of os.times() is used when ctypes is not installed - note
+    that it has resolution of 10 ms and it wraps after ~248 days of uptime on
+    32-bit systems (clock_t overflows), the entries may then expire early or late.
     """
+    if _monotonic is not None:
+        return _monotonic()
+    return os.times()[4]
+
 
-    results = {}
+def _hand_out(value):
+    """Get a value which can be given to a caller - cached trees are forked,
+    so the caller's modifications don't change the cached ones.
     """
-    records look like this
-    'uci.foris.settings' : {
-        'stored': datetime(year=2017,month=1,day=1,hour=0,minute=0,second=0),
-        'data': YinElement
-    }
+    return value.fork() if isinstance(value, YinElement) else value
+
+
+# marker of a cache miss
+MISSING = object()
+
+
+def path_segments(path):
+    """Split uci path to segments.
+
+    The path is cut before the first anonymous section (e.g. "firewall.@zone[0]"),
+    its name can't be matched to the real name of the section.
+
+    :param path: uci path, empty for the whole uci
+    :return: list of segments
     """
+    segments = []
+    for segment in path.split(".") if path else []:
+        if segment.startswith("@"):
+            break
+        segments.append(segment)
+    return segments
 
-    def invalidate(self, path):
-        """ Invalidates cache parts
 
-        :param path: uci path which should be invalidated in cache
+class _TrieNode(object):
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+
+
+class PathTrie(object):
+    """Index of cache keys by segments of uci paths.
+
+    Lookups cost O(length of the path + number of matched keys), regardless
+    of the number of the indexed keys.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, path, key):
+        node = self.root
+        for segment in path_segments(path):
+            node = node.children.setdefault(segment, _TrieNode())
+        node.keys.add(key)
+
+    def remove(self, path, key):
+        nodes = [self.root]
+        for segment in path_segments(path):
+            node = nodes[-1].children.get(segment)
+            if node is None:
+                return
+            nodes.append(node)
+        nodes[-1].keys.discard(key)
+        # prune the branch which is empty now
+        segments = path_segments(path)
+        while len(nodes) > 1 and not nodes[-1].keys and not nodes[-1].children:
+            nodes.pop()
+            del nodes[-1].children[segments[len(nodes) - 1]]
+
+    def _find(self, path):
+        node = self.root
+        for segment in path_segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def under(self, path):
+        """Get keys indexed by the path or by any path under it.
+
+        :param path: uci path, empty for the whole uci
+        :return: generator of keys
+        """
+        node = self._find(path)
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            for key in node.keys:
+                yield key
+            stack.extend(node.children.values())
+
+    def above(self, path):
+        """Get keys indexed by the paths containing the path, the path itself excluded.
+
+        :param path: uci path, empty for the whole uci
+        :return: generator of keys
+        """
+        node = self.root
+        for segment in path_segments(path):
+            for key in node.keys:
+                yield key
+            node = node.children.get(segment)
+            if node is None:
+                return
+
+
+class CacheEntry(object):
+    def __init__(self, value, namespaces, size, ttl, paths=None, path=None, age=0):
+        """
+        :param value: cached value
+        :param namespaces: namespaces (e.g. "uci", "stats") the value belongs to
+        :param size: approximate size of the value (in bytes)
+        :param ttl: time to live (in seconds), None for no expiration
+        :param paths: uci paths contained in the value, None if unknown
+        :param path: uci path of the value, only for entries created by get()
+        :param age: age of the value (in seconds)
+        """
+        self.value = value
+        self.namespaces = frozenset(namespaces)
+        self.size = size
+        self.stored = monotonic() - age
+        self.expires = self.stored + ttl if ttl is not None else None
+        self.paths = tuple(paths) if paths is not None else None
+        self.path = path
+
+    def overdue(self, now, max_age=None):
+        """Get time since the value became outdated.
+
+        :param now: current time of the monotonic clock
+        :param max_age: value older than this is outdated too (in seconds)
+        :return: seconds since the value is outdated, negative for valid values
+        """
+        overdue = now - self.expires if self.expires is not None else float("-inf")
+        if max_age is not None:
+            overdue = max(overdue, now - self.stored - max_age)
+        return overdue
+
+    @property
+    def indexed_paths(self):
+        """Uci paths the entry is indexed by - the whole uci if the paths are unknown."""
+        if "uci" not in self.namespaces:
+            return ()
+        return self.paths if self.paths is not None else ("", )
+
+
+class NuciCache(object):
+    """Cache of data read from Nuci, with TTLs given by the namespaces
+    of the data and bounded both in number of entries and in bytes - the least
+    recently used entries are evicted first.
+
+    Entries are keyed by the canonical form of the request (e.g. serialized
+    filter of <get>), the data of "uci" namespace are also invalidated when
+    the configuration is changed by Foris.
+    """
+
+    # time to live of the namespaces (in seconds), None for no expiration,
+    # data of namespaces not listed here are not cached - uci data expire too,
+    # the configuration can be changed outside of Foris (uci command, LuCI, updater)
+    DEFAULT_TTLS = {
+        "uci": 5,
+        "stats": 5,
+        "updater": 2,
+        "messages": 10,
+        "registration": 3600,
+    }
+
+    def __init__(self, max_entries=256, max_bytes=2 * 1024 * 1024, ttls=None):
+        """
+        :param max_entries: maximum number of entries
+        :param max_bytes: maximum approximate size of all the entries (in bytes)
+        :param ttls: dict overriding DEFAULT_TTLS
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # least recently used first
+        self._index = PathTrie()  # keys of uci entries by the paths of their data
+        self._bytes = 0
+        # incremented by every invalidation, so data loaded meanwhile aren't stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        # keys of stale entries being refreshed in the background
+        self._refreshing = set()
+        self._refresher = None
+        # concurrent loads of the same missing entry share a single one
+        self._loads = SingleFlight("cache")
+        # SharedCache of uci data, if enabled
+        self.shared = None
+        self._shared_generation = None
+        self.shared_hits = 0
+
+    def ttl_for(self, namespaces):
+        """Get time to live of data belonging to the namespaces.
+
+        :return: TTL in seconds (None for no expiration) or False if the data can't be cached
+        """
+        ttl = None
+        for namespace in namespaces:
+            if namespace not in self.ttls:
+                return False
+            namespace_ttl = self.ttls[namespace]
+            if namespace_ttl is not None:
+                ttl = namespace_ttl if ttl is None else min(ttl, namespace_ttl)
+        return ttl
+
+    def lookup(self, key, max_age=None):
+        """Get a cached value.
+
+        :param key: key of the entry
+        :param max_age: ignore entries older than this (in seconds)
+        :return: cached value or MISSING
+        """
+        value = self._lookup(key, max_age)[0]
+        return value if value is MISSING else _hand_out(value)
+
+    def _lookup(self, key, max_age=None, max_stale=0):
+        """Get a cached value, possibly an outdated one.
+
+        :param key: key of the entry
+        :param max_age: ignore entries older than this (in seconds)
+        :param max_stale: return values outdated for less than this (in seconds)
+        :return: tuple (cached value or MISSING, True if the value is outdated)
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING, False
+            overdue = entry.overdue(now, max_age)
+            if overdue >= max_stale:
+                if entry.overdue(now) >= 0:
+                    self._remove(key)
+                    self.expirations += 1
+                self.misses += 1
+                return MISSING, False
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            if overdue >= 0:
+                self.stale_hits += 1
+                return entry.value, True
+            self.hits += 1
+            return entry.value, False
+
+    def store(self, key, value, namespaces, size, ttl=False, paths=None, path=None,
+              generation=None, shared_generation=None, age=0):
+        """Store a value in the cache.
+
+        :param key: key of the entry
+        :param value: value to store
+        :param namespaces: namespaces the value belongs to
+        :param size: approximate size of the value (in bytes)
+        :param ttl: time to live, derived from the namespaces if False
+        :param paths: uci paths contained in the value, None if unknown
+        :param path: uci path of the value, only for entries created by get()
+        :param generation: generation of the cache when the loading of the value started
+        :param shared_generation: generation of the shared cache when the loading started,
+                                  the value is stored to the shared cache if it's given
+        :param age: age of the value (in seconds)
+        :return: True if the value was stored
+        """
+        if ttl is False:
+            ttl = self.ttl_for(namespaces)
+            if ttl is False:
+                return False
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                # invalidated while the value was being loaded
+                return False
+            if key in self._entries:
+                self._remove(key)
+            entry = CacheEntry(value, namespaces, size, ttl, paths, path, age)
+            self._entries[key] = entry
+            for indexed_path in entry.indexed_paths:
+                self._index.add(indexed_path, key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        if self.shared is not None and shared_generation is not None \
+                and entry.namespaces == frozenset(["uci"]):
+            self.shared.store(key, value, size, entry.indexed_paths, path, shared_generation)
+        return True
+
+    def set_shared(self, shared):
+        """Share the uci data with the other processes.
+
+        :param shared: SharedCache instance, None to stop sharing
+        """
+        self.shared = shared
+        self._shared_generation = shared.generation() if shared is not None else None
+
+    def _sync_shared(self):
+        """Drop the local uci entries if the shared ones were invalidated by another process.
+
+        :return: current generation of the shared cache, None if it's not used
+        """
+        if self.shared is None:
+            return None
+        generation = self.shared.generation()
+        if generation != self._shared_generation:
+            self._remove_matching(lambda entry: "uci" in entry.namespaces)
+            self._shared_generation = generation
+        return generation
+
+    def _lookup_shared(self, key, namespaces, max_age=None):
+        """Get a value from the shared cache and store it locally.
+
+        :return: value or MISSING
+        """
+        if self.shared is None or frozenset(namespaces) != frozenset(["uci"]):
+            return MISSING
+        generation = self._generation
+        record = self.shared.load(key)
+        if record is None:
+            return MISSING
+        value, size, paths, path, age = record
+        if max_age is not None and age >= max_age:
+            return MISSING
+        self.store(key, value, namespaces, size, paths=paths, path=path,
+                   generation=generation, age=age)
+        self.shared_hits += 1
+        return value
+
+    def _invalidate_shared(self, paths, keep_above=False):
+        if self.shared is None:
+            return
+        expected = self._shared_generation
+        generation = self.shared.invalidate(paths, keep_above)
+        if generation is not None and expected is not None and generation == expected + 1:
+            # nobody else invalidated the shared cache meanwhile
+            self._shared_generation = generation
+
+    def get_or_load(self, key, namespaces, load, paths=None, max_stale=0):
+        """Get a cached value or load it and store it if it can be cached.
+
+        :param key: key of the entry
+        :param namespaces: namespaces the value belongs to
+        :param load: function returning tuple (value, approximate size in bytes)
+        :param paths: uci paths contained in the value, None if unknown
+        :param max_stale: return values outdated for less than this (in seconds)
+                          right away and refresh them in the background
+        :return: value
+        """
+        if self.ttl_for(namespaces) is False:
+            return load()[0]
+
+        shared = "uci" in namespaces and self.shared is not None
+
+        def reload():
+            generation = self._generation
+            shared_generation = self._sync_shared() if shared else None
+            value, size = load()
+            self.store(key, value, namespaces, size, paths=paths, generation=generation,
+                       shared_generation=shared_generation)
+            return value
+
+        if shared:
+            self._sync_shared()
+        value, stale = self._lookup(key, max_stale=max_stale)
+        if value is MISSING and shared:
+            value = self._lookup_shared(key, namespaces, self.ttl_for(namespaces))
+        if value is MISSING:
+            # only the first caller stores the value, all of them get their own fork of it
+            return _hand_out(self._loads.do(key, reload))
+        if stale:
+            self._refresh(key, reload)
+        return _hand_out(value)
+
+    def get_or_load_many(self, entries, load):
+        """Same as get_or_load() for several values at once - all the missing ones
+        are loaded by a single call of load (e.g. by a batch of RPCs).
+
+        :param entries: list of tuples (key, namespaces, paths, max_stale),
+                        entries with None key are always loaded and never cached
+        :param load: function getting list of indexes of the missing entries and returning
+                     list of tuples (value, approximate size in bytes, exception or None)
+        :return: list of tuples (value, exception or None)
+        """
+        def reload(indexes):
+            generation = self._generation
+            shared = any("uci" in entries[index][1] for index in indexes)
+            shared_generation = self._sync_shared() if shared else None
+            loaded = load(indexes)
+            for index, (value, size, error) in zip(indexes, loaded):
+                key, namespaces, paths, _ = entries[index]
+                if key is not None and error is None:
+                    self.store(key, value, namespaces, size, paths=paths, generation=generation,
+                               shared_generation=shared_generation)
+            return [(value, error) for value, _, error in loaded]
+
+        def refresh(index):
+            error = reload([index])[0][1]
+            if error is not None:
+                raise error
+
+        results = [None] * len(entries)
+        missing = []
+        for index, (key, namespaces, paths, max_stale) in enumerate(entries):
+            if key is None or self.ttl_for(namespaces) is False:
+                missing.append(index)
+                continue
+            shared = "uci" in namespaces and self.shared is not None
+            if shared:
+                self._sync_shared()
+            value, stale = self._lookup(key, max_stale=max_stale)
+            if value is MISSING and shared:
+                value = self._lookup_shared(key, namespaces, self.ttl_for(namespaces))
+            if value is MISSING:
+                missing.append(index)
+                continue
+            if stale:
+                self._refresh(key, lambda index=index: refresh(index))
+            results[index] = (value, None)
+
+        if missing:
+            keys = tuple(entries[index][0] for index in missing)
+            if None in keys:
+                # uncached entries can't be shared, they may even change something
+                loaded = reload(missing)
+            else:
+                # concurrent loads of the same missing entries share a single one
+                loaded = self._loads.do(("many", ) + keys, lambda: reload(missing))
+            for index, result in zip(missing, loaded):
+                results[index] = result
+        return [(_hand_out(value) if error is None else None, error)
+                for value, error in results]
+
+    def _refresh(self, key, reload):
+        """Reload an outdated value in the background, unless it's already being reloaded."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+            if self._refresher is None:
+                self._refresher = CacheRefresher(self._refreshed)
+                self._refresher.start()
+        self._refresher.tasks.put((key, reload))
+
+    def _refreshed(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def _remove(self, key):
+        """Remove entry - must hold the lock."""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for indexed_path in entry.indexed_paths:
+            self._index.remove(indexed_path, key)
+        return entry
+
+    def _remove_keys(self, keys):
+        """Remove entries - must hold the lock."""
+        keys = set(keys)
+        for key in keys:
+            self._remove(key)
+        self.invalidations += len(keys)
+        self._generation += 1
+        return len(keys)
+
+    def _remove_matching(self, predicate):
+        with self._lock:
+            return self._remove_keys(
+                [key for key, entry in self._entries.items() if predicate(entry)])
+
+    def invalidate_namespace(self, namespace):
+        """Remove all the entries belonging to a namespace.
+
+        :param namespace: namespace to invalidate, None for all the namespaces
         """
+        if namespace is None:
+            removed = self._remove_matching(lambda entry: True)
+        else:
+            removed = self._remove_matching(lambda entry: namespace in entry.namespaces)
+        if namespace in (None, "uci"):
+            self._invalidate_shared(None)
+        logger.debug("%d records of %s namespace invalidated in cache", removed,
+                     namespace or "any")
+
+    def clear(self):
+        self.invalidate_namespace(None)
+
+    def invalidate(self, path):
+        """Invalidate cache parts under an uci path.
 
+        Entries stored by get() with uci path starting with `path` are removed,
+        other uci entries are removed if they can contain data of the path.
+
+        :param path: uci path which should be invalidated in cache, empty for all
+        """
         if not path:
-            # remove all records
-            self.results = {}
+            self.invalidate_namespace("uci")
+            return
 
-        self.results = {k: v for k, v in self.results.items() if not k.startswith(path)}
+        with self._lock:
+            keys = list(self._index.under(path))
+            # entries of get() containing the path are kept
+            keys.extend(key for key in self._index.above(path)
+                        if self._entries[key].path is None)
+            removed = self._remove_keys(keys)
+        self._invalidate_shared([path], keep_above=True)
+        logger.debug("%d records for %s invalidated in cache", removed, path)
 
-        logger.debug("records for %s invalidated in cache" % path)
+    def invalidate_paths(self, paths):
+        """Invalidate all the entries which can contain data of the modified uci paths.
 
-    def get(self, nuci_path, cache_valid_period):
-        """ Get the record from the cache
+        :param paths: list of modified uci paths (see uci_raw.uci_paths())
+        """
+        paths = list(paths)
+        with self._lock:
+            keys = []
+            for path in paths:
+                keys.extend(self._index.under(path))
+                keys.extend(self._index.above(path))
+            removed = self._remove_keys(keys)
+        self._invalidate_shared(paths)
+        logger.debug("%d records for %s invalidated in cache", removed, ", ".join(paths))
 
-        the old records are reobtained from nuci
+    def keys_under(self, path):
+        """Get keys of the cached entries with uci data under the path.
 
-        :param nuci_path: filter used to obtain the cache
+        :param path: uci path, empty for the whole uci
+        :return: list of keys
+        """
+        with self._lock:
+            return list(self._index.under(path))
+
+    def get(self, nuci_path, cache_valid_period, max_stale=0):
+        """Get uci subtree from the cache, load it from Nuci if it's not cached
+        or if it's too old.
+
+        :param nuci_path: uci path of the subtree
         :type nuci_path: str
         :param cache_valid_period: older records are reloaded (in seconds), 0 means always reload
         :type cache_valid_period: int
+        :param max_stale: records older than cache_valid_period by less than this are returned
+                          right away and reloaded in the background (in seconds)
+        :type max_stale: int
 
          :returns: uci tree
          :rtype: YinElement
         """
+        key = ("uci-path", nuci_path)
+        if cache_valid_period:
+            self._sync_shared()
+            value, stale = self._lookup(key, max_age=cache_valid_period, max_stale=max_stale)
+            if value is MISSING and self._lookup_shared(
+                    key, ("uci", ), cache_valid_period + max_stale) is not MISSING:
+                value, stale = self._lookup(key, max_age=cache_valid_period,
+                                            max_stale=max_stale)
+            if value is not MISSING:
+                logger.debug("uci path %s was loaded from cache", nuci_path)
+                if stale:
+                    self._refresh(key, lambda: self._load_path(nuci_path))
+                return _hand_out(value)
+        return _hand_out(self._load_path(nuci_path))
 
-        # try to return cached data
-        if cache_valid_period and nuci_path in self.results:
-            if self.results[nuci_path]['stored'] >= \
-                    datetime.now() - timedelta(seconds=cache_valid_period):
+    def _load_path(self, nuci_path):
+        key = ("uci-path", nuci_path)
+        from .client import load_uci_path
+        generation = self._generation
+        shared_generation = self._sync_shared()
+        data, size = load_uci_path(nuci_path)
+        if data is None:
+            logger.debug("failed to load uci path %s for caching", nuci_path)
+            return None
+        self.store(key, data, ("uci",), size, ttl=None, paths=[nuci_path], path=nuci_path,
+                   generation=generation, shared_generation=shared_generation)
+        logger.debug("uci path %s loaded for caching", nuci_path)
+        return data
 
-                logger.debug("uci path %s was loaded from cache" % nuci_path)
-                return self.results[nuci_path]['data']
+    def stats(self):
+        """Get counters and size of the cache.
 
-        # create record
-        splitted = nuci_path.split(".")
-        if len(splitted) == 1:
-            config, section, option = splitted[0], None, None
-        elif len(splitted) == 2:
-            config, section = splitted
-            option = None
-        else:
-            config, section, option = splitted
+        :return: dict
+        """
+        with self._lock:
+            return dict(entries=len(self._entries), bytes=self._bytes, hits=self.hits,
+                        misses=self.misses, evictions=self.evictions,
+                        expirations=self.expirations, invalidations=self.invalidations,
+                        stale_hits=self.stale_hits, refreshes=self.refreshes,
+                        shared_hits=self.shared_hits, shared=self.shared is not None)
 
-        data = netconf.get(filter=("subtree", create_uci_filter(config, section, option))).data_ele
-        uci_elem = data.find(Uci.qual_tag("uci"))
-        if not uci_elem:
-            logger.debug("failed to load uci path %s for caching" % nuci_path)
-            return None
 
-        data = Uci.from_element(data.find(Uci.qual_tag("uci")))
-        self.results[nuci_path] = {'data': data, 'stored': datetime.now()}
+class CacheRefresher(threading.Thread):
+    """Daemon thread reloading outdated cache entries."""
 
-        logger.debug("uci path %s loaded for caching" % nuci_path)
+    def __init__(self, done):
+        """
+        :param done: callable called with the key of the entry after every reload
+        """
+        super(CacheRefresher, self).__init__(name="nuci-cache-refresher")
+        self.daemon = True
+        self.done = done
+        self.tasks = Queue.Queue()
 
-        return data
+    def run(self):
+        while True:
+            key, reload = self.tasks.get()
+            try:
+                reload()
+            except Exception:
+                logger.exception("Refresh of cached Nuci data failed.")
+            finally:
+                self.done(key)
+                # tasks.join() waits for the refreshes
+                self.tasks.task_done()
@@ -13,8 +13,11 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import bz2
 import logging
 import shlex
+import threading
+from io import BytesIO
 from time import sleep, time
 from xml.etree import cElementTree as ET
 
@@ -25,11 +28,17 @@ from ncclient.operations import RPCError
 from ncclient.operations.errors import TimeoutExpiredError
 from ncclient.transport import TransportError
 
-from . import filters
+from . import deadline, filters
+from .breaker import CircuitBreaker, backoff_delay
+from .cache import NuciCache
 from .exceptions import ConfigRestoreError
 from .modules import (maintain, network, password as password_module, registration,
                       stats, time as time_module, uci_raw, updater, user_notify)
 from .modules.base import Data, YinElement
+from .pool import PooledSession, SessionPool, SessionRotator
+from .request_queue import RequestQueue, RequestStats
+from .singleflight import SingleFlight
+from .uci_files import UciFileReader, UciParseError
 from .utils import LocalizableTextValue
 
 logger = logging.getLogger("nuci.client")
@@ -39,32 +48,74 @@ class StaticNetconfConnection(object):
     """
     Static connection to Netconf/Nuci, kept open during the whole run
     of Foris. Same API as ncclient's Manager class.
+
+    Operations modifying the configuration are serialized on a single
+    designated session, read-only operations are executed concurrently
+    on sessions leased from a pool.
     """
     BIN_PATH = "/usr/bin/nuci"
 
-    # recycle session if older than MAXIMUM_SESSION_LIFE seconds
+    # recycle sessions older than MAXIMUM_SESSION_LIFE seconds
     MAXIMUM_SESSION_LIFE = 300
 
     # maximum retries for reconnection if NETCONF server dies unexpectedly
     MAXIMUM_CONNECTION_RETRIES = 3
+    # first delay between the retries (in seconds), doubled with every retry
+    RETRY_BASE_DELAY = 0.1
+
+    # bounds of the pool of sessions used for read-only operations
+    READ_POOL_MIN_SIZE = 1
+    READ_POOL_MAX_SIZE = 3
+    # close surplus pooled sessions idle for more than READ_POOL_IDLE_TIMEOUT seconds
+    READ_POOL_IDLE_TIMEOUT = 60
+
+    # when session rotation is enabled, replacement sessions are spawned in
+    # the background SESSION_ROTATION_LEAD seconds before the old ones expire
+    SESSION_ROTATION_LEAD = 30
+    SESSION_ROTATION_INTERVAL = 10
+
+    # operations that can be executed on the pooled sessions
+    READ_ONLY_OPERATIONS = (operations.Get, operations.GetConfig)
+
+    # dispatched RPCs which don't modify anything, the cache is kept after them
+    READ_ONLY_RPCS = frozenset([
+        registration.RegNum.qual_tag("get"),
+        registration.Serial.qual_tag("serial"),
+        registration.RegistrationStatus.qual_tag("get-status"),
+        network.Connection.qual_tag("check"),
+        maintain.Maintain.qual_tag("config-backup"),
+    ])
 
     # instance of singleton
     _inst = None
 
     # Manager properties
-    _session = None
+    _session = None  # PooledSession used for the operations modifying the config
     _timeout = 30
     _async_mode = False
     _raise_mode = operations.RaiseMode.ALL
 
-    # flag for lock during command execution
-    _executing = False
+    # statistics of all the commands sent to Nuci
+    _stats = RequestStats()
+
+    # FIFO queue serializing the commands sent to the write session
+    _queue = RequestQueue("nuci", _stats)
+
+    # pool of sessions for read-only operations, created on the first use
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    # cache of the data read from Nuci
+    _cache = NuciCache()
 
-    # when to restart the current persistent session
-    session_kill_time = 0
+    # fails the calls fast when Nuci keeps failing
+    _breaker = CircuitBreaker(failure_threshold=MAXIMUM_CONNECTION_RETRIES + 1)
 
-    # remaining connection retries counter
-    remaining_connection_retries = MAXIMUM_CONNECTION_RETRIES
+    # background thread rotating the sessions, if enabled
+    _rotator = None
+
+    # reader of the UCI files used instead of Nuci for reading uci, if enabled
+    _uci_files = None
 
     __metaclass__ = OpExecutor
 
@@ -78,48 +129,332 @@ class StaticNetconfConnection(object):
         return cls._inst
 
     @classmethod
-    def reset_connection_retries(cls):
-        cls.remaining_connection_retries = cls.MAXIMUM_CONNECTION_RETRIES
+    def _spawn_session(cls):
+        session = transport.StdIOSession(Capabilities(CAPABILITIES))
+        session.connect(path=shlex.split(cls.BIN_PATH))
+        return session
 
     @classmethod
     def _connect(cls):
-        if cls._session is not None:
-            cls._session.close()
-        session = transport.StdIOSession(Capabilities(CAPABILITIES))
-        session.connect(path=shlex.split(cls.BIN_PATH))
-        cls._session = session
+        """(Re)connect the write session and drop all the pooled sessions."""
+        cls._connect_write_session()
+        cls.get_pool().clear()
+        cls._cache.clear()
+
+    @classmethod
+    def get_pool(cls):
+        """Get pool of sessions used for read-only operations.
+
+        :return: SessionPool instance
+        """
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = SessionPool(cls._spawn_session,
+                                        min_size=cls.READ_POOL_MIN_SIZE,
+                                        max_size=cls.READ_POOL_MAX_SIZE,
+                                        idle_timeout=cls.READ_POOL_IDLE_TIMEOUT,
+                                        max_age=cls.MAXIMUM_SESSION_LIFE,
+                                        stats=cls._stats)
+            return cls._pool
+
+    @classmethod
+    def get_cache(cls):
+        """Get cache of the data read from Nuci.
+
+        :return: NuciCache instance
+        """
+        return cls._cache
+
+    @classmethod
+    def _invalidate_cache(cls, klass, args, kwargs):
+        """Drop the cached data an operation could have changed."""
+        if issubclass(klass, cls.READ_ONLY_OPERATIONS):
+            return
+        if issubclass(klass, operations.EditConfig):
+            config = kwargs.get("config", args[1] if len(args) > 1 else None)
+            cls._cache.invalidate_paths(_edited_paths(config))
+        elif issubclass(klass, operations.Dispatch) and args \
+                and getattr(args[0], "tag", None) in cls.READ_ONLY_RPCS:
+            return
+        else:
+            cls._cache.clear()
 
     @classmethod
     def execute(cls, klass, *args, **kwargs):
-        while cls._executing:
-            sleep(0.1)
-        cls._executing = True
+        timeout = kwargs.pop("timeout", cls._timeout)
+        if issubclass(klass, cls.READ_ONLY_OPERATIONS):
+            return cls._with_retries(cls._execute_read, klass, timeout, *args, **kwargs)
+        with cls._queue.request(klass.__name__):
+            try:
+                return cls._with_retries(cls._execute_write, klass, timeout, *args, **kwargs)
+            finally:
+                cls._invalidate_cache(klass, args, kwargs)
+
+    @classmethod
+    def _with_retries(cls, func, *args, **kwargs):
+        """Call func, try it again after a short delay if the NETCONF server dies.
+
+        :raises: NuciUnavailableError if the circuit breaker is open
+        """
+        for attempt in range(cls.MAXIMUM_CONNECTION_RETRIES + 1):
+            if attempt:
+                sleep(backoff_delay(attempt - 1, cls.RETRY_BASE_DELAY, cls._timeout))
+            cls._breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except (IOError, TransportError) as e:
+                cls._breaker.record_failure(e)
+                logger.exception("Connection to NETCONF failed.")
+                error = e
+                continue
+            except deadline.DeadlineExceeded:
+                # Nuci wasn't contacted at all
+                cls._breaker.record_cancelled()
+                raise
+            except TimeoutExpiredError as e:
+                if deadline.passed():
+                    # the timeout was shortened by the caller's deadline, not Nuci's failure
+                    cls._breaker.record_cancelled()
+                else:
+                    cls._breaker.record_failure(e)
+                raise
+            except RPCError:
+                # Nuci is alive and replied, just the operation failed
+                cls._breaker.record_success()
+                raise
+            except Exception as e:
+                cls._breaker.record_failure(e)
+                raise
+            cls._breaker.record_success()
+            return result
+        # Fail with an error, next call will try to reconnect again
+        logger.critical("Unable to revive the NETCONF server.")
+        raise error
+
+    @classmethod
+    def _request(cls, pooled, klass, timeout, *args, **kwargs):
+        timeout = deadline.budget(timeout)
         try:
-            if cls._session is None or time() > cls.session_kill_time:
-                cls._connect()
-                cls.session_kill_time = time() + cls.MAXIMUM_SESSION_LIFE
-            timeout = kwargs.pop("timeout", cls._timeout)
-            result = klass(cls._session,
-                           async=cls._async_mode,
-                           timeout=timeout,
-                           raise_mode=cls._raise_mode).request(*args, **kwargs)
-            # Everything OK, reset retries counter
-            cls.reset_connection_retries()
-        except (IOError, TransportError) as e:
-            if cls.remaining_connection_retries <= 0:
-                # Fail with an error...
-                logger.critical("Unable to revive the NETCONF server.")
-                # ... but make it possible to reconnect in the next call
-                cls.reset_connection_retries()
-                raise e
-            logger.exception("Connection to NETCONF failed, retrying.")
-            cls.remaining_connection_retries -= 1
+            return klass(pooled.session,
+                         async=cls._async_mode,
+                         timeout=timeout,
+                         raise_mode=cls._raise_mode).request(*args, **kwargs)
+        except (IOError, TransportError):
+            pooled.broken = True
+            raise
+
+    @classmethod
+    def _execute_read(cls, klass, timeout, *args, **kwargs):
+        with cls.get_pool().lease(klass.__name__) as pooled:
+            return cls._request(pooled, klass, timeout, *args, **kwargs)
+
+    @classmethod
+    def _execute_write(cls, klass, timeout, *args, **kwargs):
+        """Execute the operation on the write session.
+
+        Must be called only when the request has its turn in the queue.
+        """
+        return cls._request(cls._get_write_session(), klass, timeout, *args, **kwargs)
+
+    @classmethod
+    def _get_write_session(cls):
+        """Get the write session, reconnect it if it's dead or too old.
+
+        Must be called only when the request has its turn in the queue and it was let
+        through the circuit breaker (the trial call of half-open circuit reconnects too).
+        """
+        session = cls._session
+        if session is None or session.broken or not session.connected \
+                or session.age > cls.MAXIMUM_SESSION_LIFE:
+            cls._connect_write_session()
+        return cls._session
+
+    @classmethod
+    def _connect_write_session(cls):
+        if cls._session is not None:
+            cls._session.close()
             cls._session = None
-            cls._executing = False
-            return cls.execute(klass, *args, **kwargs)
-        finally:
-            cls._executing = False
-        return result
+        cls._session = PooledSession(cls._spawn_session())
+
+    @classmethod
+    def enable_session_rotation(cls):
+        """Start a background thread spawning the sessions before the old ones expire,
+        so the requests don't have to wait for Nuci to start.
+        """
+        if cls._rotator is None:
+            cls._rotator = SessionRotator(cls.rotate_sessions, cls.SESSION_ROTATION_INTERVAL)
+            cls._rotator.start()
+
+    @classmethod
+    def enable_uci_files(cls, directory="/etc/config"):
+        """Read uci configuration directly from the UCI files instead of asking Nuci.
+
+        The configuration is still modified only through Nuci.
+
+        :param directory: directory with the UCI files
+        """
+        cls._uci_files = UciFileReader(directory)
+
+    @classmethod
+    def disable_uci_files(cls):
+        cls._uci_files = None
+
+    @classmethod
+    def get_uci_files(cls):
+        """Get reader of the UCI files.
+
+        :return: UciFileReader instance, None if the direct reading is disabled
+        """
+        return cls._uci_files
+
+    @classmethod
+    def disable_session_rotation(cls):
+        if cls._rotator is not None:
+            cls._rotator.stop()
+            cls._rotator = None
+
+    @classmethod
+    def rotate_sessions(cls):
+        """Replace the sessions which are about to expire with newly spawned ones.
+
+        The replacement of the write session is spawned outside the queue and swapped
+        in when it gets its turn, so no request in progress uses the old session
+        when it's closed.
+        """
+        if cls._breaker.state != CircuitBreaker.CLOSED:
+            # leave the reconnection to the requests going through the breaker
+            return
+        session = cls._session
+        if session is None or session.broken or not session.connected \
+                or session.age > cls.MAXIMUM_SESSION_LIFE - cls.SESSION_ROTATION_LEAD:
+            fresh = PooledSession(cls._spawn_session())
+            with cls._queue.request("rotation"):
+                old, cls._session = cls._session, fresh
+            if old is not None:
+                logger.debug("Rotated write Nuci session (age %.1f s).", old.age)
+                old.close()
+        cls.get_pool().rotate(cls.SESSION_ROTATION_LEAD)
+
+    @classmethod
+    def execute_batch(cls, calls, timeout=None):
+        """Send several operations back to back over a single session, then collect
+        all the replies.
+
+        :param calls: list of tuples (operation class, args, kwargs)
+        :param timeout: timeout for the whole batch
+        :return: list of tuples (reply, exception), in the order of calls
+        """
+        timeout = timeout or cls._timeout
+        label = "batch of %d operations" % len(calls)
+        if all(issubclass(klass, cls.READ_ONLY_OPERATIONS) for klass, _, _ in calls):
+            def execute_read():
+                with cls.get_pool().lease(label) as pooled:
+                    return cls._pipeline(pooled, calls, timeout)
+            return cls._with_retries(execute_read)
+
+        def execute_write():
+            return cls._pipeline(cls._get_write_session(), calls, timeout)
+
+        with cls._queue.request(label):
+            try:
+                return cls._with_retries(execute_write)
+            finally:
+                for klass, args, kwargs in calls:
+                    cls._invalidate_cache(klass, args, kwargs)
+
+    @classmethod
+    def _pipeline(cls, pooled, calls, timeout):
+        timeout = deadline.budget(timeout)
+        try:
+            rpcs = [klass(pooled.session, async=True, timeout=timeout,
+                          raise_mode=cls._raise_mode).request(*args, **kwargs)
+                    for klass, args, kwargs in calls]
+        except (IOError, TransportError):
+            pooled.broken = True
+            raise
+        expires = time() + timeout
+        results = []
+        for rpc in rpcs:
+            rpc.event.wait(max(expires - time(), 0))
+            reply, error = cls._collect_reply(rpc)
+            if isinstance(error, (IOError, TransportError)):
+                pooled.broken = True
+            results.append((reply, error))
+        return results
+
+    @classmethod
+    def send_async(cls, klass, *args, **kwargs):
+        """Send an operation without waiting for its reply.
+
+        The session is released as soon as the RPC is sent, it's held open
+        until unhold() is called on it though - this must be done once the reply
+        is collected (see foris.nuci.futures).
+
+        :param klass: operation class
+        :return: tuple (PooledSession, asynchronous RPC)
+        """
+        timeout = kwargs.pop("timeout", cls._timeout)
+
+        def send(pooled):
+            try:
+                rpc = klass(pooled.session, async=True, timeout=deadline.budget(timeout),
+                            raise_mode=cls._raise_mode).request(*args, **kwargs)
+            except (IOError, TransportError):
+                pooled.broken = True
+                raise
+            pooled.hold()
+            return pooled, rpc
+
+        if issubclass(klass, cls.READ_ONLY_OPERATIONS):
+            def send_read():
+                with cls.get_pool().lease(klass.__name__) as pooled:
+                    return send(pooled)
+            return cls._with_retries(send_read)
+
+        # the replies are delivered in the order of the RPCs, so the modifications
+        # stay serialized even when the queue is left right after sending
+        with cls._queue.request(klass.__name__):
+            try:
+                return cls._with_retries(lambda: send(cls._get_write_session()))
+            finally:
+                # the reply hasn't arrived yet, but the modification is already in progress
+                cls._invalidate_cache(klass, args, kwargs)
+
+    @classmethod
+    def _collect_reply(cls, rpc):
+        """Get reply of an asynchronous RPC, same checks as in ncclient's synchronous RPC.
+
+        :return: tuple (reply, exception)
+        """
+        if not rpc.event.is_set():
+            return None, TimeoutExpiredError("ncclient timed out while waiting for an rpc reply.")
+        if rpc.error:
+            # error that prevented reply delivery
+            return None, rpc.error
+        reply = rpc.reply
+        reply.parse()
+        if reply.error is not None:
+            if cls._raise_mode == operations.RaiseMode.ALL or \
+                    (cls._raise_mode == operations.RaiseMode.ERRORS
+                     and reply.error.type == "error"):
+                return None, reply.error
+        return reply, None
+
+    @classmethod
+    def get_status(cls):
+        """Get state of the connection to Nuci for monitoring.
+
+        :return: dict, see CircuitBreaker.status()
+        """
+        return cls._breaker.status()
+
+    @classmethod
+    def get_stats(cls):
+        """Get timing statistics of the commands sent to Nuci.
+
+        :return: RequestStats instance
+        """
+        return cls._stats
 
     @classmethod
     def set_bin_path(cls, path):
@@ -130,9 +465,12 @@ class StaticNetconfConnection(object):
         :return: None
         """
         cls.BIN_PATH = path
+        # sessions spawned from the old binary must not be used anymore
+        cls.get_pool().clear()
         if cls._session:
             # reconnect to new binary
-            cls._connect()
+            with cls._queue.request("reconnect"):
+                cls._connect()
 
     @classmethod
     def enable_test_environment(cls, path):
@@ -152,23 +490,321 @@ class StaticNetconfConnection(object):
 netconf = StaticNetconfConnection()
 
 
-def get(filter=None):
-    data = netconf.get(filter=("subtree", filter) if filter is not None else None).data_ele
+# parsers of the top-level elements of <get> reply data
+_GET_REPLY_PARSERS = {
+    uci_raw.Uci.qual_tag("uci"): uci_raw.Uci.from_element,
+    time_module.Time.qual_tag("time"): time_module.Time.from_element,
+    updater.Updater.qual_tag("updater"): updater.Updater.from_element,
+    stats.Stats.qual_tag("stats"): stats.Stats.from_element,
+    user_notify.UserNotify.qual_tag("messages"): user_notify.Messages.from_element,
+}
+
+
+def _parse_get_reply(reply):
+    """Parse data of <get> reply from its raw XML.
+
+    The raw XML string is kept by ncclient (reply.xml), but its element tree
+    is never built as a whole - every top-level subtree of <data> is converted
+    as soon as it's read and its elements are freed right after that.
+    """
+    raw = reply.xml
+    if isinstance(raw, unicode):
+        raw = raw.encode("utf-8")
     reply_data = Data()
-    for elem in data.iter():
-        if elem.tag == uci_raw.Uci.qual_tag("uci"):
-            reply_data.add(uci_raw.Uci.from_element(elem))
-        elif elem.tag == time_module.Time.qual_tag("time"):
-            reply_data.add(time_module.Time.from_element(elem))
-        elif elem.tag == updater.Updater.qual_tag("updater"):
-            reply_data.add(updater.Updater.from_element(elem))
-        elif elem.tag == stats.Stats.qual_tag("stats"):
-            reply_data.add(stats.Stats.from_element(elem))
-        elif elem.tag == user_notify.UserNotify.qual_tag("messages"):
-            reply_data.add(user_notify.Messages.from_element(elem))
+    depth = 0
+    data = None
+    for event, elem in ET.iterparse(BytesIO(raw), events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 2:
+                data = elem
+            continue
+        if depth == 3:
+            # <rpc-reply><data><subtree/>
+            parser = _GET_REPLY_PARSERS.get(elem.tag)
+            if parser:
+                reply_data.add(parser(elem))
+            data.remove(elem)
+        depth -= 1
     return reply_data
 
 
+# cache namespaces of the top-level elements of <get> reply data
+_GET_NAMESPACES = {
+    uci_raw.Uci.qual_tag("uci"): "uci",
+    time_module.Time.qual_tag("time"): "time",
+    updater.Updater.qual_tag("updater"): "updater",
+    stats.Stats.qual_tag("stats"): "stats",
+    user_notify.Messages.qual_tag("messages"): "messages",
+}
+
+# concurrent gets of everything share a single RPC, each of them gets its own fork
+# of the reply, so they can modify it (the cached ones are coalesced by the cache)
+_get_flights = SingleFlight("get", share=lambda result: (result[0].fork(), result[1]))
+
+
+def _get_uncached(filter):
+    """Get data from Nuci, bypassing the cache.
+
+    :return: tuple (Data instance, size of the reply)
+    """
+    reply = netconf.get(filter=("subtree", filter) if filter is not None else None)
+    return _parse_get_reply(reply), len(reply.xml)
+
+
+def _get_from_uci_files(filter):
+    """Get uci data from the UCI files, if it's enabled and possible.
+
+    :return: Data instance, None if the data must be read from Nuci
+    """
+    uci_files = netconf.get_uci_files()
+    if uci_files is None or filter is None or filter.tag != uci_raw.Uci.qual_tag("uci"):
+        return None
+    try:
+        return uci_files.get(filter)
+    except UciParseError:
+        logger.exception("Unable to read UCI files, asking Nuci instead.")
+        return None
+
+
+def _get_cache_entry(filter):
+    """Get cache entry of <get> with the filter.
+
+    :return: tuple (key, namespaces, uci paths), key is None if it's not worth caching
+    """
+    if filter is None:
+        # everything - not worth caching
+        return None, (), None
+    # ElementTree sorts the attributes, so equal filters are serialized equally
+    namespaces = (_GET_NAMESPACES.get(filter.tag, filter.tag), )
+    paths = uci_raw.uci_paths(filter) if namespaces == ("uci", ) else None
+    return ("get", ET.tostring(filter)), namespaces, paths
+
+
+def get(filter=None):
+    data = _get_from_uci_files(filter)
+    if data is not None:
+        return data
+
+    key, namespaces, paths = _get_cache_entry(filter)
+    if key is None:
+        return _get_flights.do(key, lambda: _get_uncached(filter))[0]
+    return netconf.get_cache().get_or_load(key, namespaces,
+                                           lambda: _get_uncached(filter), paths)
+
+
+def get_fresh(filter=None):
+    """Same as get(), but the data are always read again, bypassing the cache.
+
+    :return: Data instance
+    """
+    data = _get_from_uci_files(filter)
+    if data is not None:
+        return data
+    return _get_uncached(filter)[0]
+
+
+def load_uci_path(nuci_path):
+    """Get uci subtree from Nuci, bypassing the cache.
+
+    :param nuci_path: uci path of the subtree, e.g. "foris.settings.lang"
+    :return: tuple (Uci instance or None if the path doesn't exist, size of the reply)
+    """
+    config, section, option = (nuci_path.split(".", 2) + [None, None])[:3]
+    filter = filters.create_uci_filter(config, section, option)
+    data = _get_from_uci_files(filter)
+    if data is not None:
+        uci = data.find_child("uci")
+        return uci if uci.children else None, 0
+    reply = netconf.get(filter=("subtree", filter))
+    uci_elem = reply.data_ele.find(uci_raw.Uci.qual_tag("uci"))
+    if not uci_elem:
+        return None, 0
+    return uci_raw.Uci.from_element(uci_elem), len(reply.xml)
+
+
+def get_optional(filter=None, min_budget=5):
+    """Same as get(), for data the page can do without - None is returned
+    instead of waiting when the request is running out of time.
+
+    :param filter: filter of the data
+    :param min_budget: don't even try if less than this is left until the deadline (in seconds)
+    :return: Data instance or None
+    """
+    if not deadline.allows(min_budget):
+        logger.debug("Skipping optional Nuci get, deadline is too close.")
+        return None
+    try:
+        return get(filter)
+    except TimeoutExpiredError:
+        logger.warning("Optional Nuci get timed out.")
+        return None
+
+
+# marker of BatchResult without a default value
+_NO_DEFAULT = object()
+
+
+class BatchResult(object):
+    """Result of a single RPC sent in an RPCBatch."""
+
+    def __init__(self, parse=None, default=_NO_DEFAULT):
+        """
+        :param parse: function converting the reply to the result
+        :param default: returned instead of raising RPCError or TimeoutExpiredError
+        """
+        self._parse = parse
+        self._default = default
+        self._reply = None
+        self._error = None
+        self._done = False
+
+    @property
+    def done(self):
+        return self._done
+
+    def _resolve(self, reply, error, parsed=False):
+        """
+        :param parsed: the reply was parsed already (e.g. it was taken from the cache)
+        """
+        if parsed:
+            self._parse = None
+        self._reply, self._error, self._done = reply, error, True
+
+    def result(self):
+        """Get result of the RPC.
+
+        :return: parsed reply
+        :raises: exception of the RPC - e.g. RPCError, TimeoutExpiredError
+        """
+        if not self._done:
+            raise ValueError("Batch has not been executed yet.")
+        if self._error is not None:
+            if self._default is not _NO_DEFAULT \
+                    and isinstance(self._error, (RPCError, TimeoutExpiredError)):
+                return self._default
+            raise self._error
+        if self._parse:
+            # parse only once, result is shared by the following calls
+            self._reply, self._parse = self._parse(self._reply), None
+        return self._reply
+
+
+class RPCBatch(object):
+    """Batch of RPCs pipelined over a single Nuci session.
+
+    RPCs are collected in the `with` block and sent back to back when
+    the block is left, so the whole batch costs roughly as much as its
+    slowest RPC. Errors are reported separately for every RPC when
+    its result is requested:
+
+        with client.batch() as batch:
+            stats = batch.get(filter=filters.stats)
+            serial = client.get_serial(batch=batch)
+        stats.result().find_child("stats")
+
+    Replies which can be cached are taken from the NuciCache the same way as
+    by client.get(), only the missing ones are sent.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        :param timeout: timeout for the whole batch, default Nuci timeout is used if None
+        """
+        self.timeout = timeout
+        self._calls = []
+        self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def _add(self, klass, args, kwargs, parse=None, default=_NO_DEFAULT,
+             cache_entry=(None, (), None, 0)):
+        result = BatchResult(parse, default)
+        self._calls.append((klass, args, kwargs, cache_entry))
+        self._results.append(result)
+        return result
+
+    def get(self, filter=None):
+        """Add <get> to the batch, see client.get().
+
+        :return: BatchResult with Data instance
+        """
+        data = _get_from_uci_files(filter)
+        if data is not None:
+            result = BatchResult()
+            result._resolve(data, None)
+            return result
+        key, namespaces, paths = _get_cache_entry(filter)
+        return self._add(operations.Get, (),
+                         dict(filter=("subtree", filter) if filter is not None else None),
+                         parse=_parse_get_reply, cache_entry=(key, namespaces, paths, 0))
+
+    def dispatch(self, rpc_command, parse=None, default=_NO_DEFAULT, cache_key=None,
+                 namespaces=(), max_stale=0):
+        """Add an arbitrary RPC to the batch, see client.dispatch().
+
+        :param rpc_command: element with the RPC
+        :param parse: function converting the reply to the result
+        :param default: returned instead of raising RPCError or TimeoutExpiredError
+        :param cache_key: key of the parsed reply in the cache, None if it's not cached
+        :param namespaces: cache namespaces of the reply
+        :param max_stale: use outdated reply from the cache, see NuciCache.get_or_load()
+        :return: BatchResult
+        """
+        return self._add(operations.Dispatch, (rpc_command,), {}, parse, default,
+                         cache_entry=(cache_key, namespaces, None, max_stale))
+
+    def _send(self, calls, results, indexes):
+        """Send the RPCs which weren't found in the cache.
+
+        :return: list of tuples (value, size of the reply, exception or None),
+                 the values of the cached RPCs are parsed already
+        """
+        try:
+            replies = netconf.execute_batch([calls[index][:3] for index in indexes],
+                                            timeout=self.timeout)
+        except (IOError, TransportError, deadline.DeadlineExceeded) as e:
+            # connection failed or there's no time left, report it for every RPC
+            replies = [(None, e)] * len(indexes)
+        loaded = []
+        for index, (reply, error) in zip(indexes, replies):
+            parse = results[index]._parse
+            if error is not None or calls[index][3][0] is None or parse is None:
+                loaded.append((reply, 0, error))
+                continue
+            try:
+                loaded.append((parse(reply), len(reply.xml), None))
+            except Exception as e:
+                # reported when the result is requested, like for the uncached RPCs
+                loaded.append((None, 0, e))
+        return loaded
+
+    def execute(self):
+        """Send all the collected RPCs and collect their replies."""
+        calls, results = self._calls, self._results
+        self._calls, self._results = [], []
+        if not calls:
+            return
+        replies = netconf.get_cache().get_or_load_many(
+            [call[3] for call in calls], lambda indexes: self._send(calls, results, indexes))
+        for (_, _, _, (key, _, _, _)), result, (reply, error) in zip(calls, results, replies):
+            result._resolve(reply, error, parsed=key is not None)
+
+
+def batch(timeout=None):
+    """Create a new RPCBatch - see its documentation for usage.
+
+    :param timeout: timeout for the whole batch
+    :return: RPCBatch instance
+    """
+    return RPCBatch(timeout)
+
+
 def reboot():
     try:
         dispatch(maintain.Maintain.rpc_reboot())
@@ -180,10 +816,7 @@ def reboot():
 
 def load_config_backup(file):
     try:
-        import base64
-        data = base64.b64encode(file.read())
-        logger.debug(ET.tostring(maintain.Maintain.rpc_config_restore(data)))
-        data = dispatch(maintain.Maintain.rpc_config_restore(data))
+        data = dispatch(maintain.Maintain.rpc_config_restore_from_file(file))
         return maintain.Maintain.get_new_ip(ET.fromstring(data.xml))
     except RPCError:
         logger.exception("Unable to restore backup.")
@@ -193,35 +826,121 @@ def load_config_backup(file):
         raise
 
 
-def save_config_backup(filename):
+def _decode_config_backup(raw, chunk_size):
+    """Decode backup from the raw config-backup reply and check it's a complete bzip2 stream.
+
+    :return: list of .tar.bz2 backup chunks
+    :raises: TypeError, SyntaxError, IOError or EOFError if the backup is damaged
+    """
+    decoder = maintain.BackupDecoder()
+    parser = ET.XMLParser(target=decoder)
+    decompressor = bz2.BZ2Decompressor()
+    chunks = []
+    for offset in xrange(0, len(raw), chunk_size):
+        parser.feed(raw[offset:offset + chunk_size])
+        decoded = decoder.pop_decoded()
+        if decoded:
+            # only checked, the decompressed data are dropped right away
+            decompressor.decompress(decoded)
+            chunks.append(decoded)
+    parser.close()
     try:
-        data = dispatch(maintain.Maintain.rpc_config_backup())
-        encoded_data = maintain.Maintain.from_element(ET.fromstring(data.xml)).data
-        with open(filename, "wb") as f:
-            # simple encoded_data.decode("base64") raises too general exceptions on failure
-            import base64
-            f.write(base64.b64decode(encoded_data))
-        return True
+        decompressor.decompress("")
+    except EOFError:
+        return chunks  # end of the stream was reached
+    raise EOFError("Backup is truncated.")
+
+
+def get_config_backup(chunk_size=64 * 1024):
+    """Get configuration backup.
+
+    The whole backup is decoded and checked before it's returned, so a damaged
+    one is never sent to the user as if it was valid.
+
+    :param chunk_size: size of the reply chunks to decode at once
+    :return: list of .tar.bz2 backup chunks, None on failure
+    """
+    try:
+        reply = dispatch(maintain.Maintain.rpc_config_backup())
     except (RPCError, TimeoutExpiredError):
         logger.exception("Config backup failed.")
-        return False
-    except TypeError:
+        return None
+    raw = reply.xml
+    if isinstance(raw, unicode):
+        raw = raw.encode("utf-8")
+    try:
+        return _decode_config_backup(raw, chunk_size)
+    except (TypeError, SyntaxError, IOError, EOFError):
         logger.exception("Can't decode backup file, this is probably a bug in Nuci backend.")
+        return None
+
+
+def save_config_backup(filename):
+    chunks = get_config_backup()
+    if chunks is None:
         return False
+    with open(filename, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return True
+
+
+def _parse_registration(reply):
+    return registration.RegNum.from_element(ET.fromstring(reply.xml))
 
 
-def get_registration():
+def get_registration(batch=None):
+    """Get registration code of the router.
+
+    :param batch: RPCBatch to add the RPC to, BatchResult is returned then
+    :return: RegNum instance or None on failure
+    """
+    if batch is not None:
+        rpc_command = registration.RegNum.rpc_get()
+        return batch.dispatch(rpc_command, parse=_parse_registration, default=None,
+                              cache_key=_registration_cache_key(rpc_command),
+                              namespaces=("registration", ), max_stale=REGISTRATION_MAX_STALE)
     try:
-        data = dispatch(registration.RegNum.rpc_get())
-        return registration.RegNum.from_element(ET.fromstring(data.xml))
+        return _get_registration_cached(registration.RegNum.rpc_get(), _parse_registration)
     except (RPCError, TimeoutExpiredError):
         return None
 
 
-def get_serial():
+# outdated registration data are returned right away and refreshed in the background,
+# unless they're older than this (in seconds)
+REGISTRATION_MAX_STALE = 24 * 60 * 60
+
+
+def _registration_cache_key(rpc_command):
+    return "dispatch", ET.tostring(rpc_command)
+
+
+def _get_registration_cached(rpc_command, parse):
+    def load():
+        reply = dispatch(rpc_command)
+        return parse(reply), len(reply.xml)
+    return netconf.get_cache().get_or_load(_registration_cache_key(rpc_command),
+                                           ("registration", ), load,
+                                           max_stale=REGISTRATION_MAX_STALE)
+
+
+def _parse_serial(reply):
+    return registration.Serial.from_element(ET.fromstring(reply.xml))
+
+
+def get_serial(batch=None):
+    """Get serial number of the router.
+
+    :param batch: RPCBatch to add the RPC to, BatchResult is returned then
+    :return: Serial instance or None on failure
+    """
+    if batch is not None:
+        rpc_command = registration.Serial.rpc_serial()
+        return batch.dispatch(rpc_command, parse=_parse_serial, default=None,
+                              cache_key=_registration_cache_key(rpc_command),
+                              namespaces=("registration", ), max_stale=REGISTRATION_MAX_STALE)
     try:
-        data = dispatch(registration.Serial.rpc_serial())
-        return registration.Serial.from_element(ET.fromstring(data.xml))
+        return _get_registration_cached(registration.Serial.rpc_serial(), _parse_serial)
     except (RPCError, TimeoutExpiredError):
         return None
 
@@ -332,12 +1051,15 @@ def check_connection():
     :return: Connection instance on success, None otherwise
     """
     try:
-        data = dispatch(network.Connection.rpc_check())
-        return network.Connection.from_element(ET.fromstring(data.xml))
+        return _parse_connection(dispatch(network.Connection.rpc_check()))
     except (RPCError, TimeoutExpiredError):
         return None
 
 
+def _parse_connection(reply):
+    return network.Connection.from_element(ET.fromstring(reply.xml))
+
+
 def check_updates():
     check_tag = updater.Updater.qual_tag("check")
     element = ET.Element(check_tag)
@@ -353,7 +1075,10 @@ def get_updater_status():
 
     :return: tuple of three: (status, status_message, list of last_activity)
     """
-    data = get(filter=filters.updater)
+    return _parse_updater_status(get(filter=filters.updater))
+
+
+def _parse_updater_status(data):
     updater_status = data.find_child("updater")
 
     if updater_status.running:
@@ -367,7 +1092,11 @@ def get_updater_status():
 
 
 def get_uci_config():
-    data = netconf.get_config("running").data_ele
+    return _parse_get_config_reply(netconf.get_config("running"))
+
+
+def _parse_get_config_reply(reply):
+    data = reply.data_ele
     reply_data = Data()
     reply_data.add(uci_raw.Uci.from_element(data.find(uci_raw.Uci.qual_tag("uci"))))
     return reply_data
@@ -384,22 +1113,40 @@ def edit_uci_config(uci):
     edit_config(uci.get_tree())
 
 
+def _edited_paths(config):
+    """Get uci paths modified by payload of edit-config.
+
+    :param config: <config> element wrapping the modified configs
+    :return: list of uci paths, [""] if the payload isn't understood
+    """
+    if config is None:
+        return [""]
+    paths = []
+    for child in config:
+        if child.tag != uci_raw.Uci.qual_tag("uci"):
+            return [""]
+        paths.extend(uci_raw.uci_paths(child))
+    return paths
+
+
+def _wrap_config(config):
+    config_root = ET.Element(YinElement.qual_tag("config"))
+    config_root.append(config)
+    return config_root
+
+
 def edit_config(config):
     """Execute netconf edit-config.
 
     :param config: config to edit as an XML Element
     :return:
     """
-    config_root = ET.Element(YinElement.qual_tag("config"))
-    config_root.append(config)
-    return netconf.edit_config("running", config=config_root)
+    return netconf.edit_config("running", config=_wrap_config(config))
 
 
 def edit_config_multiple(configs):
     for config in configs:
-        config_root = ET.Element(YinElement.qual_tag("config"))
-        config_root.append(config)
-        netconf.edit_config("running", config=config_root)
+        netconf.edit_config("running", config=_wrap_config(config))
 
 
 def dispatch(*args, **kwargs):
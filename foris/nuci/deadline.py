@@ -0,0 +1,95 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Deadlines of the Nuci calls, shared by all the calls done in a scope
+(typically during handling of a single HTTP request) of the current thread.
+"""
+import threading
+from contextlib import contextmanager
+from time import time
+
+from ncclient.operations.errors import TimeoutExpiredError
+
+_local = threading.local()
+
+
+class DeadlineExceeded(TimeoutExpiredError):
+    """
+    Raised without contacting Nuci when the deadline has already passed.
+    """
+    pass
+
+
+@contextmanager
+def scope(seconds):
+    """Context manager setting the deadline of the Nuci calls done in its body.
+
+    Nested scopes can only shorten the deadline of the outer scope.
+
+    :param seconds: time available for the calls, None for no deadline
+    """
+    previous = getattr(_local, "deadline", None)
+    current = time() + seconds if seconds is not None else None
+    if previous is not None and (current is None or previous < current):
+        current = previous
+    _local.deadline = current
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining():
+    """Get the time left until the deadline.
+
+    :return: seconds left or None if there's no deadline
+    """
+    deadline = getattr(_local, "deadline", None)
+    return deadline - time() if deadline is not None else None
+
+
+def passed():
+    """Check whether the deadline has passed, e.g. to tell timeouts shortened
+    by the deadline from the ones caused by slow Nuci.
+
+    :return: True if there's a deadline and it has passed
+    """
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def allows(seconds):
+    """Check whether an operation taking up to `seconds` fits before the deadline.
+
+    :return: True if there's enough time or no deadline
+    """
+    left = remaining()
+    return left is None or left >= seconds
+
+
+def budget(timeout):
+    """Limit timeout of a call by the deadline.
+
+    :param timeout: timeout of the call
+    :return: timeout not exceeding the deadline
+    :raises: DeadlineExceeded if the deadline has passed
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Deadline of the Nuci calls has passed.")
+    return min(timeout, left)
@@ -9,4 +9,19 @@ class ConfigRestoreError(NuciError):
     """
     Raised when config-restore RPC command fails.
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class NuciUnavailableError(NuciError):
+    """
+    Raised without contacting Nuci when the connection to it keeps failing.
+    """
+    def __init__(self, reason=None, retry_after=None):
+        """
+        :param reason: description of the last failure
+        :param retry_after: seconds until the next connection attempt
+        """
+        super(NuciUnavailableError, self).__init__(
+            "Nuci is unavailable: %s" % (reason or "unknown reason"))
+        self.reason = reason
+        self.retry_after = retry_after
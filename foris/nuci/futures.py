@@ -0,0 +1,197 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Non-blocking counterpart of foris.nuci.client.
+
+Every function sends its RPC right away and returns a NuciFuture, the reply
+is read by the session's transport thread meanwhile. Independent reads can be
+gathered, so they're processed by Nuci in parallel:
+
+    stats, updater = futures.gather(futures.get(filters.stats),
+                                    futures.get_updater_status())
+
+Results are the same objects as the ones returned by foris.nuci.client.
+"""
+import logging
+from time import time
+from xml.etree import cElementTree as ET
+
+from ncclient import operations
+from ncclient.operations import RPCError
+from ncclient.operations.errors import TimeoutExpiredError
+from ncclient.transport import TransportError
+
+from . import client, deadline, filters
+from .modules import network, time as time_module
+
+logger = logging.getLogger("nuci.futures")
+
+
+class NuciFuture(client.BatchResult):
+    """Pending result of a single RPC sent to Nuci."""
+
+    def __init__(self, pooled, rpc, timeout, parse=None, default=client._NO_DEFAULT):
+        """
+        :param pooled: PooledSession the RPC was sent over
+        :param rpc: asynchronous ncclient RPC
+        :param timeout: timeout of the RPC (in seconds)
+        :param parse: function converting the reply to the result
+        :param default: returned instead of raising RPCError or TimeoutExpiredError
+        """
+        super(NuciFuture, self).__init__(parse, default)
+        self._pooled = pooled
+        self._rpc = rpc
+        self._deadline = time() + timeout
+
+    @classmethod
+    def send(cls, klass, *args, **kwargs):
+        """Send an operation to Nuci.
+
+        :param klass: operation class
+        :param parse: function converting the reply to the result
+        :param default: returned instead of raising RPCError or TimeoutExpiredError
+        :param timeout: timeout of the RPC
+        :return: NuciFuture instance
+        """
+        parse = kwargs.pop("parse", None)
+        default = kwargs.pop("default", client._NO_DEFAULT)
+        try:
+            timeout = deadline.budget(kwargs.pop("timeout", client.netconf._timeout))
+            pooled, rpc = client.netconf.send_async(klass, timeout=timeout, *args, **kwargs)
+        except (IOError, TransportError, deadline.DeadlineExceeded) as e:
+            future = cls(None, None, 0, parse, default)
+            future._resolve(None, e)
+            return future
+        return cls(pooled, rpc, timeout, parse, default)
+
+    @property
+    def done(self):
+        """True if the reply has arrived (or the RPC failed)."""
+        return self._done or self._rpc.event.is_set() or time() > self._deadline
+
+    def wait(self):
+        """Wait until the reply arrives or the timeout expires."""
+        if self._done:
+            return
+        self._rpc.event.wait(max(self._deadline - time(), 0))
+        reply, error = client.netconf._collect_reply(self._rpc)
+        if isinstance(error, (IOError, TransportError)):
+            self._pooled.broken = True
+        self._resolve(reply, error)
+        self._pooled.unhold()
+        self._pooled, self._rpc = None, None
+
+    def result(self):
+        """Wait for the reply and get the result.
+
+        :return: parsed reply
+        :raises: exception of the RPC - e.g. RPCError, TimeoutExpiredError
+        """
+        self.wait()
+        return super(NuciFuture, self).result()
+
+    def __del__(self):
+        # don't keep the session open when the result was never requested
+        if self._pooled is not None:
+            self._pooled.unhold()
+
+
+def gather(*futures, **kwargs):
+    """Wait for all the futures and get their results.
+
+    :param return_exceptions: return exceptions of failed RPCs instead of raising them
+    :return: list of results in the order of futures
+    """
+    return_exceptions = kwargs.get("return_exceptions", False)
+    results = []
+    for future in futures:
+        future.wait()
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+def get(filter=None):
+    """See client.get().
+
+    :return: NuciFuture with Data instance
+    """
+    return NuciFuture.send(operations.Get,
+                           filter=("subtree", filter) if filter is not None else None,
+                           parse=client._parse_get_reply)
+
+
+def get_config():
+    """See client.get_uci_config().
+
+    :return: NuciFuture with Data instance
+    """
+    return NuciFuture.send(operations.GetConfig, "running",
+                           parse=client._parse_get_config_reply)
+
+
+def edit_config(config):
+    """See client.edit_config().
+
+    :return: NuciFuture with the reply
+    """
+    return NuciFuture.send(operations.EditConfig, "running",
+                           config=client._wrap_config(config))
+
+
+def dispatch(rpc_command, **kwargs):
+    """See client.dispatch().
+
+    :param parse: function converting the reply to the result
+    :param default: returned instead of raising RPCError or TimeoutExpiredError
+    :param timeout: timeout of the RPC
+    :return: NuciFuture with the reply
+    """
+    return NuciFuture.send(operations.Dispatch, rpc_command, **kwargs)
+
+
+def check_connection():
+    """See client.check_connection().
+
+    :return: NuciFuture with Connection instance, or None on failure
+    """
+    return dispatch(network.Connection.rpc_check(), parse=client._parse_connection,
+                    default=None)
+
+
+def get_updater_status():
+    """See client.get_updater_status().
+
+    :return: NuciFuture with tuple (status, status_message, list of last_activity)
+    """
+    return NuciFuture.send(operations.Get, filter=("subtree", filters.updater),
+                           parse=lambda reply: client._parse_updater_status(
+                               client._parse_get_reply(reply)))
+
+
+def ntp_update():
+    """See client.ntp_update().
+
+    :return: NuciFuture with True on success, False otherwise
+    """
+    # use longer timeout, because the NTP sync takes some time
+    return dispatch(ET.Element(time_module.Time.qual_tag("ntp")), timeout=60,
+                    parse=lambda reply: True, default=False)
@@ -14,22 +14,127 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy as copy_module
 import re
+import threading
+from collections import OrderedDict
 from xml.etree import cElementTree as ET
 
 
 anon_path = re.compile(r"@(?P<name>[\w\-]+)\[(?P<pos>\-?\d+)]")
 
 
+# shared by all the final nodes, which can't have any children
+_NO_CHILDREN = ()
+_NO_CHILDREN_BY_KEY = {}
+
+# trees can be shared between threads (e.g. cached Nuci data), creating
+# of the lazy children must not be interleaved
+_materialize_lock = threading.RLock()
+
+
+def _copy_value(value):
+    """Copy mutable attribute value of a node (e.g. data of Stats), so changes
+    of a fork don't leak to the original."""
+    if isinstance(value, (list, dict, set)):
+        return copy_module.deepcopy(value)
+    return value
+
+
 class YinElement(object):
+    # subclasses without __slots__ get __dict__ for their attributes, the ones
+    # with many instances (uci_raw nodes) declare __slots__ to save memory
+    __slots__ = ("_children", "_children_by_key", "_pending", "parent", "operation", "_path")
+
     tag = ""
     NS_URI = "urn:ietf:params:xml:ns:netconf:base:1.0"
     final = False  # final node can't have children
 
     def __init__(self):
-        self.children = []
+        if self.final:
+            self._children = _NO_CHILDREN
+            self._children_by_key = _NO_CHILDREN_BY_KEY
+        else:
+            self._children = []
+            self._children_by_key = {}  # index of children by their keys
+        # children not created yet - key -> (XML element, factory) or None when created
+        self._pending = None
         self.parent = None
         self.operation = None
+        self._path = None  # cached path, reset when the node is re-parented
+
+    @property
+    def children(self):
+        if self._pending:
+            self._materialize()
+        return self._children
+
+    def add_lazy(self, elements, key_of, factory):
+        """Add children to be created from their XML elements on the first access.
+
+        :param elements: XML elements of the children
+        :param key_of: function getting key of a child from its XML element
+        :param factory: function creating a child from its XML element
+        """
+        if self._pending is None:
+            self._pending = OrderedDict()
+        for element in elements:
+            key = key_of(element)
+            if key not in self._pending and key not in self._children_by_key:
+                self._pending[key] = (element, factory)
+
+    def _create_pending(self, key):
+        """Create a pending child - must hold the _materialize_lock."""
+        element, factory = self._pending[key]
+        child = factory(element)
+        child.parent = self
+        self._children_by_key[key] = child
+        self._pending[key] = None
+        return child
+
+    def _child_by_key(self, key):
+        child = self._children_by_key.get(key)
+        if child is None and self._pending:
+            with _materialize_lock:
+                child = self._children_by_key.get(key)
+                if child is None and self._pending and self._pending.get(key) is not None:
+                    child = self._create_pending(key)
+        return child
+
+    def _children_changed_from(self, original):
+        """Get children, except the pending ones which are the same as in the original node,
+        i.e. children of a fork of the original which haven't been accessed.
+
+        :param original: node this one was forked from, None if it's not known
+        """
+        with _materialize_lock:
+            if not self._pending:
+                return self._children
+            original_pending = original._pending or {} if original is not None else {}
+            changed = []
+            for key, item in self._pending.items():
+                if item is None:
+                    changed.append(self._children_by_key[key])
+                    continue
+                source = original_pending.get(key)
+                if source is not None and source[0] is item[0]:
+                    continue  # created from the same source as the original child
+                if item[1] is _fork and original is not None \
+                        and item[0] is original._children_by_key.get(key):
+                    continue  # forked from the original child
+                changed.append(self._create_pending(key))
+            return changed + self._children
+
+    def _materialize(self):
+        """Create all the pending children, in their original order."""
+        with _materialize_lock:
+            if not self._pending:
+                return
+            created = [self._children_by_key[key] if item is None else self._create_pending(key)
+                       for key, item in self._pending.items()]
+            # the children added explicitly come after the original ones
+            self._children[:0] = created
+            self._pending = None
 
     def __iter__(self):
         return iter(self.children)
@@ -40,6 +145,46 @@ class YinElement(object):
     def __cmp__(self, other):
         return cmp(self.path, other.path)
 
+    def _shallow_copy(self):
+        """Copy this node without its children."""
+        copy = object.__new__(type(self))
+        YinElement.__init__(copy)
+        for klass in type(self).__mro__:
+            for attr in getattr(klass, "__slots__", ()):
+                if attr not in YinElement.__slots__:
+                    # private attributes are caches of the children
+                    setattr(copy, attr,
+                            None if attr.startswith("_") else _copy_value(getattr(self, attr)))
+        if hasattr(self, "__dict__"):
+            for attr, value in self.__dict__.items():
+                copy.__dict__[attr] = _copy_value(value)
+        copy.operation = self.operation
+        return copy
+
+    def fork(self):
+        """Create copy-on-write fork of this node.
+
+        Children of the fork are copied from the original ones when they're accessed
+        for the first time, the subtrees which are never accessed are shared. So the fork
+        can be modified without affecting the original, which must not be modified
+        while the fork is used. To remove a child of the fork in edit-config, set its
+        operation to "remove".
+
+        :return: forked node without parent
+        """
+        fork = self._shallow_copy()
+        with _materialize_lock:
+            pending = OrderedDict()
+            if self._pending:
+                for key, item in self._pending.items():
+                    # not created yet - the fork creates its own child from the same source
+                    pending[key] = item if item is not None \
+                        else (self._children_by_key[key], _fork)
+            for child in self._children:
+                pending[child.key] = (child, _fork)
+        fork._pending = pending or None
+        return fork
+
     def add(self, child):
         """Add new child node.
         Doesn't add the child if node with same path already exists.
@@ -50,11 +195,26 @@ class YinElement(object):
         if self.final:
             raise ValueError("Can't add child, '%s' is final node." % self.path)
         child.parent = self
-        if child not in self.children:
-            self.children.append(child)
-            return child
-        else:
-            return self.children[self.children.index(child)]
+        child._reset_path()
+        # children of the same node have the same path if they have the same key
+        existing = self._child_by_key(child.key)
+        if existing is not None:
+            return existing
+        self._children.append(child)
+        self._children_by_key[child.key] = child
+        return child
+
+    def put(self, child):
+        """Add new child node, replace the child with the same path if it exists
+        (e.g. an option of a fork).
+
+        :param child: child node to add
+        :return: added child
+        """
+        existing = self._child_by_key(child.key)
+        if existing is not None:
+            self.remove(existing)
+        return self.add(child)
 
     def add_removal(self, child):
         """Add new child node marked for removal.
@@ -63,7 +223,7 @@ class YinElement(object):
         :return:
         """
         child.operation = "remove"
-        return self.add(child)
+        return self.put(child)
 
     def add_replace(self, child):
         """Add a new child node to replace an existing one if it exists.
@@ -72,11 +232,25 @@ class YinElement(object):
         :return:
         """
         child.operation = "replace"
-        return self.add(child)
+        return self.put(child)
 
     def remove(self, child):
-        self.children.remove(child)
-        child.parent = None
+        existing = self._child_by_key(child.key)
+        if existing is None:
+            raise ValueError("%s is not a child of %s" % (child, self))
+        with _materialize_lock:
+            del self._children_by_key[child.key]
+            if self._pending and child.key in self._pending:
+                # created from the pending ones, it isn't in _children yet
+                del self._pending[child.key]
+            else:
+                # compare identities, comparing the paths is much slower
+                for index, other in enumerate(self._children):
+                    if other is existing:
+                        del self._children[index]
+                        break
+        existing.parent = None
+        existing._reset_path()
 
     def find_child(self, path, where=None):
         """Find child according to path, supports Uci-style indexing for sections.
@@ -93,22 +267,20 @@ class YinElement(object):
             key = keys.pop(0)
             if key[0] == "@":
                 match = anon_path.match(key)
-                section_type = match.group("name")
-                sections = filter(lambda x: x.type == section_type, where.children)
+                sections = where._children_of_type(match.group("name"))
                 pos = int(match.group("pos"))
                 try:
                     where = sections[pos]
                 except IndexError:
                     where = None
             else:
-                for child in where.children:
-                    if child.key == key:
-                        where = child
-                        break
-                else:
-                    where = None
+                where = where._child_by_key(key)
         return where
 
+    def _children_of_type(self, type_):
+        """Get children of given type (e.g. sections), in their order."""
+        return [child for child in self.children if getattr(child, "type", None) == type_]
+
     def _append_subelements(self, element):
         pass
 
@@ -156,14 +328,25 @@ class YinElement(object):
 
     @property
     def path(self):
-        parent = self.parent
-        path = [self.key]
-        while parent is not None:
-            if not parent.key:
-                break
-            path.append(parent.key)
-            parent = parent.parent
-        return ".".join(reversed(path))
+        if self._path is None:
+            parent = self.parent
+            if parent is None or not parent.key:
+                self._path = self.key
+            else:
+                # caches the paths of all the ancestors too
+                self._path = parent.path + "." + self.key
+        return self._path
+
+    def _reset_path(self):
+        """Reset cached paths of this node and of its descendants."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            # descendants of a node without cached path have no cached path either
+            if node._path is not None:
+                node._path = None
+                # children which haven't been created yet have no cached path
+                stack.extend(node._children_by_key.itervalues())
 
     @property
     def key(self):
@@ -185,6 +368,10 @@ class YinElement(object):
         return "{%s}%s" % (ns_uri, tag)
 
 
+def _fork(node):
+    return node.fork()
+
+
 class Data(YinElement):
     """
     Wrapper class for RPC reply data.
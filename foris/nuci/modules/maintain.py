@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 from xml.etree import cElementTree as ET
 
 from .base import YinElement
@@ -75,6 +76,20 @@ class Maintain(YinElement):
         data_elem.text = data
         return element
 
+    @staticmethod
+    def rpc_config_restore_from_file(file):
+        """
+        Same as rpc_config_restore(), the backup is read from a file.
+
+        The whole request is serialized to a single string by ncclient, so the
+        encoded backup is held in memory anyway. It's encoded at once, encoding
+        by chunks would need another copy of it for joining the chunks.
+
+        :param file: file-like object with .tar.bz2 backup
+        :return: element with config-restore RPC
+        """
+        return Maintain.rpc_config_restore(base64.b64encode(file.read()))
+
     @staticmethod
     def get_new_ip(reply_element):
         new_ip_el = reply_element.find(Maintain.qual_tag("new-ip"))
@@ -82,5 +97,50 @@ class Maintain(YinElement):
             return new_ip_el.text
         return None
 
+
+class BackupDecoder(object):
+    """
+    Target of XMLParser decoding the backup from config-backup RPC reply
+    incrementally, as the reply is fed to the parser.
+    """
+
+    def __init__(self):
+        self.data_tag = Maintain.qual_tag("data")
+        self._inside = False
+        self._pending = ""
+        self._decoded = []
+
+    def start(self, tag, attrib):
+        if tag == self.data_tag:
+            self._inside = True
+
+    def end(self, tag):
+        if tag == self.data_tag:
+            self._inside = False
+
+    def data(self, data):
+        if not self._inside:
+            return
+        self._pending += "".join(data.split())
+        # decode only complete quadruples of base64 characters
+        complete = len(self._pending) // 4 * 4
+        if complete:
+            self._decoded.append(base64.b64decode(self._pending[:complete]))
+            self._pending = self._pending[complete:]
+
+    def close(self):
+        if self._pending:
+            raise TypeError("Incomplete base64 data in backup.")
+
+    def pop_decoded(self):
+        """
+        Get data decoded since the last call.
+
+        :return: string with a part of the .tar.bz2 backup
+        """
+        decoded, self._decoded = "".join(self._decoded), []
+        return decoded
+
+
 ####################################################################################################
 ET.register_namespace("maintain", Maintain.NS_URI)
@@ -19,18 +19,15 @@ from xml.etree import cElementTree as ET
 
 
 class Uci(YinElement):
+    __slots__ = ()
     tag = "uci"
     NS_URI = "http://www.nic.cz/ns/router/uci-raw"
 
     @staticmethod
     def from_element(element):
         uci = Uci()
-        config_elems = element.findall(Uci.qual_tag("config"))
-        for config_elem in config_elems:
-            config = Config.from_element(config_elem)
-            uci.add(config)
-        else:
-            pass  # just return an empty UciElement
+        # configs are created when they're accessed for the first time
+        uci.add_lazy(element.findall(Uci.qual_tag("config")), _name_of, Config.from_element)
         return uci
 
     @property
@@ -42,11 +39,14 @@ class Uci(YinElement):
 
 
 class Config(Uci):
+    __slots__ = ("name", "_sections_by_type")
     tag = "config"
 
     def __init__(self, name):
         super(Config, self).__init__()
         self.name = name
+        # type -> list of sections, built on the first lookup of an anonymous section
+        self._sections_by_type = None
 
     def __str__(self):
         return "Config " + self.name
@@ -58,20 +58,43 @@ class Config(Uci):
     def key(self):
         return self.name
 
+    def add(self, child):
+        added = super(Config, self).add(child)
+        if added is child and self._sections_by_type is not None:
+            self._sections_by_type.setdefault(child.type, []).append(child)
+        return added
+
+    def remove(self, child):
+        # the child is removed by its key, it can be a different instance
+        existing = self._child_by_key(child.key)
+        super(Config, self).remove(child)
+        if self._sections_by_type is not None:
+            sections = self._sections_by_type.get(existing.type, [])
+            for index, section in enumerate(sections):
+                if section is existing:
+                    del sections[index]
+                    break
+
+    def _children_of_type(self, type_):
+        # note that the index isn't updated when type of a section is changed
+        if self._sections_by_type is None:
+            sections_by_type = {}
+            for section in self.children:
+                sections_by_type.setdefault(section.type, []).append(section)
+            self._sections_by_type = sections_by_type
+        return self._sections_by_type.get(type_, [])
+
     @staticmethod
     def from_element(element):
         name = element.find(Config.qual_tag("name")).text
         config = Config(name)
-        section_elems = element.findall(Config.qual_tag("section"))
-        for section_elem in section_elems:
-            section = Section.from_element(section_elem)
-            config.add(section)
-        else:
-            pass  # just return an empty ConfigElement
+        config.add_lazy(element.findall(Config.qual_tag("section")), _name_of,
+                        Section.from_element)
         return config
 
 
 class Section(Uci):
+    __slots__ = ("name", "type", "anonymous")
     tag = "section"
 
     def __init__(self, name, type, anonymous=False):
@@ -113,11 +136,10 @@ class Section(Uci):
 
         anonymous = element.find(Section.qual_tag("anonymous")) is not None
         section = Section(name, type_, anonymous)
-        for elem in element.iter():
-            if elem.tag == Option.qual_tag("option"):
-                section.add(Option.from_element(elem))
-            elif elem.tag == List.qual_tag("list"):
-                section.add(List.from_element(elem))
+        option_tag, list_tag = Option.qual_tag("option"), List.qual_tag("list")
+        section.add_lazy(
+            [elem for elem in element.iter() if elem.tag in (option_tag, list_tag)], _name_of,
+            lambda elem: (Option if elem.tag == option_tag else List).from_element(elem))
         return section
 
     def _append_subelements(self, element):
@@ -129,6 +151,7 @@ class Section(Uci):
 
 
 class Option(Uci):
+    __slots__ = ("name", "value")
     tag = "option"
     final = True
 
@@ -161,6 +184,7 @@ class Option(Uci):
 
 
 class List(Uci):
+    __slots__ = ("name", )
     tag = "list"
 
     def __init__(self, name):
@@ -202,6 +226,7 @@ class List(Uci):
 
 
 class Value(Uci):
+    __slots__ = ("index", "content")
     tag = "value"
     final = True
 
@@ -231,6 +256,153 @@ class Value(Uci):
         ET.SubElement(element, self.qual_tag("content")).text = self.content
 
 
+def _name_of(element):
+    """Get name of config, section, option or list from its XML element."""
+    return element.find(Uci.qual_tag("name")).text
+
+
+def uci_paths(element):
+    """
+    Get uci paths covered by an XML representation of Uci tree,
+    e.g. by a filter or by a payload of edit-config.
+
+    :param element: <uci> Element
+    :return: list of paths "config[.section[.option]]", [""] for the whole uci
+    """
+    def name_of(elem):
+        name_elem = elem.find(Uci.qual_tag("name"))
+        return name_elem.text if name_elem is not None else None
+
+    paths = []
+    for config_elem in element.findall(Uci.qual_tag("config")):
+        config = name_of(config_elem)
+        if not config:
+            return [""]
+        section_elems = config_elem.findall(Uci.qual_tag("section"))
+        if not section_elems:
+            paths.append(config)
+        for section_elem in section_elems:
+            section = name_of(section_elem)
+            if not section:
+                paths.append(config)
+                continue
+            option_elems = section_elem.findall(Uci.qual_tag("option")) \
+                + section_elem.findall(Uci.qual_tag("list"))
+            if not option_elems:
+                paths.append("%s.%s" % (config, section))
+            for option_elem in option_elems:
+                option = name_of(option_elem)
+                paths.append("%s.%s.%s" % (config, section, option) if option
+                             else "%s.%s" % (config, section))
+    return paths or [""]
+
+
+def _copy_tree(node):
+    """Copy Uci node with all its descendants."""
+    copy = node._shallow_copy()
+    for child in node.children:
+        copy.add(_copy_tree(child))
+    return copy
+
+
+def _same_tree(current, desired):
+    """Check whether applying the desired node would leave the current one unchanged."""
+    if type(current) is not type(desired):
+        return False
+    if isinstance(desired, Option):
+        return current.value == desired.value
+    if isinstance(desired, List):
+        return [value.content for value in current.children] \
+            == [value.content for value in desired.children]
+    if isinstance(desired, Section) and desired.type is not None \
+            and desired.type != current.type:
+        return False
+    if len(current.children) != len(desired.children):
+        return False
+    for child in desired.children:
+        existing = current._child_by_key(child.key)
+        if existing is None or not _same_tree(existing, child):
+            return False
+    return True
+
+
+def _overlaps(path, paths):
+    """Check whether the path is under or above any of the paths."""
+    for other in paths:
+        if not other or not path or path == other or path.startswith(other + ".") \
+                or other.startswith(path + "."):
+            return True
+    return False
+
+
+def _is_under(path, paths):
+    for other in paths:
+        if not other or path == other or path.startswith(other + "."):
+            return True
+    return False
+
+
+def uci_diff(current, desired, fetched_paths=("", ), changed_paths=(), origin=None):
+    """
+    Compute the minimal changeset turning the current Uci tree into the desired one,
+    i.e. the desired tree without the nodes which wouldn't change anything.
+
+    Nodes missing in the current tree are kept, unless they're marked for removal
+    and the current tree is known to contain all the data under their paths.
+
+    :param current: Uci tree with the current configuration, None if not known - only
+                    the nodes changed from the origin are kept then (if it's set)
+    :param desired: Uci tree which would be sent in edit-config
+    :param fetched_paths: uci paths fetched completely into the current tree
+                          (see uci_paths()), [""] if it contains the whole uci
+    :param changed_paths: uci paths changed since the current tree was fetched,
+                          the current data are not reliable for them
+    :param origin: tree the desired one was forked from (see YinElement.fork()), the current
+                   one by default - children of the fork which weren't accessed are unchanged
+    :return: Uci tree with the changeset, it has no children when nothing changes
+    """
+    changeset = Uci()
+    if origin is None:
+        origin = current
+    if current is None:
+        fetched_paths = ()
+        # never send the whole (possibly outdated) fork, only the modified nodes
+        current = origin
+
+    def diff_children(current_node, origin_node, desired_node, target, path):
+        for child in desired_node._children_changed_from(origin_node):
+            child_path = "%s.%s" % (path, child.key) if path else child.key
+            existing = current_node._child_by_key(child.key) if current_node is not None \
+                else None
+            if child.operation == "remove":
+                # removal of non-existent node does nothing
+                if existing is None and _is_under(child_path, fetched_paths) \
+                        and not _overlaps(child_path, changed_paths):
+                    continue
+                target.add(_copy_tree(child))
+            elif existing is None or child.operation == "create":
+                target.add(_copy_tree(child))
+            elif isinstance(child, (Option, List)) or child.operation == "replace":
+                # incomplete current section or config can't be compared
+                complete = isinstance(child, (Option, List)) \
+                    or _is_under(child_path, fetched_paths)
+                if not complete or _overlaps(child_path, changed_paths) \
+                        or not _same_tree(existing, child):
+                    target.add(_copy_tree(child))
+            else:
+                node = child._shallow_copy()
+                origin_child = origin_node._child_by_key(child.key) \
+                    if origin_node is not None else None
+                diff_children(existing, origin_child, child, node, child_path)
+                retyped = isinstance(child, Section) and child.type is not None \
+                    and child.type != existing.type
+                if node.children or retyped:
+                    target.add(node)
+
+    diff_children(current, origin, desired, changeset, "")
+    return changeset
+
+
 def parse_uci_bool(value):
     """
     Helper function to parse Uci bool values.
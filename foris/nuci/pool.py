@@ -0,0 +1,293 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+
+from contextlib import contextmanager
+from time import time
+
+from .request_queue import RequestStats
+
+logger = logging.getLogger("nuci.pool")
+
+
+class PooledSession(object):
+    """Nuci session together with the bookkeeping needed by the SessionPool."""
+
+    def __init__(self, session, generation=0):
+        self.session = session
+        self.generation = generation
+        self.created = time()
+        self.last_used = self.created
+        # set to True when the session failed and must not be reused
+        self.broken = False
+        # RPCs sent in the asynchronous mode still waiting for their reply
+        self._pending = 0
+        self._closing = False
+        self._lock = threading.Lock()
+
+    @property
+    def age(self):
+        return time() - self.created
+
+    @property
+    def connected(self):
+        return getattr(self.session, "connected", True)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def hold(self):
+        """Mark an RPC waiting for its reply - the session is not closed until
+        the RPC is finished by calling unhold().
+        """
+        with self._lock:
+            self._pending += 1
+
+    def unhold(self):
+        with self._lock:
+            self._pending -= 1
+            close = self._closing and not self._pending
+        if close:
+            self._close()
+
+    def close(self):
+        """Close the session, or postpone it until all the pending RPCs are finished."""
+        with self._lock:
+            self._closing = True
+            if self._pending:
+                return
+        self._close()
+
+    def _close(self):
+        try:
+            self.session.close()
+        except Exception:
+            logger.exception("Unable to close Nuci session.")
+
+
+class SessionPool(object):
+    """Bounded pool of Nuci sessions which can be leased concurrently.
+
+    Sessions are spawned lazily when there's no idle session available,
+    until max_size sessions exist - then the callers wait for a session
+    to be returned. Idle sessions exceeding min_size are closed after
+    idle_timeout seconds, sessions older than max_age seconds are closed
+    instead of being returned to the pool.
+    """
+
+    def __init__(self, factory, min_size=1, max_size=3, idle_timeout=60, max_age=300,
+                 stats=None):
+        """
+        :param factory: callable returning a new connected session
+        :param min_size: number of idle sessions which are never reaped
+        :param max_size: maximum number of sessions (both idle and leased)
+        :param idle_timeout: close surplus sessions idle for this long (in seconds)
+        :param max_age: recycle sessions older than this (in seconds)
+        :param stats: RequestStats instance to record timing into
+        """
+        if min_size > max_size:
+            raise ValueError("min_size must not be greater than max_size")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.stats = stats or RequestStats()
+        self._condition = threading.Condition(threading.Lock())
+        self._idle = []  # idle sessions, most recently used last
+        self._size = 0  # number of all sessions, including the leased ones
+        self._generation = 0
+
+    @property
+    def size(self):
+        with self._condition:
+            return self._size
+
+    @property
+    def idle(self):
+        with self._condition:
+            return len(self._idle)
+
+    def _is_reusable(self, pooled):
+        return (not pooled.broken and pooled.connected
+                and pooled.generation == self._generation
+                and pooled.age < self.max_age)
+
+    def _reap(self):
+        """Remove idle sessions which should be closed - must hold the lock.
+
+        :return: list of removed sessions, they should be closed without the lock held
+        """
+        now = time()
+        kept, reaped = [], []
+        # the most recently used sessions are preferred to be kept
+        for pooled in reversed(self._idle):
+            surplus = len(kept) >= self.min_size
+            if not self._is_reusable(pooled) or \
+                    (surplus and now - pooled.last_used > self.idle_timeout):
+                reaped.append(pooled)
+            else:
+                kept.append(pooled)
+        self._idle = list(reversed(kept))
+        self._size -= len(reaped)
+        return reaped
+
+    def _acquire(self):
+        with self._condition:
+            reaped = self._reap()
+            while not self._idle and self._size >= self.max_size:
+                self._condition.wait()
+            pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                self._size += 1
+            generation = self._generation
+        for old in reaped:
+            logger.debug("Closing idle Nuci session (age %.1f s).", old.age)
+            old.close()
+        if pooled is None:
+            try:
+                pooled = PooledSession(self.factory(), generation)
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+            logger.debug("Spawned new pooled Nuci session (%d in pool).", self.size)
+        return pooled
+
+    def _release(self, pooled):
+        pooled.last_used = time()
+        with self._condition:
+            reusable = self._is_reusable(pooled)
+            if reusable:
+                self._idle.append(pooled)
+            else:
+                self._size -= 1
+            self._condition.notify()
+        if not reusable:
+            logger.debug("Recycling pooled Nuci session (age %.1f s).", pooled.age)
+            pooled.close()
+
+    @contextmanager
+    def lease(self, label=None):
+        """Context manager leasing a session from the pool for exclusive use.
+
+        Set `broken` attribute of the yielded PooledSession to True if the session
+        failed, it won't be returned to the pool then.
+
+        :param label: description of the request used in debug messages
+        :return: PooledSession instance
+        """
+        enqueued = time()
+        pooled = self._acquire()
+        started = time()
+        try:
+            yield pooled
+        finally:
+            self._release(pooled)
+            finished = time()
+            wait, execution = started - enqueued, finished - started
+            self.stats.record(wait, execution)
+            logger.debug("pool: %s waited %.3f s, executed in %.3f s",
+                         label or "request", wait, execution)
+
+    def clear(self):
+        """Close all idle sessions and make the leased ones close on their return."""
+        with self._condition:
+            self._generation += 1
+            reaped = self._reap()
+        for pooled in reaped:
+            pooled.close()
+
+    def rotate(self, lead):
+        """Replace idle sessions expiring in less than `lead` seconds and spawn the
+        sessions missing to min_size.
+
+        The replacements are spawned without the lock held, so the callers leasing
+        sessions meanwhile aren't blocked - it's meant to be called periodically from
+        a background thread (see SessionRotator).
+
+        :param lead: replace sessions this many seconds before they reach max_age
+        """
+        with self._condition:
+            reaped = self._reap()
+            expiring = [p for p in self._idle if p.age > self.max_age - lead]
+            missing = max(self.min_size - self._size, 0)
+            generation = self._generation
+        for old in reaped:
+            old.close()
+        if not expiring and not missing:
+            return
+
+        fresh = []
+        try:
+            for _ in range(len(expiring) + missing):
+                fresh.append(PooledSession(self.factory(), generation))
+        except Exception:
+            for pooled in fresh:
+                pooled.close()
+            raise
+        retired = []
+        with self._condition:
+            for pooled in fresh:
+                old = expiring.pop() if expiring else None
+                if generation != self._generation:
+                    retired.append(pooled)
+                elif old is not None and old in self._idle:
+                    # swap in place of the expiring session
+                    self._idle.remove(old)
+                    self._idle.append(pooled)
+                    retired.append(old)
+                elif self._size < self.max_size:
+                    # expiring session is leased now, it'll be recycled on its return
+                    self._size += 1
+                    self._idle.append(pooled)
+                else:
+                    retired.append(pooled)
+            self._condition.notify_all()
+        for pooled in retired:
+            pooled.close()
+        logger.debug("Rotated %d pooled Nuci sessions.", len(fresh))
+
+
+class SessionRotator(threading.Thread):
+    """Daemon thread calling a rotation function periodically."""
+
+    def __init__(self, rotate, interval):
+        """
+        :param rotate: callable doing the rotation
+        :param interval: period of the rotation (in seconds)
+        """
+        super(SessionRotator, self).__init__(name="nuci-session-rotator")
+        self.daemon = True
+        self.rotate = rotate
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.rotate()
+            except Exception:
+                logger.exception("Rotation of Nuci sessions failed.")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,125 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+
+from contextlib import contextmanager
+from time import time
+
+logger = logging.getLogger("nuci.request_queue")
+
+
+class RequestStats(object):
+    """Timing statistics of requests served by a RequestQueue.
+
+    Global counters are kept for the whole run of Foris, local counters
+    are kept per thread and can be reset e.g. at the beginning of every
+    HTTP request to see how much of the page latency is caused by Nuci.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.calls = 0
+        self.total_wait = 0.0
+        self.total_execution = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, execution):
+        """Record timing of a single served request.
+
+        :param wait: time spent waiting in the queue (in seconds)
+        :param execution: time spent executing the request (in seconds)
+        """
+        with self._lock:
+            self.calls += 1
+            self.total_wait += wait
+            self.total_execution += execution
+            self.max_wait = max(self.max_wait, wait)
+        local = self.local_totals()
+        local['calls'] += 1
+        local['wait'] += wait
+        local['execution'] += execution
+
+    def reset_local(self):
+        """Reset counters of the current thread."""
+        self._local.totals = dict(calls=0, wait=0.0, execution=0.0)
+
+    def local_totals(self):
+        """Get counters of the current thread.
+
+        :return: dict with keys 'calls', 'wait' and 'execution'
+        """
+        if not hasattr(self._local, "totals"):
+            self.reset_local()
+        return self._local.totals
+
+    def as_dict(self):
+        with self._lock:
+            return dict(calls=self.calls, total_wait=self.total_wait,
+                        total_execution=self.total_execution, max_wait=self.max_wait)
+
+
+class RequestQueue(object):
+    """Fair FIFO queue serializing requests to a shared resource.
+
+    Every request draws a ticket and waits until its ticket is served,
+    so the requests are served strictly in the order of their arrival and
+    the next waiter is woken up as soon as the previous request finishes.
+    """
+
+    def __init__(self, name, stats=None):
+        """
+        :param name: name of the queue used in debug messages
+        :param stats: RequestStats instance to record timing into
+        """
+        self.name = name
+        self.stats = stats or RequestStats()
+        self._condition = threading.Condition(threading.Lock())
+        self._next_ticket = 0
+        self._now_serving = 0
+
+    @property
+    def waiting(self):
+        """Number of requests waiting in the queue (including the one being served)."""
+        with self._condition:
+            return self._next_ticket - self._now_serving
+
+    @contextmanager
+    def request(self, label=None):
+        """Context manager - the body is executed once the request gets its turn.
+
+        :param label: description of the request used in debug messages
+        """
+        enqueued = time()
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._now_serving:
+                self._condition.wait()
+        started = time()
+        try:
+            yield
+        finally:
+            finished = time()
+            with self._condition:
+                self._now_serving += 1
+                self._condition.notify_all()
+            wait, execution = started - enqueued, finished - started
+            self.stats.record(wait, execution)
+            logger.debug("%s: %s waited %.3f s, executed in %.3f s",
+                         self.name, label or "request", wait, execution)
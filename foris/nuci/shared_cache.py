@@ -0,0 +1,283 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Cache of uci data shared by all Foris processes running on the router
+(e.g. flup workers or CGI processes) through an SQLite database.
+
+Every invalidation increments a generation counter stored in the database,
+so the other processes know they have to drop their local copies.
+"""
+import errno
+import logging
+import os
+import sqlite3
+import stat
+import threading
+from contextlib import contextmanager
+from time import time
+
+from . import snapshot
+from .cache import path_segments
+
+logger = logging.getLogger("nuci.shared_cache")
+
+# the data contain e.g. the password hash, the directory must not be writable by others
+DEFAULT_PATH = "/var/run/foris/nuci-cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    path TEXT,
+    stored REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry_paths (
+    key TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entry_paths_path ON entry_paths (path);
+CREATE INDEX IF NOT EXISTS entry_paths_key ON entry_paths (key);
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO generation VALUES (0, 0);
+"""
+
+
+class SharedCache(object):
+    """Cache of uci data in an SQLite database shared by Foris processes."""
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=1024):
+        """
+        :param path: path to the database file, its directory is created if it doesn't exist
+        :param max_entries: maximum number of entries, the oldest ones are removed first
+        """
+        self.path = path
+        self.max_entries = max_entries
+        # connections can't be shared between threads nor inherited by forked processes
+        self._local = threading.local()
+        self._prepare_directory()
+        self._check_file()
+
+    def _prepare_directory(self):
+        """Create the directory of the database, check nobody else can modify it.
+
+        :raises: ValueError if the directory can't be trusted
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        dir_stat = os.lstat(directory)
+        # otherwise the file could be replaced by somebody else at any time
+        if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() \
+                or dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError("Directory of shared cache %s is not private." % self.path)
+
+    def _check_file(self):
+        """Check that the database file (if it exists) can be trusted.
+
+        :raises: ValueError if it's not a regular file owned by the current user
+        """
+        try:
+            file_stat = os.lstat(self.path)
+        except OSError:
+            return  # created by the first connection
+        self._check_stat(file_stat)
+
+    def _check_stat(self, file_stat):
+        # don't trust a file (or a link) planted by somebody else
+        if not stat.S_ISREG(file_stat.st_mode):
+            raise ValueError("Shared cache %s is not a regular file." % self.path)
+        if file_stat.st_uid != os.getuid():
+            raise ValueError("Shared cache %s is owned by another user." % self.path)
+
+    def _open_file(self):
+        """Create the database file readable only by the current user, or check
+        the existing one - on the opened file, so it can't be swapped meanwhile.
+
+        :raises: ValueError if the file can't be trusted
+        """
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_NOFOLLOW | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ELOOP:
+                    raise ValueError("Shared cache %s is not a regular file." % self.path)
+                raise
+        try:
+            self._check_stat(os.fstat(fd))
+            os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+
+    def _connection(self):
+        """Get connection of the current thread, open it on the first use in the process."""
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            try:
+                self._open_file()
+            except (ValueError, OSError) as e:
+                raise sqlite3.DatabaseError(str(e))
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.text_factory = str
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _key(key):
+        return repr(key)
+
+    def generation(self):
+        """Get the current generation - it's incremented by every invalidation.
+
+        :return: int, None if the database is not available
+        """
+        try:
+            return self._connection().execute(
+                "SELECT value FROM generation WHERE id = 0").fetchone()[0]
+        except sqlite3.Error:
+            logger.exception("Unable to read generation of shared Nuci cache.")
+            return None
+
+    def load(self, key):
+        """Get an entry.
+
+        :param key: key of the entry
+        :return: tuple (value, size, uci paths, path, age in seconds) or None
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT value, size, path, stored FROM entries WHERE key = ?",
+                (self._key(key), )).fetchone()
+            if row is None:
+                return None
+            paths = [path for path, in connection.execute(
+                "SELECT path FROM entry_paths WHERE key = ?", (self._key(key), ))]
+        except sqlite3.Error:
+            logger.exception("Unable to read shared Nuci cache.")
+            return None
+        raw, size, path, stored = row
+        try:
+            value = snapshot.loads(raw)
+        except ValueError:
+            # e.g. written by an older version of Foris
+            logger.warning("Invalid entry in shared Nuci cache: %r", key)
+            return None
+        return value, size, paths, path, max(time() - stored, 0)
+
+    def store(self, key, value, size, paths, path, generation):
+        """Store an entry, unless the cache was invalidated since `generation`.
+
+        :param key: key of the entry
+        :param value: Uci or Data instance
+        :param size: approximate size of the value (in bytes)
+        :param paths: uci paths contained in the value
+        :param path: uci path of the value, only for entries created by NuciCache.get()
+        :param generation: generation when the loading of the value started
+        :return: True if the value was stored
+        """
+        raw = snapshot.dumps(value)
+        db_key = self._key(key)
+        try:
+            with self._transaction() as connection:
+                current = connection.execute(
+                    "SELECT value FROM generation WHERE id = 0").fetchone()[0]
+                if current != generation:
+                    return False
+                connection.execute("DELETE FROM entry_paths WHERE key = ?", (db_key, ))
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, path, stored) "
+                    "VALUES (?, ?, ?, ?, ?)", (db_key, raw, size, path, time()))
+                connection.executemany(
+                    "INSERT INTO entry_paths (key, path) VALUES (?, ?)",
+                    [(db_key, ".".join(path_segments(entry_path))) for entry_path in paths])
+                self._trim(connection)
+        except sqlite3.Error:
+            logger.exception("Unable to write to shared Nuci cache.")
+            return False
+        return True
+
+    def _trim(self, connection):
+        connection.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+            "ORDER BY stored DESC LIMIT -1 OFFSET ?)", (self.max_entries, ))
+        connection.execute(
+            "DELETE FROM entry_paths WHERE key NOT IN (SELECT key FROM entries)")
+
+    def invalidate(self, paths, keep_above=False):
+        """Remove entries containing data of the uci paths and increment the generation.
+
+        :param paths: list of uci paths, None for all the entries
+        :param keep_above: keep entries of NuciCache.get() for paths containing the paths
+        :return: new generation or None on failure
+        """
+        try:
+            with self._transaction() as connection:
+                if paths is None:
+                    connection.execute("DELETE FROM entries")
+                    connection.execute("DELETE FROM entry_paths")
+                else:
+                    for path in paths:
+                        self._invalidate_path(connection, path_segments(path), keep_above)
+                    connection.execute(
+                        "DELETE FROM entry_paths WHERE key NOT IN (SELECT key FROM entries)")
+                connection.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+                return connection.execute(
+                    "SELECT value FROM generation WHERE id = 0").fetchone()[0]
+        except sqlite3.Error:
+            logger.exception("Unable to invalidate shared Nuci cache.")
+            return None
+
+    def _invalidate_path(self, connection, segments, keep_above):
+        path = ".".join(segments)
+        # entries under the path
+        if path:
+            connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entry_paths "
+                "WHERE path = ? OR substr(path, 1, ?) = ?)", (path, len(path) + 1, path + "."))
+        else:
+            connection.execute("DELETE FROM entries")
+        # entries containing the path
+        above = [".".join(segments[:length]) for length in range(len(segments))]
+        if above:
+            connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entry_paths "
+                "WHERE path IN (%s))%s" % (", ".join("?" * len(above)),
+                                           " AND path IS NULL" if keep_above else ""),
+                above)
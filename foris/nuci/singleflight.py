@@ -0,0 +1,86 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sys
+import threading
+
+logger = logging.getLogger("nuci.singleflight")
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.shared = 0
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls with the same key into a single one.
+
+    The first caller (the leader) executes the function, callers with the
+    same key arriving before it finishes wait for it and get the same
+    result - or the same exception. Mutable results must be copied for the
+    waiting callers by the `share` function, otherwise they're shared.
+    """
+
+    def __init__(self, name, share=None):
+        """
+        :param name: name used in debug messages
+        :param share: function copying the result for each of the waiting callers
+        """
+        self.name = name
+        self.share = share
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Call func unless a call with the same key is in progress already.
+
+        :param key: hashable key identifying the call
+        :param func: function without arguments
+        :return: result of func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.shared += 1
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+            if call.shared:
+                logger.debug("%s: result shared with %d callers", self.name, call.shared)
+        else:
+            call.event.wait()
+
+        if call.exc_info:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        if not leader and self.share is not None:
+            return self.share(call.result)
+        return call.result
@@ -0,0 +1,145 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compact snapshots of Uci trees, e.g. for storing them in files or comparing them.
+
+A snapshot is JSON made of nested lists:
+
+    [version, "uci", [config, ...]]        Uci
+    [version, "config", config]            Config
+    [version, "data", [[config, ...], ...]] Data with Uci trees
+
+    config = [name, [section, ...]]
+    section = [name, type, anonymous, [option or list, ...]]
+    option = [name, value]
+    list = [name, [content or [index, content], ...]]
+
+Contents of the list values are stored without indexes when they're numbered
+from zero. Operations of the nodes (remove, replace, ...) are not stored.
+The trees are created lazily - the nodes are created on the first access.
+"""
+import hashlib
+import json
+
+from .modules.base import Data
+from .modules.uci_raw import Uci, Config, Section, Option, List, Value
+
+VERSION = 1
+
+
+def _dump_config(config):
+    return [config.name, [_dump_section(section) for section in config.children]]
+
+
+def _dump_section(section):
+    items = []
+    for child in section.children:
+        if isinstance(child, List):
+            values = child.children
+            if all(value.index == str(i) for i, value in enumerate(values)):
+                items.append([child.name, [value.content for value in values]])
+            else:
+                items.append([child.name, [[value.index, value.content] for value in values]])
+        else:
+            items.append([child.name, child.value])
+    return [section.name, section.type, section.anonymous, items]
+
+
+def _load_config(item):
+    config = Config(item[0])
+    config.add_lazy(item[1], _first, _load_section)
+    return config
+
+
+def _load_section(item):
+    name, type_, anonymous, items = item
+    section = Section(name, type_, anonymous)
+    section.add_lazy(items, _first, _load_option)
+    return section
+
+
+def _load_option(item):
+    name, value = item
+    if not isinstance(value, list):
+        return Option(name, value)
+    list_ = List(name)
+    for i, content in enumerate(value):
+        list_.add(Value(*content) if isinstance(content, list) else Value(i, content))
+    return list_
+
+
+def _first(item):
+    return item[0]
+
+
+def _load_uci(configs):
+    uci = Uci()
+    uci.add_lazy(configs, _first, _load_config)
+    return uci
+
+
+def dumps(node):
+    """Create snapshot of a Uci tree.
+
+    :param node: Uci, Config or Data instance with Uci trees
+    :return: str
+    """
+    if isinstance(node, Data):
+        if any(type(uci) is not Uci for uci in node.children):
+            raise TypeError("Unable to create snapshot of data other than Uci.")
+        snapshot = [VERSION, "data",
+                    [[_dump_config(config) for config in uci.children] for uci in node.children]]
+    elif isinstance(node, Config):
+        snapshot = [VERSION, "config", _dump_config(node)]
+    elif type(node) is Uci:
+        snapshot = [VERSION, "uci", [_dump_config(config) for config in node.children]]
+    else:
+        raise TypeError("Unable to create snapshot of %s." % node)
+    return json.dumps(snapshot, separators=(",", ":"))
+
+
+def loads(raw):
+    """Create Uci tree from its snapshot.
+
+    :param raw: snapshot created by dumps()
+    :return: Uci, Config or Data instance
+    :raises: ValueError if it's not a valid snapshot
+    """
+    try:
+        version, kind, payload = json.loads(raw)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid snapshot of Uci tree.")
+    if version != VERSION:
+        raise ValueError("Unsupported version of snapshot: %s" % version)
+    if kind == "uci":
+        return _load_uci(payload)
+    if kind == "config":
+        return _load_config(payload)
+    if kind == "data":
+        data = Data()
+        for configs in payload:
+            data.add(_load_uci(configs))
+        return data
+    raise ValueError("Unknown kind of snapshot: %s" % kind)
+
+
+def digest(node):
+    """Get hash of a Uci tree, equal trees have equal hashes.
+
+    :param node: Uci, Config or Data instance with Uci trees
+    :return: hex digest
+    """
+    return hashlib.sha1(dumps(node)).hexdigest()
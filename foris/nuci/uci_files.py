@@ -0,0 +1,309 @@
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Reading of uci configuration directly from the UCI files (/etc/config/*),
+without the round trip through Nuci.
+
+The result is the same tree of uci_raw objects as the one Nuci would return
+for the same filter. Only the reads can be done this way, all the changes
+must go through Nuci, which also restarts the affected services.
+"""
+import logging
+import os
+import platform
+import re
+import threading
+
+from .modules.base import Data
+from .modules.uci_raw import Uci, Config, Section, Option, List, Value
+
+logger = logging.getLogger("nuci.uci_files")
+
+DEFAULT_DIRECTORY = "/etc/config"
+
+# a word of UCI file - sequence of quoted and unquoted parts
+_WORD = re.compile(r"""(?:'[^']*'|"(?:[^"\\]|\\.)*"|\\.|[^\s'"\\])+""")
+_PART = re.compile(r"""'([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)|([^\s'"\\]+)""")
+_ESCAPE = re.compile(r"\\(.)")
+
+
+# libuci hashes plain chars for the names of anonymous sections, so the names
+# depend on their signedness - unsigned on ARM and PowerPC (Turris routers), signed on x86
+SIGNED_CHAR = not platform.machine().lower().startswith(
+    ("arm", "aarch64", "ppc", "powerpc", "s390"))
+
+
+class UciParseError(ValueError):
+    pass
+
+
+def _unquote(word):
+    parts = []
+    for single, double, escaped, plain in _PART.findall(word):
+        parts.append(single or _ESCAPE.sub(r"\1", double) or escaped or plain)
+    return "".join(parts)
+
+
+def tokenize(line):
+    """Split a line of UCI file to words, the same way as libuci does.
+
+    :param line: line of the file
+    :return: list of words (without quotes and escapes)
+    """
+    words = []
+    pos = 0
+    length = len(line)
+    while True:
+        while pos < length and line[pos].isspace():
+            pos += 1
+        if pos == length or line[pos] == "#":
+            return words
+        match = _WORD.match(line, pos)
+        if not match:
+            raise UciParseError("unterminated quote")
+        words.append(_unquote(match.group()))
+        pos = match.end()
+
+
+def _djbhash(hash, string, signed_char=SIGNED_CHAR):
+    """Hash function used by libuci for names of anonymous sections."""
+    if hash == 0xffffffff:
+        hash = 5381
+    for char in string:
+        code = ord(char)
+        if signed_char and code > 127:
+            code -= 256
+        hash = ((hash << 5) + hash + code) & 0xffffffff
+    return hash & 0x7fffffff
+
+
+def _anonymous_name(index, type_, options, signed_char=SIGNED_CHAR):
+    """Name of an anonymous section assigned by libuci.
+
+    :param index: 1-based position of the section in the config
+    :param type_: type of the section
+    :param options: list of tuples (name, value), value is a list for UCI lists
+    :param signed_char: whether libuci was built with signed chars
+    """
+    hash = _djbhash(0xffffffff, type_, signed_char)
+    for name, value in options:
+        hash = _djbhash(hash, name, signed_char)
+        if not isinstance(value, list):
+            hash = _djbhash(hash, value, signed_char)
+    return "cfg%02x%04x" % (index, hash % (1 << 16))
+
+
+def parse_uci(text):
+    """Parse contents of a UCI config file.
+
+    Sections with the same name are merged the way libuci does it - the options are added
+    to the first one and the type is taken from the last one.
+
+    :param text: contents of the file
+    :return: list of tuples (name, type, anonymous, list of tuples (option name, value)),
+             value is a list of strings for UCI lists
+    :raises: UciParseError when the file is malformed
+    """
+    sections = []
+    current = [None]  # index of the section being parsed
+
+    def finish():
+        index = current[0]
+        if index is not None and sections[index][0] is None:
+            _, type_, _, options = sections[index]
+            # libuci counts the sections created so far
+            sections[index] = (_anonymous_name(len(sections), type_, options), type_, True,
+                               options)
+
+    options = None
+    for line_no, line in enumerate(text.splitlines(), 1):
+        try:
+            words = tokenize(line)
+        except UciParseError as e:
+            raise UciParseError("line %d: %s" % (line_no, e))
+        if not words:
+            continue
+        keyword, args = words[0], words[1:]
+        if keyword == "package":
+            continue
+        if keyword == "config" and 1 <= len(args) <= 2:
+            finish()
+            name = args[1] if len(args) > 1 else None
+            for index, (other_name, _, anonymous, other_options) in enumerate(sections):
+                if name is not None and other_name == name:
+                    options = other_options
+                    sections[index] = (name, args[0], anonymous, options)
+                    current[0] = index
+                    break
+            else:
+                options = []
+                sections.append((name, args[0], name is None, options))
+                current[0] = len(sections) - 1
+        elif keyword == "option" and options is not None and len(args) == 2:
+            for i, (name, _) in enumerate(options):
+                if name == args[0]:
+                    options[i] = (name, args[1])
+                    break
+            else:
+                options.append((args[0], args[1]))
+        elif keyword == "list" and options is not None and len(args) == 2:
+            for name, values in options:
+                if name == args[0] and isinstance(values, list):
+                    values.append(args[1])
+                    break
+            else:
+                options[:] = [item for item in options if item[0] != args[0]]
+                options.append((args[0], [args[1]]))
+        else:
+            raise UciParseError("line %d: unexpected statement '%s'" % (line_no, keyword))
+    finish()
+    return sections
+
+
+def _build_section(name, type_, anonymous, options, wanted=None):
+    """Create Section with its options and lists.
+
+    :param wanted: names of the options and lists to include, None for all
+    """
+    section = Section(name, type_, anonymous)
+    for option_name, value in options:
+        if wanted and option_name not in wanted:
+            continue
+        if isinstance(value, list):
+            list_ = section.add(List(option_name))
+            for index, content in enumerate(value):
+                list_.add(Value(index, content))
+        else:
+            section.add(Option(option_name, value))
+    return section
+
+
+def _names(element, tag):
+    """Get names of the children of a filter element, None if they're not restricted."""
+    names = {}
+    for child in element.findall(Uci.qual_tag(tag)):
+        name = child.findtext(Uci.qual_tag("name"))
+        if name is None:
+            return None
+        names[name] = child
+    return names or None
+
+
+class UciFileReader(object):
+    """Reader of UCI files, keeping the parsed files until they're modified."""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        """
+        :param directory: directory with the UCI files
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        # config name -> (mtime, inode, size, parsed sections)
+        self._files = {}
+
+    def config_names(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory)
+                          if not name.startswith(".")
+                          and os.path.isfile(os.path.join(self.directory, name)))
+        except OSError:
+            return []
+
+    def load(self, name):
+        """Get parsed config, parse the file again only if it was changed.
+
+        :param name: name of the config
+        :return: list of sections (see parse_uci()), None if there's no such config
+        :raises: UciParseError when the file is malformed
+        """
+        if not name or "/" in name or name.startswith("."):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # files are replaced by libuci, so the inode changes even if mtime doesn't
+        version = (stat.st_mtime, stat.st_ino, stat.st_size)
+        with self._lock:
+            cached = self._files.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            with open(path) as f:
+                text = f.read()
+        except IOError:
+            return None
+        try:
+            # the values are decoded by uci_raw, the anonymous names are hashed from bytes
+            text.decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise UciParseError("%s: %s" % (path, e))
+        try:
+            sections = parse_uci(text)
+        except UciParseError as e:
+            raise UciParseError("%s: %s" % (path, e))
+        with self._lock:
+            self._files[name] = (version, sections)
+        return sections
+
+    def get_config(self, name, filter_element=None):
+        """Get config as a uci_raw tree.
+
+        :param name: name of the config
+        :param filter_element: <config> element of a subtree filter
+        :return: Config instance or None if there's no such config
+        """
+        sections = self.load(name)
+        if sections is None:
+            return None
+        wanted = _names(filter_element, "section") if filter_element is not None else None
+        config = Config(name)
+        for section_name, type_, anonymous, options in sections:
+            if wanted is not None:
+                if section_name not in wanted:
+                    continue
+                wanted_options = _names(wanted[section_name], "option") or {}
+                wanted_options.update(_names(wanted[section_name], "list") or {})
+            else:
+                wanted_options = None
+            config.add(_build_section(section_name, type_, anonymous, options,
+                                      wanted_options))
+        return config
+
+    def get_uci(self, filter_element=None):
+        """Get configs selected by a filter, the same ones as Nuci would return.
+
+        :param filter_element: <uci> element of a subtree filter, None for all the configs
+        :return: Uci instance
+        """
+        uci = Uci()
+        wanted = _names(filter_element, "config") if filter_element is not None else None
+        for name in sorted(wanted) if wanted is not None else self.config_names():
+            config = self.get_config(name, wanted[name] if wanted is not None else None)
+            if config is not None:
+                uci.add(config)
+        return uci
+
+    def get(self, filter_element=None):
+        """Counterpart of foris.nuci.client.get() for uci filters.
+
+        :param filter_element: <uci> element of a subtree filter, None for all the configs
+        :return: Data instance
+        """
+        data = Data()
+        data.add(self.get_uci(filter_element))
+        return data
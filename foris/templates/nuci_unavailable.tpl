@@ -0,0 +1,27 @@
+%# Foris - web administration interface for OpenWrt based on NETCONF
+%# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+%#
+%# This program is free software: you can redistribute it and/or modify
+%# it under the terms of the GNU General Public License as published by
+%# the Free Software Foundation, either version 3 of the License, or
+%# (at your option) any later version.
+%#
+%# This program is distributed in the hope that it will be useful,
+%# but WITHOUT ANY WARRANTY; without even the implied warranty of
+%# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+%# GNU General Public License for more details.
+%#
+%# You should have received a copy of the GNU General Public License
+%# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+%#
+%rebase("_layout.tpl", title=trans("Service unavailable"))
+<div id="login-page">
+    <h1>{{ trans("Service unavailable") }}</h1>
+    <p>{{ trans("The router configuration backend is not responding. Please try reloading the page later.") }}</p>
+    %if retry_after is not None:
+    <p>{{ trans("Next connection attempt in %d seconds.") % (int(retry_after) + 1) }}</p>
+    %end
+    %if reason:
+    <p><small>{{ reason }}</small></p>
+    %end
+</div>
@@ -0,0 +1,635 @@
+#!/usr/bin/env python
+# Foris - web administration interface for OpenWrt based on NETCONF
+# Copyright (C) 2017 CZ.NIC, z.s.p.o. <http://www.nic.cz>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Stand-in for Nuci speaking NETCONF over stdio, for tests and benchmarks
+on machines without the real Nuci.
+
+Configuration is read from (and written to) a directory of UCI files,
+the data of other namespaces are static. Only the standard library is used,
+so it can be run by any Python 2 interpreter:
+
+    foris --nucipath "python foris/tests/fake_nuci.py --config-dir /tmp/config --latency 0.05"
+
+Directory in NUCI_TEST_CONFIG_DIR environment variable is used if --config-dir
+is not set (see StaticNetconfConnection.enable_test_environment).
+"""
+import argparse
+import base64
+import logging
+import os
+import platform
+import shlex
+import socket
+import sys
+import time
+from xml.etree import cElementTree as ET
+
+logger = logging.getLogger("fake_nuci")
+
+DELIMITER = "]]>]]>"
+
+NC_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+UCI_NS = "http://www.nic.cz/ns/router/uci-raw"
+STATS_NS = "http://www.nic.cz/ns/router/stats"
+UPDATER_NS = "http://www.nic.cz/ns/router/updater"
+TIME_NS = "http://www.nic.cz/ns/router/time"
+NOTIFY_NS = "http://www.nic.cz/ns/router/user-notify"
+MAINTAIN_NS = "http://www.nic.cz/ns/router/maintain"
+REGISTRATION_NS = "http://www.nic.cz/ns/router/registration"
+NETWORK_NS = "http://www.nic.cz/ns/router/network"
+PADDING_NS = "http://www.nic.cz/ns/router/fake-nuci"
+
+
+def qual(ns, tag):
+    return "{%s}%s" % (ns, tag)
+
+
+def sub(parent, ns, tag, text=None):
+    element = ET.SubElement(parent, qual(ns, tag))
+    if text is not None:
+        element.text = text
+    return element
+
+
+class RPCFailed(Exception):
+    def __init__(self, message, tag="operation-failed"):
+        super(RPCFailed, self).__init__(message)
+        self.tag = tag
+
+
+# signedness of plain chars hashed by libuci on this machine
+SIGNED_CHAR = platform.machine().lower() in ("x86_64", "amd64", "i386", "i686", "mips", "mipsel")
+
+
+def djbhash(hash, string, signed_char=SIGNED_CHAR):
+    """Hash function used by libuci for names of anonymous sections."""
+    if hash == 0xffffffff:
+        hash = 5381
+    for char in string:
+        code = ord(char)
+        if signed_char and code >= 0x80:
+            code -= 0x100
+        hash = ((hash << 5) + hash + code) & 0xffffffff
+    return hash & 0x7fffffff
+
+
+class UciSection(object):
+    def __init__(self, type, name=None):
+        self.type = type
+        self.name = name
+        self.anonymous = name is None
+        self.options = []  # list of tuples (name, value), value is a list for UCI lists
+
+    def get(self, name):
+        for option_name, value in self.options:
+            if option_name == name:
+                return value
+        return None
+
+    def set(self, name, value):
+        for i, (option_name, _) in enumerate(self.options):
+            if option_name == name:
+                self.options[i] = (name, value)
+                return
+        self.options.append((name, value))
+
+    def delete(self, name):
+        self.options = [(n, v) for n, v in self.options if n != name]
+
+    def fix_anonymous_name(self, index, signed_char=SIGNED_CHAR):
+        """Name anonymous section the same way as libuci does.
+
+        :param index: number of the sections in the config created so far
+        :param signed_char: whether libuci was built with signed chars
+        """
+        hash = djbhash(0xffffffff, self.type, signed_char)
+        for name, value in self.options:
+            hash = djbhash(hash, name, signed_char)
+            if not isinstance(value, list):
+                hash = djbhash(hash, value, signed_char)
+        self.name = "cfg%02x%04x" % (index, hash % (1 << 16))
+
+
+def parse_uci(text):
+    """Parse contents of a UCI config file.
+
+    :param text: contents of the file
+    :return: list of UciSection instances
+    :raises: ValueError when the file is malformed
+    """
+    sections = []
+    section = None
+    for line_no, line in enumerate(text.splitlines(), 1):
+        try:
+            tokens = shlex.split(line, comments=True)
+        except ValueError as e:
+            raise ValueError("line %d: %s" % (line_no, e))
+        if not tokens:
+            continue
+        keyword, args = tokens[0], tokens[1:]
+        if keyword == "package":
+            continue
+        if keyword == "config" and 1 <= len(args) <= 2:
+            if section and section.name is None:
+                section.fix_anonymous_name(len(sections))
+            name = args[1] if len(args) > 1 else None
+            # libuci adds the options of a section with the same name to the existing one
+            existing = [s for s in sections if name is not None and s.name == name]
+            if existing:
+                section = existing[0]
+                section.type = args[0]
+            else:
+                section = UciSection(args[0], name)
+                sections.append(section)
+        elif keyword == "option" and section and len(args) == 2:
+            section.set(args[0], args[1])
+        elif keyword == "list" and section and len(args) == 2:
+            values = section.get(args[0])
+            if not isinstance(values, list):
+                values = []
+                section.set(args[0], values)
+            values.append(args[1])
+        else:
+            raise ValueError("line %d: unexpected statement '%s'" % (line_no, keyword))
+    if section and section.name is None:
+        section.fix_anonymous_name(len(sections))
+    return sections
+
+
+def _quote(value):
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+def format_uci(sections):
+    """Format sections as a UCI config file.
+
+    :param sections: list of UciSection instances
+    :return: contents of the file
+    """
+    lines = []
+    for section in sections:
+        if section.anonymous:
+            lines.append("config %s" % section.type)
+        else:
+            lines.append("config %s %s" % (section.type, _quote(section.name)))
+        for name, value in section.options:
+            if isinstance(value, list):
+                for item in value:
+                    lines.append("\tlist %s %s" % (name, _quote(item)))
+            else:
+                lines.append("\toption %s %s" % (name, _quote(value)))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _filtered(filter_element, *tags):
+    """Get the filter elements of the wanted children by their names.
+
+    :param filter_element: element of a subtree filter, None for no filter
+    :param tags: tags of the children in the filter
+    :return: dict name -> element, None if all the children are wanted
+    """
+    if filter_element is None:
+        return None
+    filtered = {}
+    for tag in tags:
+        for child in filter_element.findall(qual(UCI_NS, tag)):
+            name = child.findtext(qual(UCI_NS, "name"))
+            if name is None:
+                return None  # selection node, all of them are wanted
+            filtered[name] = child
+    return filtered or None
+
+
+class UciStore(object):
+    """UCI configs stored in a directory, reloaded when the files change."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._configs = {}  # name -> (mtime, list of sections)
+
+    def names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if not name.startswith(".") and
+                      os.path.isfile(os.path.join(self.directory, name)))
+
+    def load(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        cached = self._configs.get(name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path) as f:
+            sections = parse_uci(f.read())
+        self._configs[name] = (mtime, sections)
+        return sections
+
+    def save(self, name, sections):
+        path = os.path.join(self.directory, name)
+        temp_path = os.path.join(self.directory, ".%s.tmp" % name)
+        with open(temp_path, "w") as f:
+            f.write(format_uci(sections))
+        os.rename(temp_path, path)
+        self._configs[name] = (os.stat(path).st_mtime, sections)
+
+    def to_element(self, filter_element=None):
+        """Build <uci> element of uci-raw namespace.
+
+        :param filter_element: <uci> element of a subtree filter
+        :return: Element
+        """
+        uci = ET.Element(qual(UCI_NS, "uci"))
+        configs = _filtered(filter_element, "config")
+        for name in sorted(configs) if configs is not None else self.names():
+            sections = self.load(name)
+            if sections is None:
+                continue
+            config = sub(uci, UCI_NS, "config")
+            sub(config, UCI_NS, "name", name)
+            section_filters = _filtered(configs[name] if configs else None, "section")
+            for section in sections:
+                if section_filters is None:
+                    self._section_element(config, section)
+                elif section.name in section_filters:
+                    self._section_element(
+                        config, section,
+                        _filtered(section_filters[section.name], "option", "list"))
+        return uci
+
+    @staticmethod
+    def _section_element(config, section, wanted=None):
+        """
+        :param wanted: names of the options and lists to include, None for all
+        """
+        element = sub(config, UCI_NS, "section")
+        sub(element, UCI_NS, "name", section.name)
+        sub(element, UCI_NS, "type", section.type)
+        if section.anonymous:
+            sub(element, UCI_NS, "anonymous")
+        for name, value in section.options:
+            if wanted is not None and name not in wanted:
+                continue
+            if isinstance(value, list):
+                list_element = sub(element, UCI_NS, "list")
+                sub(list_element, UCI_NS, "name", name)
+                for index, item in enumerate(value):
+                    value_element = sub(list_element, UCI_NS, "value")
+                    sub(value_element, UCI_NS, "index", str(index))
+                    sub(value_element, UCI_NS, "content", item)
+            else:
+                option = sub(element, UCI_NS, "option")
+                sub(option, UCI_NS, "name", name)
+                sub(option, UCI_NS, "value", value)
+
+    def edit(self, uci_element):
+        """Apply <uci> element of edit-config and save the modified configs."""
+        operation_attr = qual(NC_NS, "operation")
+        for config_element in uci_element.findall(qual(UCI_NS, "config")):
+            name = config_element.findtext(qual(UCI_NS, "name"))
+            sections = self.load(name)
+            if sections is None:
+                sections = []
+            for section_element in config_element.findall(qual(UCI_NS, "section")):
+                self._edit_section(sections, section_element, operation_attr)
+            self.save(name, sections)
+
+    def _edit_section(self, sections, element, operation_attr):
+        name = element.findtext(qual(UCI_NS, "name"))
+        type_ = element.findtext(qual(UCI_NS, "type"))
+        operation = element.get(operation_attr)
+        existing = [s for s in sections if s.name == name]
+        section = existing[0] if existing else None
+        if operation == "remove":
+            if section:
+                sections.remove(section)
+            return
+        if section is None or operation == "replace":
+            if type_ is None:
+                raise RPCFailed("Type of section '%s' is missing." % name)
+            new_section = UciSection(type_, name)
+            new_section.anonymous = element.find(qual(UCI_NS, "anonymous")) is not None
+            if section is not None:
+                sections[sections.index(section)] = new_section
+            else:
+                sections.append(new_section)
+            section = new_section
+        elif type_ is not None:
+            section.type = type_
+
+        for option in element.findall(qual(UCI_NS, "option")):
+            option_name = option.findtext(qual(UCI_NS, "name"))
+            if option.get(operation_attr) == "remove":
+                section.delete(option_name)
+            else:
+                section.set(option_name, option.findtext(qual(UCI_NS, "value")) or "")
+
+        for list_element in element.findall(qual(UCI_NS, "list")):
+            list_name = list_element.findtext(qual(UCI_NS, "name"))
+            list_operation = list_element.get(operation_attr)
+            if list_operation == "remove":
+                section.delete(list_name)
+                continue
+            values = section.get(list_name)
+            if list_operation in ("replace", "create") or not isinstance(values, list):
+                values = []
+            for value in list_element.findall(qual(UCI_NS, "value")):
+                index = int(value.findtext(qual(UCI_NS, "index")))
+                content = value.findtext(qual(UCI_NS, "content")) or ""
+                if value.get(operation_attr) == "remove":
+                    if index < len(values):
+                        values[index] = None
+                elif index < len(values):
+                    values[index] = content
+                else:
+                    values.append(content)
+            section.set(list_name, [v for v in values if v is not None])
+
+
+class FakeNuci(object):
+    def __init__(self, config_dir, latency=0.0, padding=0):
+        """
+        :param config_dir: directory with UCI configs
+        :param latency: delay of every reply (in seconds)
+        :param padding: size of junk data appended to every <get> reply (in bytes)
+        """
+        self.uci = UciStore(config_dir)
+        self.latency = latency
+        self.padding = padding
+        self.messages = []
+        self.started = time.time()
+
+    # NETCONF operations
+
+    def op_get(self, rpc_element, data_tag="data"):
+        data = ET.Element(qual(NC_NS, data_tag))
+        filter_element = rpc_element.find(qual(NC_NS, "filter"))
+        requested = list(filter_element) if filter_element is not None else None
+        builders = {
+            qual(UCI_NS, "uci"): self.uci.to_element,
+            qual(STATS_NS, "stats"): self.stats_element,
+            qual(UPDATER_NS, "updater"): self.updater_element,
+            qual(TIME_NS, "time"): self.time_element,
+            qual(NOTIFY_NS, "messages"): self.messages_element,
+        }
+        if requested is None:
+            for tag in (qual(UCI_NS, "uci"), qual(STATS_NS, "stats"), qual(UPDATER_NS, "updater"),
+                        qual(TIME_NS, "time"), qual(NOTIFY_NS, "messages")):
+                data.append(builders[tag]())
+        else:
+            for element in requested:
+                builder = builders.get(element.tag)
+                if builder is not None:
+                    data.append(builder(element) if element.tag == qual(UCI_NS, "uci")
+                                else builder())
+        if self.padding:
+            sub(data, PADDING_NS, "padding", "x" * self.padding)
+        return [data]
+
+    def op_get_config(self, rpc_element):
+        data = ET.Element(qual(NC_NS, "data"))
+        filter_element = rpc_element.find(qual(NC_NS, "filter"))
+        uci_filter = filter_element.find(qual(UCI_NS, "uci")) \
+            if filter_element is not None else None
+        data.append(self.uci.to_element(uci_filter))
+        return [data]
+
+    def op_edit_config(self, rpc_element):
+        config = rpc_element.find(qual(NC_NS, "config"))
+        if config is not None:
+            for uci_element in config.findall(qual(UCI_NS, "uci")):
+                self.uci.edit(uci_element)
+        return [ET.Element(qual(NC_NS, "ok"))]
+
+    # data of the other namespaces
+
+    def stats_element(self):
+        stats = ET.Element(qual(STATS_NS, "stats"))
+        sub(stats, STATS_NS, "model", "Turris Omnia")
+        sub(stats, STATS_NS, "board-name", "rtrom01")
+        sub(stats, STATS_NS, "hostname", socket.gethostname())
+        sub(stats, STATS_NS, "kernel-version", os.uname()[2])
+        sub(stats, STATS_NS, "turris-os-version", "3.7")
+        sub(stats, STATS_NS, "uptime", "%.2f" % (time.time() - self.started))
+        meminfo = sub(stats, STATS_NS, "meminfo")
+        sub(meminfo, STATS_NS, "MemTotal", "1033476")
+        sub(meminfo, STATS_NS, "MemFree", "692172")
+        interfaces = sub(stats, STATS_NS, "interfaces")
+        for name in ("eth0", "eth1", "br-lan"):
+            interface = sub(interfaces, STATS_NS, "interface")
+            sub(interface, STATS_NS, "name", name)
+            sub(interface, STATS_NS, "up")
+        for component in ("ucollect-sending", "firewall-sending"):
+            sending = sub(stats, STATS_NS, component)
+            sub(sending, STATS_NS, "status", "online")
+            sub(sending, STATS_NS, "age", "42")
+        return stats
+
+    def updater_element(self):
+        updater = ET.Element(qual(UPDATER_NS, "updater"))
+        activity = sub(updater, UPDATER_NS, "last_activity")
+        sub(activity, UPDATER_NS, "install", "foris")
+        for name, title in (("nas", "NAS"), ("netutils", "Extensions of network protocols")):
+            pkg_list = sub(updater, UPDATER_NS, "pkg-list")
+            sub(pkg_list, UPDATER_NS, "name", name)
+            title_element = sub(pkg_list, UPDATER_NS, "title", title)
+            title_element.set("{http://www.w3.org/XML/1998/namespace}lang", "en")
+            description = sub(pkg_list, UPDATER_NS, "description", "Packages of %s." % title)
+            description.set("{http://www.w3.org/XML/1998/namespace}lang", "en")
+        return updater
+
+    def time_element(self):
+        element = ET.Element(qual(TIME_NS, "time"))
+        now = time.time()
+        sub(element, TIME_NS, "local", time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)))
+        sub(element, TIME_NS, "timezone", time.strftime("%Z"))
+        sub(element, TIME_NS, "utc", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)))
+        return element
+
+    def messages_element(self):
+        messages = ET.Element(qual(NOTIFY_NS, "messages"))
+        for message_id, body, severity, timestamp, displayed in self.messages:
+            message = sub(messages, NOTIFY_NS, "message")
+            sub(message, NOTIFY_NS, "id", message_id)
+            body_element = sub(message, NOTIFY_NS, "body", body)
+            body_element.set("{http://www.w3.org/XML/1998/namespace}lang", "en")
+            sub(message, NOTIFY_NS, "severity", severity)
+            sub(message, NOTIFY_NS, "timestamp", str(timestamp))
+            if displayed:
+                sub(message, NOTIFY_NS, "displayed")
+        return messages
+
+    # RPCs of the Nuci plugins
+
+    def rpc_notify_test(self, element):
+        now = int(time.time())
+        self.messages.append(("%d-test" % now, "Testing message", "news", now, False))
+        return []
+
+    def rpc_notify_display(self, element):
+        displayed = set(e.text for e in element.findall(qual(NOTIFY_NS, "message-id")))
+        self.messages = [(i, b, s, t, d or i in displayed) for i, b, s, t, d in self.messages]
+        return []
+
+    def rpc_config_backup(self, element):
+        import tarfile
+        from io import BytesIO
+        buffer = BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:bz2") as tar:
+            tar.add(self.uci.directory, arcname="etc/config")
+        data = ET.Element(qual(MAINTAIN_NS, "data"))
+        data.text = base64.b64encode(buffer.getvalue())
+        return [data]
+
+    def rpc_reg_num(self, element):
+        reg_num = ET.Element(qual(REGISTRATION_NS, "reg-num"))
+        reg_num.text = "0123456789ABCDEF"
+        return [reg_num]
+
+    def rpc_serial(self, element):
+        serial = ET.Element(qual(REGISTRATION_NS, "serial"))
+        serial.text = "0000000B00009CD6"
+        return [serial]
+
+    def rpc_check_connection(self, element):
+        connection = ET.Element(qual(NETWORK_NS, "connection"))
+        for check in ("IPv4-connectivity", "IPv6-connectivity", "IPv4-gateway",
+                      "IPv6-gateway", "DNS", "DNSSEC"):
+            sub(connection, NETWORK_NS, check, "true")
+        return [connection]
+
+    def rpc_ok(self, element):
+        return []
+
+    def dispatch(self, rpc_element):
+        operation = rpc_element[0] if len(rpc_element) else None
+        if operation is None:
+            raise RPCFailed("Empty RPC.", "missing-element")
+        handlers = {
+            qual(NC_NS, "get"): self.op_get,
+            qual(NC_NS, "get-config"): self.op_get_config,
+            qual(NC_NS, "edit-config"): self.op_edit_config,
+            qual(NC_NS, "close-session"): self.rpc_ok,
+            qual(NOTIFY_NS, "test"): self.rpc_notify_test,
+            qual(NOTIFY_NS, "display"): self.rpc_notify_display,
+            qual(MAINTAIN_NS, "config-backup"): self.rpc_config_backup,
+            qual(MAINTAIN_NS, "config-restore"): self.rpc_ok,
+            qual(MAINTAIN_NS, "reboot"): self.rpc_ok,
+            qual(REGISTRATION_NS, "get"): self.rpc_reg_num,
+            qual(REGISTRATION_NS, "serial"): self.rpc_serial,
+            qual(REGISTRATION_NS, "contract-update"): self.rpc_ok,
+            qual(NETWORK_NS, "check"): self.rpc_check_connection,
+            qual(TIME_NS, "ntp"): self.rpc_ok,
+            qual(TIME_NS, "set"): self.rpc_ok,
+            qual(UPDATER_NS, "check"): self.rpc_ok,
+            qual("http://www.nic.cz/ns/router/password", "set"): self.rpc_ok,
+        }
+        handler = handlers.get(operation.tag)
+        if handler is None:
+            raise RPCFailed("Operation %s is not supported." % operation.tag,
+                            "operation-not-supported")
+        return handler(operation)
+
+    # transport
+
+    def reply(self, rpc_element):
+        reply = ET.Element(qual(NC_NS, "rpc-reply"), rpc_element.attrib)
+        try:
+            children = self.dispatch(rpc_element)
+            if not children:
+                children = [ET.Element(qual(NC_NS, "ok"))]
+            reply.extend(children)
+        except Exception as e:
+            # bad input (e.g. broken UCI file) fails the RPC, not the whole server
+            if not isinstance(e, (RPCFailed, ValueError, EnvironmentError)):
+                logger.exception("RPC failed.")
+            self._add_error(reply, e)
+        if self.latency:
+            time.sleep(self.latency)
+        return ET.tostring(reply)
+
+    @staticmethod
+    def _add_error(reply, exception):
+        error = sub(reply, NC_NS, "rpc-error")
+        sub(error, NC_NS, "error-type", "application")
+        sub(error, NC_NS, "error-tag", getattr(exception, "tag", "operation-failed"))
+        sub(error, NC_NS, "error-severity", "error")
+        sub(error, NC_NS, "error-message", str(exception))
+
+    def hello(self):
+        hello = ET.Element(qual(NC_NS, "hello"))
+        capabilities = sub(hello, NC_NS, "capabilities")
+        sub(capabilities, NC_NS, "capability", "urn:ietf:params:netconf:base:1.0")
+        sub(hello, NC_NS, "session-id", str(os.getpid()))
+        return ET.tostring(hello)
+
+    def serve(self, input_fd=0, output=sys.stdout):
+        def send(message):
+            output.write(message + DELIMITER)
+            output.flush()
+
+        send(self.hello())
+        buffer = ""
+        hello_received = False
+        while True:
+            chunk = os.read(input_fd, 65536)
+            if not chunk:
+                return
+            buffer += chunk
+            while DELIMITER in buffer:
+                message, buffer = buffer.split(DELIMITER, 1)
+                try:
+                    element = ET.fromstring(message)
+                except SyntaxError as e:
+                    reply = ET.Element(qual(NC_NS, "rpc-reply"))
+                    self._add_error(reply, RPCFailed("Malformed message: %s" % e,
+                                                     "malformed-message"))
+                    send(ET.tostring(reply))
+                    continue
+                if not hello_received:
+                    hello_received = True
+                    continue
+                if element.tag == qual(NC_NS, "close-session"):
+                    return
+                if element.tag == qual(NC_NS, "rpc"):
+                    send(self.reply(element))
+                    # like Nuci, close the session after replying, the RPCs
+                    # pipelined after it are dropped
+                    if element.find(qual(NC_NS, "close-session")) is not None:
+                        return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NETCONF stand-in for Nuci.")
+    parser.add_argument("--config-dir", default=os.environ.get("NUCI_TEST_CONFIG_DIR"),
+                        help="directory with UCI configs")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="delay of every reply (in seconds)")
+    parser.add_argument("--padding", type=int, default=0,
+                        help="junk appended to every <get> reply (in bytes)")
+    args = parser.parse_args()
+    if not args.config_dir:
+        parser.error("--config-dir or NUCI_TEST_CONFIG_DIR must be set")
+    FakeNuci(args.config_dir, args.latency, args.padding).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 # coding=utf-8
+import os
 import re
+import sys
 import time
 from subprocess import call
 from tempfile import NamedTemporaryFile
@@ -15,7 +17,7 @@ from webtest import TestApp, Upload, Text
 import foris.core
 from foris.nuci.client import StaticNetconfConnection
 
-from . import test_data
+from . import fake_nuci, test_data
 from .utils import uci_get, uci_set, uci_commit, uci_is_empty
 
 # dict of texts that are used to determine returned stated etc.
@@ -44,6 +46,10 @@ class ForisTest(TestCase):
     def setUpClass(cls):
         # load configs and monkey-patch env so Nuci uses them
         cls.restore_config()
+        if os.environ.get("FORIS_FAKE_NUCI"):
+            # run without the real Nuci
+            StaticNetconfConnection.set_bin_path(
+                "%s %s" % (sys.executable, fake_nuci.__file__.replace(".pyc", ".py")))
         StaticNetconfConnection.enable_test_environment(cls.config_directory)
         # initialize Foris WSGI app
         args = cls.make_args()
@@ -1,13 +1,36 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from StringIO import StringIO
 from xml.etree import cElementTree as ET
 
 import pytest
 
+from foris.nuci import deadline
+from foris.nuci import filters
+from foris.nuci import snapshot
+from foris.nuci import cache
+from foris.nuci.breaker import CircuitBreaker
+from foris.nuci.exceptions import NuciUnavailableError
+from foris.nuci.pool import SessionPool
+from foris.nuci.request_queue import RequestQueue
+from foris.nuci.singleflight import SingleFlight
+from foris.nuci.uci_files import UciFileReader, UciParseError
+from foris.tests import fake_nuci
+from foris.tests.fake_nuci import UciStore, format_uci, parse_uci
+from foris.nuci.modules.base import YinElement
 from foris.nuci.modules.uci_raw import (
     Uci,
     Config,
     Section,
     Option,
+    List,
+    Value,
     build_option_uci_tree,
+    uci_diff,
+    uci_paths,
 )
 
 
@@ -45,3 +68,1036 @@ def test_option_bool_serialization():
     option_bool = Option("test", False)
     option_str = Option("test", "0")
     assert option_bool.value == option_str.value == "0"
+
+
+def test_request_queue_fifo_order():
+    queue = RequestQueue("test")
+    served = []
+
+    def request(number):
+        with queue.request():
+            served.append(number)
+
+    threads = []
+    with queue.request():
+        for i in range(5):
+            thread = threading.Thread(target=request, args=(i,))
+            thread.start()
+            threads.append(thread)
+            # wait until the thread takes its ticket
+            while queue.waiting != i + 2:
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+
+    assert served == range(5)
+    assert queue.stats.calls == 6
+    assert queue.waiting == 0
+
+
+class DummySession(object):
+    connected = True
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_session_pool_recycling():
+    pool = SessionPool(DummySession, min_size=0, max_size=2, idle_timeout=60, max_age=60)
+    with pool.lease() as first:
+        with pool.lease() as second:
+            assert first.session is not second.session
+            assert pool.size == 2
+    assert pool.idle == 2
+
+    # broken session is not returned to the pool
+    with pool.lease() as pooled:
+        pooled.broken = True
+    assert pooled.session.closed
+    assert pool.size == 1
+
+    # old sessions are recycled
+    pool.max_age = 0
+    with pool.lease() as pooled:
+        pass
+    assert pooled.session.closed
+    assert pool.size == 0
+
+
+def test_session_pool_rotation():
+    pool = SessionPool(DummySession, min_size=1, max_size=2, idle_timeout=60, max_age=60)
+    # missing sessions are pre-spawned
+    pool.rotate(lead=10)
+    assert pool.size == 1 and pool.idle == 1
+
+    with pool.lease() as pooled:
+        pass
+    # session close to its max_age is replaced by a fresh one
+    pooled.created -= 55
+    pool.rotate(lead=10)
+    assert pooled.session.closed
+    assert pool.size == 1 and pool.idle == 1
+    with pool.lease() as fresh:
+        assert fresh.session is not pooled.session
+
+
+def test_single_flight_sharing():
+    flights = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return object()
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", slow)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(flights.do("key", slow)))
+    follower.start()
+    while not flights.coalesced:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(calls) == 1
+    assert results[0] is results[1]
+    # next call is executed again
+    flights.do("key", slow)
+    assert len(calls) == 2
+
+
+def test_single_flight_share():
+    flights = SingleFlight("test", share=lambda result: result.fork())
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+        uci = Uci()
+        uci.add(Config("foris")).add(Section("settings", "config")).add(Option("lang", "en"))
+        return uci
+
+    leader_results, follower_results = [], []
+    leader = threading.Thread(target=lambda: leader_results.append(flights.do("key", slow)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(
+        target=lambda: follower_results.append(flights.do("key", slow)))
+    follower.start()
+    while not flights.coalesced:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+    # the follower's modifications are not visible to the leader
+    follower_results[0].find_child("foris.settings.lang").value = "cs"
+    assert leader_results[0].find_child("foris.settings.lang").value == "en"
+
+
+def test_nuci_cache_coalesced_loads():
+    nuci_cache = cache.NuciCache()
+    started, release = threading.Event(), threading.Event()
+    loads, stores = [], []
+    store = nuci_cache.store
+
+    def counting_store(*args, **kwargs):
+        stores.append(args[0])
+        return store(*args, **kwargs)
+
+    nuci_cache.store = counting_store
+
+    def slow():
+        loads.append(None)
+        started.set()
+        release.wait()
+        uci = Uci()
+        uci.add(Config("foris")).add(Section("settings", "config")).add(Option("lang", "en"))
+        return uci, 10
+
+    results = []
+
+    def get():
+        results.append(nuci_cache.get_or_load("lang", ("uci", ), slow))
+
+    threads = [threading.Thread(target=get) for _ in range(3)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while nuci_cache._loads.coalesced < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    # only the first caller loaded and stored the value
+    assert len(loads) == 1 and stores == ["lang"]
+    # every caller got its own tree
+    results[0].find_child("foris.settings.lang").value = "cs"
+    assert [result.find_child("foris.settings.lang").value for result in results[1:]] \
+        == ["en", "en"]
+
+
+def test_circuit_breaker_states():
+    breaker = CircuitBreaker(failure_threshold=2, base_delay=0.05, max_delay=1)
+    breaker.before_call()
+    breaker.record_failure(IOError("nuci died"))
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(IOError("nuci died"))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(NuciUnavailableError):
+        breaker.before_call()
+    assert breaker.status()["last_failure"] == "nuci died"
+
+    time.sleep(0.1)
+    # single trial call is let through
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(NuciUnavailableError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_half_open_write():
+    from foris.nuci import client
+
+    connection = client.StaticNetconfConnection
+    saved = connection._breaker, connection._session, connection.__dict__["_spawn_session"]
+    spawned = []
+
+    def spawn_session(cls):
+        spawned.append(object())
+        return spawned[-1]
+
+    breaker = CircuitBreaker(failure_threshold=1, base_delay=0, max_delay=0)
+    breaker.record_failure(IOError("nuci died"))
+    connection._breaker, connection._session = breaker, None
+    connection._spawn_session = classmethod(spawn_session)
+    try:
+        def failing_write():
+            # the trial call reconnects the write session
+            assert connection._get_write_session().session is spawned[-1]
+            raise TypeError("operation failed")
+
+        with pytest.raises(TypeError):
+            connection._with_retries(failing_write)
+        # failed trial doesn't close the circuit
+        assert breaker.state == CircuitBreaker.OPEN
+
+        def write():
+            return connection._get_write_session().session
+
+        assert connection._with_retries(write) is spawned[-1]
+        assert breaker.state == CircuitBreaker.CLOSED
+    finally:
+        connection._breaker, connection._session, connection._spawn_session = saved
+
+
+def test_deadline_timeout_breaker():
+    from ncclient.operations.errors import TimeoutExpiredError
+    from foris.nuci import client
+
+    connection = client.StaticNetconfConnection
+    saved = connection._breaker
+    breaker = connection._breaker = CircuitBreaker(failure_threshold=1)
+    try:
+        def slow_read():
+            # ncclient waits for the reply at most until the deadline
+            time.sleep(deadline.budget(30) + 0.001)
+            raise TimeoutExpiredError("timed out")
+
+        with deadline.scope(0.01):
+            with pytest.raises(TimeoutExpiredError):
+                connection._with_retries(slow_read)
+        # the caller ran out of time, Nuci didn't fail
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        def stuck_read():
+            raise TimeoutExpiredError("timed out")
+
+        with pytest.raises(TimeoutExpiredError):
+            connection._with_retries(stuck_read)
+        assert breaker.state == CircuitBreaker.OPEN
+    finally:
+        connection._breaker = saved
+
+
+def test_config_backup_check():
+    import base64
+    import bz2
+    from foris.nuci import client
+
+    class Reply(object):
+        def __init__(self, payload):
+            self.xml = '<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">' \
+                '<data xmlns="http://www.nic.cz/ns/router/maintain">%s</data></rpc-reply>' \
+                % payload
+
+    backup = bz2.compress("".join(chr(i % 256) for i in range(100000)))
+    encoded = base64.b64encode(backup)
+    replies = []
+    saved = client.dispatch
+    client.dispatch = lambda rpc: replies.pop()
+    try:
+        replies.append(Reply(encoded))
+        assert "".join(client.get_config_backup(chunk_size=1000)) == backup
+        # damaged backups aren't returned, the page fails with an error then
+        for payload in (encoded[:-5], encoded[:len(encoded) // 2],
+                        base64.b64encode(backup[:-10]), encoded.replace("A", "B")):
+            replies.append(Reply(payload))
+            assert client.get_config_backup(chunk_size=1000) is None
+    finally:
+        client.dispatch = saved
+
+
+def test_batch_cache():
+    from ncclient.operations.errors import TimeoutExpiredError
+    from foris.nuci import client
+    from foris.nuci.modules import registration
+
+    class Reply(object):
+        def __init__(self, xml):
+            self.xml = xml
+
+    uci_reply = Reply('<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><data>'
+                      '<uci xmlns="%s"><config><name>foris</name></config></uci>'
+                      '</data></rpc-reply>' % Uci.NS_URI)
+    serial_reply = Reply('<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">'
+                         '<serial xmlns="%s">1234</serial></rpc-reply>'
+                         % registration.Serial.NS_URI)
+    status_rpc = registration.RegistrationStatus.rpc_get_status("user@example.com")
+    replies = {"get": uci_reply, "serial": serial_reply, "get-status": Reply("<status/>")}
+    sent = []
+
+    def execute_batch(calls, timeout=None):
+        tags = [args[0].tag.split("}")[1] if args else "get" for _, args, _ in calls]
+        sent.append(tags)
+        return [(None, TimeoutExpiredError()) if tag == "serial" and failing
+                else (replies[tag], None) for tag in tags]
+
+    def run_batch():
+        with client.batch() as batch:
+            config = batch.get(filter=filters.create_config_filter("foris"))
+            serial = client.get_serial(batch=batch)
+            status = batch.dispatch(status_rpc)
+        return config.result(), serial.result(), status.result()
+
+    connection = client.StaticNetconfConnection
+    saved = connection.__dict__["execute_batch"], connection._cache, connection._uci_files
+    connection.execute_batch = staticmethod(execute_batch)
+    connection._cache = cache.NuciCache()
+    connection._uci_files = None
+    try:
+        failing = True
+        config, serial, status = run_batch()
+        assert sent == [["get", "serial", "get-status"]]
+        assert config.find_child("uci.foris") is not None and serial is None
+        assert status.xml == "<status/>"
+        # the failed serial is asked for again, the config is cached, uncached RPCs are sent
+        failing = False
+        config, serial, status = run_batch()
+        assert sent[1:] == [["serial", "get-status"]]
+        assert serial.raw == "1234"
+        # every batch gets its own tree
+        config.find_child("uci.foris").add(Section("settings", "config"))
+        config, serial, status = run_batch()
+        assert sent[2:] == [["get-status"]]
+        assert serial.raw == "1234" and config.find_child("uci.foris.settings") is None
+        # the cache is shared with the single calls
+        assert client.get_serial().raw == "1234"
+        assert client.get(filters.create_config_filter("foris")).find_child("uci.foris")
+        assert len(sent) == 3
+    finally:
+        connection.execute_batch, connection._cache, connection._uci_files = saved
+
+
+def test_fake_nuci_uci_roundtrip():
+    text = "\n".join([
+        "config zone",
+        "\toption name 'lan'",
+        "\tlist network 'lan'",
+        "\tlist network \"guest_turris\"",
+        "",
+        "config rule 'dhcp'",
+        "\toption src 'it''s wan'",
+    ])
+    sections = parse_uci(text)
+    assert [s.type for s in sections] == ["zone", "rule"]
+    assert sections[0].anonymous and sections[0].name.startswith("cfg01")
+    assert sections[0].get("network") == ["lan", "guest_turris"]
+    assert sections[1].name == "dhcp"
+
+    reparsed = parse_uci(format_uci(sections))
+    assert [(s.name, s.type, s.options) for s in reparsed] == \
+        [(s.name, s.type, s.options) for s in sections]
+
+
+def _serve_fake_nuci(nuci, *messages):
+    """Send the messages to the fake Nuci pipelined in a single write.
+
+    :return: list of reply elements
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, "".join(message + fake_nuci.DELIMITER
+                                   for message in (nuci.hello(), ) + messages))
+        os.close(write_fd)
+        output = StringIO()
+        nuci.serve(read_fd, output)
+    finally:
+        os.close(read_fd)
+    return [ET.fromstring(reply) for reply in
+            output.getvalue().split(fake_nuci.DELIMITER)[1:] if reply]
+
+
+_FAKE_RPC = '<rpc xmlns="%s" message-id="%%d">%%s</rpc>' % fake_nuci.NC_NS
+
+
+def test_fake_nuci_close_session():
+    directory = tempfile.mkdtemp()
+    nuci = fake_nuci.FakeNuci(directory)
+    rpc = _FAKE_RPC
+    try:
+        # the session is closed in the middle of the pipelined RPCs
+        replies = _serve_fake_nuci(
+            nuci, rpc % (1, "<get-config><source><running/></source></get-config>"),
+            rpc % (2, "<get/><close-session/>"), rpc % (3, "<get/>"))
+        assert [reply.get("message-id") for reply in replies] == ["1", "2"]
+        assert replies[1].find(fake_nuci.qual(fake_nuci.NC_NS, "data")) is not None
+
+        # the usual close-session RPC of ncclient
+        replies = _serve_fake_nuci(nuci, rpc % (4, "<close-session/>"), rpc % (5, "<get/>"))
+        assert len(replies) == 1
+        assert replies[0].find(fake_nuci.qual(fake_nuci.NC_NS, "ok")) is not None
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_fake_nuci_bad_input():
+    directory = tempfile.mkdtemp()
+    nuci = fake_nuci.FakeNuci(directory)
+    rpc = _FAKE_RPC
+    get_config = "<get-config><source><running/></source></get-config>"
+    error_tag = fake_nuci.qual(fake_nuci.NC_NS, "rpc-error")
+    try:
+        with open(os.path.join(directory, "broken"), "w") as f:
+            f.write("config\n")
+        # errors are replied, the server keeps running
+        replies = _serve_fake_nuci(nuci, rpc % (1, get_config), "<rpc><get>", rpc % (2, "<get/>"))
+        assert len(replies) == 3
+        assert replies[0].find(error_tag) is not None
+        assert replies[1].find(error_tag).findtext(
+            fake_nuci.qual(fake_nuci.NC_NS, "error-tag")) == "malformed-message"
+        assert replies[2].find(error_tag) is not None
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_fake_nuci_anonymous_names():
+    # names generated by libuci built with signed and unsigned chars
+    sections = [
+        (1, "defaults", [("input", "ACCEPT"), ("syn_flood", "1")], "cfg01669b", "cfg01669b"),
+        (2, "zone", [("name", "lan"), ("network", ["lan"])], "cfg02b587", "cfg02b587"),
+        (3, "rule", [("name", "\xc5\xbeluva"), ("src", "wan")], "cfg03d187", "cfg037387"),
+        (12, "host", [("name", "caf\xc3\xa9"), ("mac", "00:11:22:33:44:55")],
+         "cfg0cc78b", "cfg0ce98b"),
+    ]
+    for index, type_, options, signed, unsigned in sections:
+        section = fake_nuci.UciSection(type_)
+        section.options = options
+        section.fix_anonymous_name(index, signed_char=True)
+        assert section.name == signed
+        section.fix_anonymous_name(index, signed_char=False)
+        assert section.name == unsigned
+
+
+def test_deadline_budget():
+    assert deadline.budget(30) == 30
+    with deadline.scope(10):
+        assert 9 < deadline.budget(30) <= 10
+        with deadline.scope(60):
+            # nested scope can't prolong the deadline
+            assert deadline.budget(30) <= 10
+        assert not deadline.allows(20)
+    with deadline.scope(0):
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.budget(30)
+    assert deadline.remaining() is None
+
+
+def test_nuci_cache_lru_and_ttl():
+    nuci_cache = cache.NuciCache(max_entries=2, max_bytes=100, ttls={"stats": 0})
+
+    assert nuci_cache.get_or_load("a", ("uci", ), lambda: ("A", 10)) == "A"
+    assert nuci_cache.get_or_load("b", ("registration", ), lambda: ("B", 10)) == "B"
+    assert nuci_cache.lookup("a") == "A"
+    # "b" is the least recently used entry
+    nuci_cache.store("c", "C", ("uci", ), 10)
+    assert nuci_cache.lookup("b") is cache.MISSING
+    # too many bytes
+    nuci_cache.store("d", "D", ("uci", ), 85)
+    assert nuci_cache.lookup("a") is cache.MISSING
+
+    # not cached namespace
+    assert not nuci_cache.store("t", "T", ("time", ), 1)
+
+    # expires right away
+    nuci_cache.store("s", "S", ("stats", ), 1)
+    assert nuci_cache.lookup("s") is cache.MISSING
+    assert nuci_cache.lookup("d") == "D"
+
+    nuci_cache.invalidate("")
+    assert nuci_cache.lookup("d") is cache.MISSING
+    stats = nuci_cache.stats()
+    assert stats["entries"] == 0 and stats["bytes"] == 0
+    assert stats["evictions"] == 3 and stats["expirations"] == 1
+
+
+def test_nuci_cache_uci_expiration():
+    from foris.nuci import shared_cache
+
+    # the configuration is changed outside of Foris (e.g. by uci command)
+    backing = {"lang": "cs"}
+
+    def load():
+        uci = Uci()
+        uci.add(Config("foris")).add(Section("settings", "config")) \
+            .add(Option("lang", backing["lang"]))
+        return uci, 10
+
+    def lang(nuci_cache):
+        return nuci_cache.get_or_load("lang", ("uci", ), load) \
+            .find_child("foris.settings.lang").value
+
+    clock = [1000.0]
+    saved = cache.monotonic, shared_cache.time
+    cache.monotonic = shared_cache.time = lambda: clock[0]
+    directory = tempfile.mkdtemp()
+    try:
+        ttl = cache.NuciCache.DEFAULT_TTLS["uci"]
+        assert ttl is not None
+        first, second = cache.NuciCache(), cache.NuciCache()
+        path = os.path.join(directory, "cache.sqlite")
+        first.set_shared(shared_cache.SharedCache(path))
+        second.set_shared(shared_cache.SharedCache(path))
+        assert lang(first) == "cs"
+        backing["lang"] = "en"
+        assert lang(first) == "cs"
+        assert lang(second) == "cs"  # from the shared cache
+
+        clock[0] += ttl
+        assert lang(first) == "en"
+        assert lang(second) == "en"
+        # the shared entry isn't used when it's outdated either
+        clock[0] += ttl
+        backing["lang"] = "de"
+        assert lang(second) == "de"
+    finally:
+        cache.monotonic, shared_cache.time = saved
+        shutil.rmtree(directory)
+
+
+def test_nuci_cache_invalidation_by_paths():
+    uci = Uci()
+    foris = Config("foris")
+    uci.add(foris)
+    settings = Section("settings", "config")
+    foris.add(settings)
+    settings.add(Option("lang", "cs"))
+    uci.add(Config("network"))
+    assert uci_paths(uci.get_xml()) == ["foris.settings.lang", "network"]
+
+    nuci_cache = cache.NuciCache()
+    nuci_cache.store("foris", "F", ("uci", ), 1, paths=["foris"])
+    nuci_cache.store("lang", "L", ("uci", ), 1, paths=["foris.settings.lang"])
+    nuci_cache.store("contract", "C", ("uci", ), 1, paths=["foris.contract"])
+    nuci_cache.store("zone", "Z", ("uci", ), 1, paths=["firewall.@zone[1]"])
+    nuci_cache.store("stats", "S", ("stats", ), 1)
+
+    nuci_cache.invalidate_paths(["foris.settings", "firewall.cfg02dc81"])
+    assert [key for key in ("foris", "lang", "contract", "zone", "stats")
+            if nuci_cache.lookup(key) is not cache.MISSING] == ["contract", "stats"]
+
+
+def test_nuci_cache_stale_while_revalidate():
+    nuci_cache = cache.NuciCache(ttls={"stats": 0})
+    loaded = []
+
+    def load():
+        loaded.append(len(loaded))
+        return loaded[-1], 1
+
+    assert nuci_cache.get_or_load("key", ("stats", ), load, max_stale=60) == 0
+    # outdated value is returned and refreshed in the background
+    assert nuci_cache.get_or_load("key", ("stats", ), load, max_stale=60) == 0
+    nuci_cache._refresher.tasks.join()
+    assert loaded == [0, 1]
+    assert nuci_cache.get_or_load("key", ("stats", ), load, max_stale=60) == 1
+    # outdated value isn't returned without max_stale
+    assert nuci_cache.get_or_load("key", ("stats", ), load) > 1
+
+
+def test_nuci_cache_path_index():
+    nuci_cache = cache.NuciCache()
+    for path in ("test", "test.cache1", "test.cache1.test1", "test.cache2.test1"):
+        nuci_cache.store(("uci-path", path), path, ("uci", ), 1, paths=[path], path=path)
+    assert sorted(nuci_cache.keys_under("test.cache1")) == \
+        [("uci-path", "test.cache1"), ("uci-path", "test.cache1.test1")]
+
+    nuci_cache.invalidate("test.cache1")
+    assert sorted(nuci_cache.keys_under("")) == \
+        [("uci-path", "test"), ("uci-path", "test.cache2.test1")]
+    nuci_cache.invalidate_paths(["test.cache2"])
+    assert nuci_cache.keys_under("") == []
+    assert nuci_cache._index.root.children == {}
+
+
+def test_shared_nuci_cache():
+    from foris.nuci.shared_cache import SharedCache
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "cache.sqlite")
+        shared_cache = SharedCache(path)
+        # the database is opened lazily, by each process separately
+        assert not os.path.exists(path)
+        first, second = cache.NuciCache(), cache.NuciCache()
+        first.set_shared(shared_cache)
+        second.set_shared(SharedCache(path))
+
+        uci = Uci()
+        uci.add(Config("foris")).add(Section("settings", "config")).add(Option("lang", "cs"))
+        paths = ["foris.settings.lang"]
+        first.get_or_load("lang", ("uci", ), lambda: (uci, 10), paths)
+        # loaded by the other process
+        shared = second.get_or_load("lang", ("uci", ), lambda: (None, 0), paths)
+        assert shared.find_child("foris.settings.lang").value == "cs"
+
+        # the cached tree is not affected by modifications of the returned one
+        shared.find_child("foris.settings.lang").value = "en"
+        assert second.get_or_load("lang", ("uci", ), lambda: (None, 0), paths) \
+            .find_child("foris.settings.lang").value == "cs"
+
+        second.invalidate_paths(["foris.settings"])
+        reloaded = Uci()
+        reloaded.add(Config("foris")).add(Section("settings", "config")) \
+            .add(Option("lang", "de"))
+        assert first.get_or_load("lang", ("uci", ), lambda: (reloaded, 0), paths) \
+            .find_child("foris.settings.lang").value == "de"
+
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+        # links and other special files are rejected
+        link = os.path.join(directory, "link.sqlite")
+        os.symlink(path, link)
+        with pytest.raises(ValueError):
+            SharedCache(link)
+        os.mkdir(os.path.join(directory, "subdirectory"), 0o700)
+        with pytest.raises(ValueError):
+            SharedCache(os.path.join(directory, "subdirectory"))
+        # even when they're planted after the check
+        planted = SharedCache(os.path.join(directory, "planted.sqlite"))
+        target = os.path.join(directory, "target")
+        open(target, "w").close()
+        os.symlink(target, os.path.join(directory, "planted.sqlite"))
+        assert planted.generation() is None
+        assert os.path.getsize(target) == 0
+
+        # the directory must not be writable by others
+        public = os.path.join(directory, "public")
+        os.mkdir(public)
+        os.chmod(public, 0o777)
+        with pytest.raises(ValueError):
+            SharedCache(os.path.join(public, "cache.sqlite"))
+        # missing one is created
+        SharedCache(os.path.join(directory, "private", "cache.sqlite"))
+        assert os.stat(os.path.join(directory, "private")).st_mode & 0o777 == 0o700
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_yin_element_children_index():
+    config = Config("network")
+    sections = [config.add(Section("s%d" % i, "interface")) for i in range(5)]
+    duplicate = Section("s2", "interface")
+    assert config.add(duplicate) is sections[2]
+    assert config.find_child("s3") is sections[3]
+    assert config.find_child("@interface[-1]") is sections[4]
+
+    config.remove(sections[1])
+    assert [section.name for section in config.children] == ["s0", "s2", "s3", "s4"]
+    assert config.find_child("s1") is None
+    with pytest.raises(ValueError):
+        config.remove(sections[1])
+
+
+def test_yin_element_cached_path():
+    uci = Uci()
+    network = uci.add(Config("network"))
+    section = Section("lan", "interface")
+    option = section.add(Option("proto", "dhcp"))
+    assert option.path == "lan.proto"
+
+    network.add(section)
+    assert option.path == "uci.network.lan.proto"
+    assert hash(option) == hash("uci.network.lan.proto")
+    network.remove(section)
+    assert option.path == "lan.proto"
+    uci.add(Config("wan")).add(section)
+    assert option.path == "uci.wan.lan.proto"
+
+
+def test_uci_lazy_materialization():
+    uci = Uci()
+    for name in ("dhcp", "firewall", "network"):
+        config = uci.add(Config(name))
+        for section_name in ("a", "b"):
+            config.add(Section(section_name, "type")).add(Option("enabled", "1"))
+    parsed = Uci.from_element(ET.fromstring(ET.tostring(uci.get_xml())))
+
+    assert parsed.find_child("network.b.enabled").value == "1"
+    # only the nodes on the path were created
+    assert sorted(parsed._children_by_key) == ["network"]
+    assert sorted(parsed.find_child("network")._children_by_key) == ["b"]
+
+    assert [config.name for config in parsed.children] == ["dhcp", "firewall", "network"]
+    assert [section.name for section in parsed.find_child("network").children] == ["a", "b"]
+    assert ET.tostring(parsed.get_xml()) == ET.tostring(uci.get_xml())
+
+
+def test_uci_diff():
+    current = Uci()
+    lan = current.add(Config("network")).add(Section("lan", "interface"))
+    lan.add(Option("proto", "static"))
+    lan.add(Option("ipaddr", "192.168.1.1"))
+    dns = lan.add(List("dns"))
+    dns.add(Value(0, "8.8.8.8"))
+
+    def desired_tree(ipaddr, dns_servers):
+        uci = Uci()
+        lan = uci.add(Config("network")).add(Section("lan", "interface"))
+        lan.add(Option("proto", "static"))
+        lan.add(Option("ipaddr", ipaddr))
+        lan.add_removal(Option("gateway", ""))
+        dns = List("dns")
+        for i, server in enumerate(dns_servers):
+            dns.add(Value(i, server))
+        lan.add_replace(dns)
+        return uci
+
+    # no-op save
+    assert uci_diff(current, desired_tree("192.168.1.1", ["8.8.8.8"])).children == []
+    # removal of the option is kept when the current tree could be incomplete
+    changeset = uci_diff(current, desired_tree("192.168.1.1", ["8.8.8.8"]), ["network.wan"])
+    assert uci_paths(changeset.get_xml()) == ["network.lan.gateway"]
+
+    changeset = uci_diff(current, desired_tree("10.0.0.1", ["8.8.8.8", "1.1.1.1"]))
+    assert uci_paths(changeset.get_xml()) == ["network.lan.ipaddr", "network.lan.dns"]
+    assert changeset.find_child("network.lan.dns").operation == "replace"
+    assert [value.content for value in changeset.find_child("network.lan.dns").children] \
+        == ["8.8.8.8", "1.1.1.1"]
+
+    # options changed by a previous update are always sent
+    changeset = uci_diff(current, desired_tree("192.168.1.1", ["8.8.8.8"]),
+                         changed_paths=["network.lan.ipaddr"])
+    assert uci_paths(changeset.get_xml()) == ["network.lan.ipaddr"]
+
+
+def test_uci_file_reader():
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "firewall"), "w") as f:
+            f.write("\n".join([
+                "config defaults",
+                "\toption input 'ACCEPT' # comment",
+                "",
+                "config zone",
+                "\toption name lan",
+                "\tlist network 'lan'",
+                "\tlist network \"guest_\\\"turris\"",
+                "",
+                "config rule 'dhcp'",
+                "\toption src 'it'\\''s wan'",
+                "",
+                "config zone",
+                "\toption name '\xc5\xbe'",
+                "",
+                "config rule 'dhcp'",
+                "\toption proto 'udp'",
+                "",
+            ]))
+        reader = UciFileReader(directory)
+        store = UciStore(directory)
+        for filter_element in (None, filters.create_config_filter("firewall", "missing"),
+                               filters.create_uci_filter("firewall", "dhcp", "src")):
+            expected = Uci.from_element(store.to_element(filter_element))
+            assert ET.tostring(reader.get_uci(filter_element).get_xml()) \
+                == ET.tostring(expected.get_xml())
+        # both of them filter the options
+        assert uci_paths(store.to_element(
+            filters.create_uci_filter("firewall", "dhcp", "src"))) == ["firewall.dhcp.src"]
+        # duplicate sections are merged
+        rule = reader.get_uci().find_child("firewall.dhcp")
+        assert [option.name for option in rule.children] == ["src", "proto"]
+        zone = reader.get(None).find_child("uci.firewall.@zone[0]")
+        assert zone.anonymous
+        assert [value.content for value in zone.find_child("network").children] \
+            == ["lan", 'guest_"turris']
+
+        # the file is parsed again only when it's modified
+        assert reader.load("firewall") is reader.load("firewall")
+        with open(os.path.join(directory, "firewall"), "a") as f:
+            f.write("config rule\n\toption name 'new'\n")
+        assert reader.get_uci().find_child("firewall.@rule[-1].name").value == "new"
+
+        # files which are not in UTF-8 can't be parsed, they're read by Nuci then
+        with open(os.path.join(directory, "network"), "w") as f:
+            f.write("config interface 'lan'\n\toption name '\xe9'\n")
+        with pytest.raises(UciParseError):
+            reader.get_uci()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_uci_files_anonymous_names():
+    from foris.nuci import uci_files
+
+    # names generated by libuci built with signed and unsigned chars
+    sections = [
+        (1, "defaults", [("input", "ACCEPT"), ("syn_flood", "1")], "cfg01669b", "cfg01669b"),
+        (2, "zone", [("name", "lan"), ("network", ["lan"])], "cfg02b587", "cfg02b587"),
+        (3, "rule", [("name", "\xc5\xbeluva"), ("src", "wan")], "cfg03d187", "cfg037387"),
+        (12, "host", [("name", "caf\xc3\xa9"), ("mac", "00:11:22:33:44:55")],
+         "cfg0cc78b", "cfg0ce98b"),
+    ]
+    for index, type_, options, signed, unsigned in sections:
+        assert uci_files._anonymous_name(index, type_, options, signed_char=True) == signed
+        assert uci_files._anonymous_name(index, type_, options, signed_char=False) == unsigned
+
+    # sections with the same name are merged, the anonymous ones are numbered after that
+    parsed = uci_files.parse_uci("\n".join([
+        "config interface 'lan'",
+        "\toption proto 'dhcp'",
+        "config zone",
+        "\toption name 'x'",
+        "config alias 'lan'",
+        "\toption proto 'static'",
+        "\toption ipaddr '192.168.1.1'",
+        "config zone",
+        "\toption name '\xc5\xbe'",
+    ]))
+    assert parsed == [
+        ("lan", "alias", False, [("proto", "static"), ("ipaddr", "192.168.1.1")]),
+        ("cfg026a7a", "zone", True, [("name", "x")]),
+        ("cfg03a265" if uci_files.SIGNED_CHAR else "cfg03c465", "zone", True,
+         [("name", "\xc5\xbe")]),
+    ]
+
+
+def test_uci_snapshot():
+    uci = Uci()
+    firewall = uci.add(Config("firewall"))
+    zone = firewall.add(Section("cfg02dc81", "zone", anonymous=True))
+    zone.add(Option("name", u"\u017eluva"))
+    network = zone.add(List("network"))
+    network.add(Value(0, "lan"))
+    network.add(Value(1, "guest_turris"))
+    gaps = zone.add(List("gaps"))
+    gaps.add(Value(2, "x"))
+    firewall.add(Section("lang", None)).add(Option("lang", "cs"))
+
+    restored = snapshot.loads(snapshot.dumps(uci))
+    assert ET.tostring(restored.get_xml()) == ET.tostring(uci.get_xml())
+    assert restored.find_child("firewall.@zone[0]").anonymous
+    assert snapshot.digest(restored) == snapshot.digest(uci)
+
+    zone.find_child("name").value = u"zeluva"
+    assert snapshot.digest(restored) != snapshot.digest(uci)
+    config = snapshot.loads(snapshot.dumps(firewall))
+    assert isinstance(config, Config) and config.find_child("@zone[-1].name").value == "zeluva"
+    with pytest.raises(ValueError):
+        snapshot.loads("<uci/>")
+
+
+def test_anonymous_sections_index():
+    uci = Uci()
+    config = uci.add(Config("firewall"))
+    rules = [config.add(Section("cfg%04x" % i, "rule", anonymous=True)) for i in range(5)]
+    config.add(Section("lan", "zone"))
+    parsed = Uci.from_element(ET.fromstring(ET.tostring(uci.get_xml())))
+    assert parsed.find_child("firewall.@rule[3]").name == "cfg0003"
+    assert parsed.find_child("firewall.@rule[-1]").name == "cfg0004"
+    assert parsed.find_child("firewall.@zone[0]").name == "lan"
+    assert parsed.find_child("firewall.@rule[5]") is None
+    assert parsed.find_child("firewall.@redirect[0]") is None
+
+    # the index is kept up to date
+    assert config.find_child("@rule[-1]") is rules[-1]
+    new_rule = config.add(Section("cfg0005", "rule", anonymous=True))
+    assert config.find_child("@rule[-1]") is new_rule
+    config.remove(rules[0])
+    assert config.find_child("@rule[0]") is rules[1]
+    assert config.find_child("@rule[-1]") is new_rule
+    # removal by key - an equal section, not the indexed instance
+    config.remove(Section("cfg0001", "rule", anonymous=True))
+    assert config.find_child("@rule[0]") is rules[2]
+    assert rules[1].parent is None
+    parsed_firewall = parsed.find_child("firewall")
+    parsed_firewall.remove(Section("lan", "zone"))
+    assert parsed_firewall.find_child("@zone[0]") is None
+
+
+def test_uci_fork():
+    uci = Uci()
+    for name in ("firewall", "network"):
+        config = uci.add(Config(name))
+        for section_name in ("lan", "wan"):
+            section = config.add(Section(section_name, "interface"))
+            section.add(Option("proto", "dhcp"))
+    original = Uci.from_element(ET.fromstring(ET.tostring(uci.get_xml())))
+    original.find_child("firewall.lan.proto")
+    original.find_child("network.lan.proto")
+
+    # record the original nodes which are copied to the fork
+    forked = []
+    fork_method = YinElement.fork
+
+    def recording_fork(node):
+        forked.append(node)
+        return fork_method(node)
+
+    YinElement.fork = recording_fork
+    try:
+        fork = original.fork()
+        fork.find_child("network.lan.proto").value = "static"
+        fork.find_child("network.wan").add(Option("mtu", "1400"))
+        fork.find_child("network.lan").type = "alias"
+        assert original.find_child("network.lan.proto").value == "dhcp"
+        assert original.find_child("network.wan.mtu") is None
+        assert original.find_child("network.lan").type == "interface"
+        # only the accessed nodes are copied, firewall is shared with the original
+        # and network.wan is created by the fork from the same source
+        copied = [original.find_child(path) for path in (
+            "network", "network.lan", "network.lan.proto")]
+        assert forked == [original] + copied
+
+        del forked[:]
+        changeset = uci_diff(original, fork)
+        assert uci_paths(changeset.get_xml()) == ["network.lan.proto", "network.wan.mtu"]
+        assert changeset.find_child("network.lan").type == "alias"
+        # the diff didn't copy anything else
+        assert forked == []
+        assert uci_diff(original, original.fork()).children == []
+    finally:
+        YinElement.fork = fork_method
+
+
+def test_uci_fork_put():
+    uci = Uci()
+    section = uci.add(Config("network")).add(Section("lan", "interface"))
+    section.add(Option("proto", "dhcp"))
+    section.add(Option("ipaddr", "192.168.1.1"))
+    dns = section.add(List("dns"))
+    dns.add(Value(0, "8.8.8.8"))
+    origin = Uci.from_element(ET.fromstring(ET.tostring(uci.get_xml())))
+    # changed by someone else after the form was loaded
+    current = Uci.from_element(ET.fromstring(ET.tostring(uci.get_xml())))
+    current.find_child("network.lan.proto").value = "static"
+
+    fork = origin.fork()
+    lan = fork.find_child("network.lan")
+    lan.put(Option("ipaddr", "10.0.0.1"))
+    dns = List("dns")
+    dns.add(Value(0, "1.1.1.1"))
+    lan.add_replace(dns)
+    assert fork.find_child("network.lan.ipaddr").value == "10.0.0.1"
+    assert fork.find_child("network.lan.dns").operation == "replace"
+    assert origin.find_child("network.lan.ipaddr").value == "192.168.1.1"
+    assert origin.find_child("network.lan.dns").operation is None
+
+    # the untouched proto is not reverted
+    changeset = uci_diff(current, fork, origin=origin)
+    assert sorted(uci_paths(changeset.get_xml())) == ["network.lan.dns", "network.lan.ipaddr"]
+
+
+def _dhcp_config():
+    uci = Uci()
+    dhcp = uci.add(Config("dhcp"))
+    dhcp.add(Section("cfg01abcd", "dnsmasq", anonymous=True)).add(Option("domain", "lan"))
+    lan = dhcp.add(Section("lan", "dhcp"))
+    lan.add(Option("start", "100"))
+    lan.add(Option("limit", "150"))
+    dhcp.add(Section("host0", "host")).add(Option("ip", "192.168.1.10"))
+    return Uci.from_element(ET.fromstring(ET.tostring(uci.get_xml())))
+
+
+def test_uci_fork_diff_unknown_current():
+    origin = _dhcp_config()
+    fork = origin.fork()
+    fork.find_child("dhcp.lan").put(Option("start", "200"))
+    fork.find_child("dhcp.host0.ip")
+    # only the modified option is sent, not the whole forked tree
+    assert uci_paths(uci_diff(None, fork, origin=origin).get_xml()) == ["dhcp.lan.start"]
+
+
+def test_fork_lists():
+    from foris.nuci.modules.base import Data
+    from foris.nuci.modules.stats import Stats
+
+    def load():
+        data = Data()
+        zone = data.add(Uci()).add(Config("firewall")).add(Section("lan", "zone"))
+        zone.add(List("network")).add(Value(0, "lan"))
+        stats = data.add(Stats())
+        stats.data["interfaces"] = [{"name": "eth0"}]
+        return data, 10
+
+    nuci_cache = cache.NuciCache(ttls={"test": None})
+    fork = nuci_cache.get_or_load("data", ("test", ), load)
+    fork.find_child("uci.firewall.lan.network").add(Value(1, "guest"))
+    fork.find_child("stats").data["interfaces"].append({"name": "eth1"})
+    fork.find_child("stats").data["interfaces"][0]["name"] = "br-lan"
+
+    cached = nuci_cache.lookup("data")
+    assert [value.content for value in cached.find_child("uci.firewall.lan.network").children] \
+        == ["lan"]
+    assert cached.find_child("stats").data == {"interfaces": [{"name": "eth0"}]}
+
+
+def test_form_refetch_failure():
+    from foris import fapi
+    from foris.nuci import client, configurator
+    from foris.nuci.modules.base import Data
+
+    def unavailable(filter=None):
+        raise NuciUnavailableError("test")
+
+    fetched = Data()
+    fetched.add(_dhcp_config())
+    saved = client.get, client.get_fresh
+    client.get, client.get_fresh = lambda filter=None: fetched, unavailable
+    configurator.clean_updates()
+    try:
+        form = fapi.ForisForm("dhcp", {}, filter=filters.create_config_filter("dhcp"))
+
+        def form_cb(data):
+            uci = form.fork_config()
+            uci.find_child("dhcp.lan").put(Option("start", "200"))
+            return "edit_config", uci
+
+        form.add_callback(form_cb)
+        # the save fails rather than sending the whole (possibly outdated) configuration
+        with pytest.raises(NuciUnavailableError):
+            form.process_callbacks({})
+        assert configurator.config_updates == []
+    finally:
+        client.get, client.get_fresh = saved
+        configurator.clean_updates()
@@ -65,7 +65,8 @@ def contract_valid():
         return False
 
     from foris.core import nuci_cache
-    data = nuci_cache.get("foris.contract", 60 * 60)  # once per hour should be enought
+    # once per hour should be enought, the outdated value is refreshed in the background
+    data = nuci_cache.get("foris.contract", 60 * 60, max_stale=24 * 60 * 60)
     valid = data.find_child("foris.contract.valid")
 
     if not valid:  # valid record
@@ -161,8 +162,8 @@ class Lazy(object):
 
 
 def print_model(model):
-    import copy
-    toprint = copy.deepcopy(model.get_tree())
+    # get_tree() creates new elements, so they can be indented in place
+    toprint = model.get_tree()
     indent(toprint)
     data = ET.tostring(toprint)
     logger.debug(data)
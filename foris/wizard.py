@@ -18,7 +18,8 @@ from bottle import Bottle, template, request
 import bottle
 from ncclient.operations import RPCError, TimeoutExpiredError
 
-from .core import gettext_dummy as gettext, make_notification_title, ugettext as _
+from .core import gettext_dummy as gettext, make_notification_title, ugettext as _, \
+    LONG_NUCI_DEADLINE
 import logging
 from .config_handlers import BaseConfigHandler, PasswordHandler, RegionHandler, \
     WanHandler, TimeHandler, LanHandler, UpdaterEulaHandler, WifiHandler
@@ -158,10 +159,12 @@ class WizardStep2(WizardStepMixin, WanHandler):
         super(WizardStep2, self).__init__(hide_no_wan=True, *args, **kwargs)
 
     def render(self, **kwargs):
-        stats = client.get(filter=filters.stats).find_child("stats")
-        wan_if = stats.data['interfaces'].get(self.wan_ifname)
-        if not (wan_if and wan_if.get('is_up')):
-            messages.warning(_("WAN port has no link, your internet connection probably won't work."))
+        # link status is just a hint, skip it when Nuci is slow
+        stats = client.get_optional(filter=filters.stats)
+        if stats is not None:
+            wan_if = stats.find_child("stats").data['interfaces'].get(self.wan_ifname)
+            if not (wan_if and wan_if.get('is_up')):
+                messages.warning(_("WAN port has no link, your internet connection probably won't work."))
         return super(WizardStep2, self).render(**kwargs)
 
 
@@ -563,7 +566,9 @@ def skip():
 def init_app():
     app = Bottle()
     app.install(CSRFPlugin())
-    app.route("/step/<number:re:\d+>/ajax", method=['GET', 'POST'], name="wizard_ajax", callback=ajax)
+    # connection check and NTP sync take longer than the other actions
+    app.route("/step/<number:re:\d+>/ajax", method=['GET', 'POST'], name="wizard_ajax", callback=ajax,
+              nuci_deadline=LONG_NUCI_DEADLINE)
     app.route("/", name="wizard_index", callback=wizard)
     app.route("/step/<number:re:\d+>", name="wizard_step", callback=step)
     app.route("/step/<number:re:\d+>", method="POST", callback=step_post)